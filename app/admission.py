@@ -0,0 +1,90 @@
+"""Sharing and rationing of expensive computations across requests.
+
+Both classes are used from the event loop only, so their bookkeeping
+needs no locks.
+"""
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+
+class SectionBusy(Exception):
+    """Raised when a section already has as many computations as it may queue."""
+
+class SingleFlight:
+    """
+    Shares one in-flight computation among concurrent identical calls.
+
+    The first call for a key starts the computation, and calls made with
+    the same key before it finishes await the same result instead of
+    starting their own. A caller that is cancelled does not cancel the
+    computation other callers are waiting on.
+
+    calls: Tasks of the computations in flight, by key
+    shared: Number of calls answered by another call's computation
+    """
+    def __init__(self):
+        self.calls = {}
+        self.shared = 0
+
+    async def run(self, key, start):
+        """Await the computation for key, calling start() to begin it if needed.
+
+        start returns the awaitable that computes the result.
+        """
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(start())
+            self.calls[key] = task
+            task.add_done_callback(functools.partial(self._finish, key))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        """Forget a finished computation, so later calls recompute."""
+        if self.calls.get(key) is task:
+            del self.calls[key]
+
+class SectionAdmission:
+    """
+    Caps the executor workers any one section may occupy.
+
+    Each section may run 'limit' computations at once and queue
+    'queueLimit' more; anything beyond that raises SectionBusy, so one
+    huge class waits on its own slots instead of filling the executor
+    and the queue in front of every other section.
+
+    executor: Executor that runs the computations
+    limit: Computations of one section running at once
+    queueLimit: Computations of one section waiting for a slot
+    """
+    def __init__(self, executor, limit : int, queueLimit : int):
+        self.executor = executor
+        self.limit = limit
+        self.queueLimit = queueLimit
+        self.sections = {}
+        self.rejected = 0
+
+    async def run(self, passcode : str, function, *args):
+        """Run function(*args) on the executor within the section's slots."""
+        async with self.slot(passcode):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(function, *args))
+
+    @asynccontextmanager
+    async def slot(self, passcode : str):
+        """Hold one of the section's slots, for computations run elsewhere."""
+        entry = self.sections.get(passcode)
+        if entry is None:
+            entry = self.sections[passcode] = [asyncio.Semaphore(self.limit), 0]
+        if entry[1] >= self.limit + self.queueLimit:
+            self.rejected += 1
+            raise SectionBusy(passcode)
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.sections[passcode]
@@ -0,0 +1,86 @@
+"""Compression and long-lived caching of pages and static assets."""
+import hashlib
+import os
+from urllib.parse import parse_qs
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, IdentityResponder
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+class HashedStaticFiles(StaticFiles):
+    """
+    StaticFiles whose URLs carry a hash of the file's content.
+
+    url() appends the hash as ?v=..., so the URL of a file changes
+    whenever the file does. Requests carrying the current hash are served
+    with a year-long immutable Cache-Control, and any other request must
+    revalidate through the ETag StaticFiles already sends.
+
+    prefix: Path the files are mounted at
+    """
+    def __init__(self, prefix : str, directory : str):
+        super().__init__(directory=directory)
+        self.prefix = prefix
+        self.hashes = {}
+
+    def url(self, path : str):
+        """Retrieve the content-hashed URL of a file."""
+        return f"{self.prefix}/{path}?v={self.content_hash(path)}"
+
+    def content_hash(self, path : str):
+        """Hash of a file's content, recomputed only when the file changes."""
+        fullPath = os.path.join(self.directory, path)
+        modified = os.stat(fullPath).st_mtime_ns
+        cached = self.hashes.get(path)
+        if cached is None or cached[0] != modified:
+            with open(fullPath, "rb") as file:
+                cached = (modified, hashlib.sha256(file.read()).hexdigest()[:12])
+            self.hashes[path] = cached
+        return cached[1]
+
+    async def get_response(self, path : str, scope):
+        response = await super().get_response(path, scope)
+        version = parse_qs(scope["query_string"].decode()).get("v")
+        if response.status_code in (200, 304) and version == [self.content_hash(path)]:
+            response.headers["Cache-Control"] = IMMUTABLE
+        else:
+            response.headers["Cache-Control"] = REVALIDATE
+        return response
+
+class BrotliResponder(IdentityResponder):
+    """Brotli counterpart of Starlette's GZipResponder."""
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size : int, quality : int = 5):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def apply_compression(self, body : bytes, *, more_body : bool):
+        body = self.compressor.process(body)
+        if more_body:
+            return body + self.compressor.flush()
+        return body + self.compressor.finish()
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compresses responses with brotli, or gzip for clients without it.
+
+    Brotli is only used when the brotli package is installed. Event
+    streams are never compressed, so events are not held back in a
+    compressor's buffer.
+    """
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and brotli is not None:
+            acceptEncoding = Headers(scope=scope).get("accept-encoding", "")
+            codings = [coding.split(";")[0].strip() for coding in acceptEncoding.split(",")]
+            if "br" in codings:
+                await BrotliResponder(self.app, self.minimum_size)(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
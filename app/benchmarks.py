@@ -0,0 +1,337 @@
+"""Benchmarks of the hot paths of the API.
+
+Run from the app directory:
+    python benchmarks.py
+    python benchmarks.py --save-baseline
+
+The matching benchmarks and the time to first request after a restart
+are compared against BASELINE_PATH, and the run exits with status 1 if
+any of them got slower than the baseline by more than the tolerance.
+--save-baseline records the current results instead.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from pathlib import Path
+from fastapi.encoders import jsonable_encoder
+from schedules import ALLPOSSIBLETIMES, SLOT_HOURS, to_mask, from_mask, count_slots, longest_run
+from similarity import SectionMatrix
+from ranking import schedule_intersection
+from serialization import SlotMask, encode_json
+from records import StudentRecord, SectionRecord
+from passcodes import create_passcode
+from snapshot import Snapshot, encode_section, write_snapshot
+
+APP_DIR = Path(__file__).resolve().parent
+BASELINE_PATH = APP_DIR/"benchmarks_baseline.json"
+SIZES = [10, 100, 1000, 10000]
+TOLERANCE = 0.5
+COLD_START_SCRIPT = """
+import time
+started = time.perf_counter()
+import asyncio, json, sys
+import httpx
+import main
+imported = time.perf_counter()
+
+async def first_request():
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://coldstart") as client:
+        return await client.get(sys.argv[1])
+
+response = asyncio.run(first_request())
+answered = time.perf_counter()
+try:
+    import resource
+    peakBytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+except ImportError:
+    peakBytes = 0
+print(json.dumps({"importSeconds": imported - started, "requestSeconds": answered - imported,
+                  "status": response.status_code, "peakBytes": peakBytes}))
+"""
+
+def random_masks(count : int, seed : int = 0):
+    """Random schedule bitmasks, each with about a third of the week free."""
+    rng = random.Random(seed)
+    slots = [i for i in ALLPOSSIBLETIMES if i]
+    return [to_mask(rng.sample(slots, rng.randint(20, 80))) for i in range(count)]
+
+def synthetic_section(students : int, density : float = 1 / 3, clusters : int = 8,
+                      spread : float = 0.2, seed : int = 0):
+    """Generate a section whose schedules cluster around a few shared ones.
+
+    density: Fraction of the week's slots free in each schedule
+    clusters: Number of base schedules students are drawn around, or 0
+              for schedules drawn independently
+    spread: Fraction of a base schedule's slots each student swaps for
+            other slots
+    """
+    rng = random.Random(seed)
+    slots = [i for i in ALLPOSSIBLETIMES if i]
+    count = max(1, round(density * len(slots)))
+    bases = [rng.sample(slots, count) for i in range(clusters)]
+    studentList = []
+    for i in range(students):
+        if bases:
+            schedule = set(rng.choice(bases))
+            swapped = round(spread * count)
+            schedule.difference_update(rng.sample(sorted(schedule), swapped))
+            schedule.update(rng.sample(slots, swapped))
+        else:
+            schedule = rng.sample(slots, count)
+        studentList.append(StudentRecord(f"Student {i}", f"contact {i}", to_mask(schedule)))
+    return SectionRecord("Benchmark", "", students, studentList)
+
+def default_encode(content):
+    """Encode content the way FastAPI does for a handler returning a dict."""
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode()
+
+def time_per_call(function, repeat : int = 5):
+    """Best time in microseconds of one call of function."""
+    number, total = timeit.Timer(function).autorange()
+    best = min(timeit.repeat(function, number=number, repeat=repeat))
+    return best / number * 1e6
+
+def bench_serialization(students : int = 500):
+    """Compare FastAPI's default encoding with serialization.encode_json.
+
+    Returns a dict from response name to (defaultMicroseconds, fastMicroseconds).
+    """
+    masks = random_masks(students)
+    matrix = SectionMatrix(masks)
+    ranking = {"data":[(f"Student {i}", float(i % 40) * SLOT_HOURS, f"contact {i}", i)
+                       for i in range(students)], "total":students}
+    intersections = {"data":{i: {"intersections":masks[0] & mask,
+                                 "studentADiff":masks[0] & ~mask,
+                                 "studentBDiff":mask & ~masks[0]}
+                             for i, mask in enumerate(masks[1:], 1)}}
+    setIntersections = {"data":{i: {key: from_mask(value) for key, value in item.items()}
+                                for i, item in intersections["data"].items()}}
+    maskIntersections = {"data":{i: {key: SlotMask(value) for key, value in item.items()}
+                                 for i, item in intersections["data"].items()}}
+    cumulative = matrix.cumulative * SLOT_HOURS
+    cases = {
+        "ranking": (lambda: default_encode(ranking), lambda: encode_json(ranking)),
+        "schedule_intersections": (lambda: default_encode(setIntersections),
+                                   lambda: encode_json(maskIntersections)),
+        "similarity_matrix": (lambda: default_encode({"cumulative": cumulative.tolist()}),
+                              lambda: encode_json({"cumulative": cumulative})),
+    }
+    return {name: (time_per_call(default), time_per_call(fast))
+            for name, (default, fast) in cases.items()}
+
+def peak_memory(function):
+    """Peak bytes allocated by Python during one call of function."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def similar_hours_cumulative(currentStudent: StudentRecord, currentSection: SectionRecord):
+    """Retrieve total similar schedule between a student and their classmates.
+
+    Returns a list 'similarHours' of tuples containing: 
+    (classmateDisplayName, classmateSimilarHours, classmateContactDetails, student_id)
+    """
+    similarHours = []
+    rankingList = currentSection.studentList
+    studentMask = currentStudent.scheduleMask
+    student_id = 0
+    for student in rankingList:
+        if student != currentStudent:
+            similarMask = studentMask & student.scheduleMask
+            similarHours.append((student.displayName,
+                                 count_slots(similarMask) * currentSection.registry.slotHours,
+                                 student.contactDetails, student_id))
+        student_id += 1
+    return similarHours
+
+def similar_hours_consecutive(currentStudent: StudentRecord, currentSection: SectionRecord):
+    """Retrieve length of longest consecutive similar time between a student and
+    their classmates.
+
+    Returns a list 'similarHours' of tuples containing: 
+    (classmateDisplayName, classmateConsecutiveHours, classmateContactDetails, student_id)
+    """
+    allStudentsChunks = []
+    rankingList = currentSection.studentList
+    studentMask = currentStudent.scheduleMask
+    student_id = 0
+    for student in rankingList:
+        if student != currentStudent:
+            similarMask = studentMask & student.scheduleMask
+            maxLength = longest_run(similarMask) * currentSection.registry.slotHours
+            allStudentsChunks.append((student.displayName, maxLength,
+                                      student.contactDetails, student_id))
+        student_id += 1
+    return allStudentsChunks
+
+def merge(L1, L2):
+    """Merge two lists sorted by descending score.
+
+    Walks both lists by index, since popping from the front of a list
+    shifts every remaining item.
+    """
+    mergedList = []
+    i = j = 0
+    while i < len(L1) and j < len(L2):
+        if L1[i][1] > L2[j][1]:
+            mergedList.append(L1[i])
+            i += 1
+        else:
+            mergedList.append(L2[j])
+            j += 1
+    mergedList.extend(L2[j:])
+    mergedList.extend(L1[i:])
+    return mergedList
+
+def merge_sort(L):
+    """Merge sort implementation."""
+    if len(L) <= 1:
+        return L
+    else:
+        middleIndex = len(L) // 2
+        firstHalf = L[:middleIndex]
+        secondHalf = L[middleIndex:]
+        firstHalf = merge_sort(firstHalf)
+        secondHalf = merge_sort(secondHalf)
+        return merge(firstHalf, secondHalf)
+
+def bench_matching(sizes = SIZES, repeat : int = 3, **sectionOptions):
+    """Time the matching algorithms on synthetic sections of each size.
+
+    similar_hours_cumulative, similar_hours_consecutive and merge_sort
+    are the original per-classmate implementations, kept here as the
+    baseline the vectorized ranking is measured against.
+
+    sectionOptions are passed on to synthetic_section. Returns a dict
+    from "name@size" to {"opsPerSecond", "peakBytes"}.
+    """
+    cases = {"create_passcode@1": create_passcode}
+    for size in sizes:
+        section = synthetic_section(size, **sectionOptions)
+        student = section.studentList[0]
+        ranking = similar_hours_cumulative(student, section)
+        cases.update({
+            f"similar_hours_cumulative@{size}":
+                lambda student=student, section=section:
+                    similar_hours_cumulative(student, section),
+            f"similar_hours_consecutive@{size}":
+                lambda student=student, section=section:
+                    similar_hours_consecutive(student, section),
+            f"merge_sort@{size}": lambda ranking=ranking: merge_sort(ranking),
+            f"schedule_intersection@{size}":
+                lambda student=student, section=section:
+                    [schedule_intersection(student.scheduleMask, i.scheduleMask)
+                     for i in section.studentList],
+        })
+    return {name: {"opsPerSecond": 1e6 / time_per_call(function, repeat),
+                   "peakBytes": peak_memory(function)}
+            for name, function in cases.items()}
+
+def bench_cold_start(sections : int = 1000, students : int = 100, repeat : int = 3):
+    """Time a fresh process from importing main to answering its first request.
+
+    The process restores a snapshot of synthetic sections, so the time
+    covers module imports, Jinja2Templates and store setup, and decoding
+    the one section the request reads. Decoding every section of the
+    snapshot up front is timed for comparison. Returns a dict with the
+    best of repeat runs.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sections.snapshot")
+        now = time.time()
+        write_snapshot(path, [(f"S{i:05d}", now,
+                               encode_section(synthetic_section(students, seed=i)))
+                              for i in range(sections)])
+        environment = dict(os.environ, GROUPME_STORAGE="memory", GROUPME_SNAPSHOT=path)
+        runs = []
+        for i in range(repeat):
+            output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT,
+                                     "/api/S00000/0/view_schedule"],
+                                    cwd=APP_DIR, env=environment, capture_output=True,
+                                    text=True, check=True).stdout
+            runs.append(json.loads(output))
+        started = time.perf_counter()
+        snapshot = Snapshot(path)
+        for passcode, lastAccess in snapshot.entries():
+            snapshot.load(passcode)
+        eagerSeconds = time.perf_counter() - started
+        snapshot.close()
+        snapshotBytes = os.path.getsize(path)
+    best = min(runs, key=lambda run: run["importSeconds"] + run["requestSeconds"])
+    return {"firstRequestSeconds": best["importSeconds"] + best["requestSeconds"],
+            "importSeconds": best["importSeconds"], "requestSeconds": best["requestSeconds"],
+            "status": best["status"], "peakBytes": best["peakBytes"],
+            "eagerRestoreSeconds": eagerSeconds, "snapshotBytes": snapshotBytes}
+
+def compare_baseline(results, baseline, tolerance : float = TOLERANCE):
+    """Names of the benchmarks more than tolerance slower than the baseline."""
+    return [name for name, result in results.items() if name in baseline
+            and result["opsPerSecond"] < baseline[name]["opsPerSecond"] * (1 - tolerance)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--density", type=float, default=1 / 3)
+    parser.add_argument("--clusters", type=int, default=8)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--skip-serialization", action="store_true")
+    parser.add_argument("--cold-start-sections", type=int, default=1000)
+    parser.add_argument("--skip-cold-start", action="store_true")
+    args = parser.parse_args()
+
+    if not args.skip_serialization:
+        for name, (default, fast) in bench_serialization().items():
+            print(f"{name:24} default {default:10.1f} us   fast {fast:10.1f} us   "
+                  f"x{default / fast:.1f}")
+        print()
+
+    results = bench_matching(args.sizes, density=args.density, clusters=args.clusters)
+    if not args.skip_cold_start:
+        coldStart = bench_cold_start(args.cold_start_sections)
+        print(f"time to first request    {coldStart['firstRequestSeconds'] * 1000:8.1f} ms "
+              f"(import {coldStart['importSeconds'] * 1000:.1f} ms, "
+              f"request {coldStart['requestSeconds'] * 1000:.1f} ms, "
+              f"status {coldStart['status']})")
+        print(f"eager restore of all     {coldStart['eagerRestoreSeconds'] * 1000:8.1f} ms "
+              f"({args.cold_start_sections} sections, "
+              f"{coldStart['snapshotBytes'] / 1024:,.1f} KiB snapshot)\n")
+        results[f"time_to_first_request@{args.cold_start_sections}"] = {
+            "opsPerSecond": 1 / coldStart["firstRequestSeconds"],
+            "peakBytes": coldStart["peakBytes"]}
+    baseline = {}
+    if BASELINE_PATH.exists() and not args.save_baseline:
+        baseline = json.loads(BASELINE_PATH.read_text())
+    for name, result in results.items():
+        line = (f"{name:34} {result['opsPerSecond']:14,.1f} ops/s "
+                f"{result['peakBytes'] / 1024:10,.1f} KiB")
+        if name in baseline:
+            change = result["opsPerSecond"] / baseline[name]["opsPerSecond"] - 1
+            line += f"   {change:+7.1%} vs baseline"
+        print(line)
+
+    if args.save_baseline:
+        BASELINE_PATH.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\nSaved baseline to {BASELINE_PATH.name}")
+        return 0
+    regressions = compare_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\nSlower than baseline by more than {args.tolerance:.0%}: "
+              + ", ".join(regressions))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import asyncio
+import itertools
+import json
+from collections import deque
+
+HISTORY_SIZE = 256
+KEEPALIVE_SECONDS = 15
+
+class SectionChannel:
+    """
+    Recent events of one section and the clients listening to them
+
+    history: (eventId, frame) pairs of the latest events, oldest first
+    floorId: Newest event id no longer in history; subscribers that have
+             not seen past it missed events and must refetch
+    changed: Set, then replaced, whenever an event is appended
+    """
+    def __init__(self, floorId : int):
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.floorId = floorId
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+
+class EventBroker:
+    """
+    Fans section events out to Server-Sent Events clients.
+
+    Events are serialized once into an SSE frame and appended to their
+    section's bounded history, then every subscriber of the section is
+    woken and reads the same frames from that history. Publishing costs
+    the same whether one client or hundreds are listening, and a client
+    that falls behind only replays what it missed. Clients that fall
+    further behind than the history get a 'reset' event and refetch.
+
+    Events only reach clients connected to the same worker process.
+    """
+    def __init__(self):
+        self.channels = {}
+        self.eventIds = itertools.count(1)
+        self.lastId = 0
+        self.loop = None
+
+    def has_subscribers(self, passcode : str):
+        """Verify if any client listens to a section."""
+        return passcode in self.channels
+
+    def publish(self, passcode : str, event : str, data : dict):
+        """Send an event to every client listening to a section.
+
+        Safe to call from the worker threads running sync handlers, which
+        call it while holding the section's lock so events keep their order.
+        """
+        loop = self.loop
+        if loop is None or not self.has_subscribers(passcode):
+            return
+        payload = json.dumps(data, separators=(",", ":"))
+        loop.call_soon_threadsafe(self._append, passcode, event, payload)
+
+    async def subscribe(self, passcode : str, lastEventId : int | None = None):
+        """Yield SSE frames of a section's events until the client disconnects.
+
+        A reconnecting client passes the Last-Event-ID it saw, and is
+        replayed every event after it that is still in the history.
+        """
+        self.loop = asyncio.get_running_loop()
+        channel = self.channels.get(passcode)
+        if channel is None:
+            channel = self.channels[passcode] = SectionChannel(self.lastId)
+        channel.subscribers += 1
+        lastSeen = self.lastId if lastEventId is None else lastEventId
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                changed = channel.changed
+                if lastSeen < channel.floorId:
+                    lastSeen = self.lastId
+                    yield f"id: {lastSeen}\nevent: reset\ndata: {{}}\n\n".encode()
+                    continue
+                frames = [frame for eventId, frame in channel.history if eventId > lastSeen]
+                if frames:
+                    lastSeen = channel.history[-1][0]
+                    yield b"".join(frames)
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            channel.subscribers -= 1
+            if not channel.subscribers:
+                del self.channels[passcode]
+
+    def _append(self, passcode : str, event : str, payload : str):
+        """Append an event to a section's history and wake its subscribers."""
+        channel = self.channels.get(passcode)
+        eventId = self.lastId = next(self.eventIds)
+        if channel is None:
+            return
+        if len(channel.history) == channel.history.maxlen:
+            channel.floorId = channel.history[0][0]
+        channel.history.append((eventId, f"id: {eventId}\nevent: {event}\ndata: {payload}\n\n".encode()))
+        channel.changed.set()
+        channel.changed = asyncio.Event()
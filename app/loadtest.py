@@ -0,0 +1,175 @@
+"""Replays traffic traces against the API and reports latency per route.
+
+Run from the app directory:
+    python loadtest.py                          # synthetic lecture-start spike
+    python loadtest.py --trace traffic.jsonl    # recorded trace
+    python loadtest.py --url http://127.0.0.1:8000
+
+Without --url, requests go straight to main.app in-process, with
+sections kept in memory, so no server or database is needed.
+
+A trace is JSONL with one request per line:
+    {"phase": 1, "method": "POST", "path": "/api/{s0[passcode]}/create_student",
+     "json": {...}, "save": "s0u3"}
+Requests of a phase are sent concurrently, and a phase starts once the
+previous one has finished. Paths are formatted with the responses saved
+by earlier requests under their "save" names, so a trace can refer to
+passcodes and student ids that only exist once it runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from itertools import groupby
+import httpx
+from schedules import ALLPOSSIBLETIMES
+
+PLACEHOLDER = re.compile(r"\{\w+\[(\w+)\]\}")
+
+def synthetic_trace(sections : int = 5, students : int = 200, updates : int = 2,
+                    seed : int = 0):
+    """Generate the requests of a lecture-start traffic spike.
+
+    Sections are created, every student joins, each student saves
+    their schedule updates times, then every student ranks their
+    classmates and compares schedules with one of them.
+    """
+    rng = random.Random(seed)
+    slots = [i for i in ALLPOSSIBLETIMES if i]
+    trace = []
+    for section in range(sections):
+        trace.append({"phase": 0, "method": "POST", "path": "/api/create_section",
+                      "json": {"sectionName": f"Section {section}", "maxSize": students},
+                      "save": f"s{section}"})
+    for section in range(sections):
+        for student in range(students):
+            trace.append({"phase": 1, "method": "POST",
+                          "path": f"/api/{{s{section}[passcode]}}/create_student",
+                          "json": {"displayName": f"Student {student}",
+                                   "contactDetails": f"student{student}@example.com"},
+                          "save": f"s{section}u{student}"})
+    for update in range(updates):
+        for section in range(sections):
+            for student in range(students):
+                trace.append({"phase": 2 + update, "method": "POST",
+                              "path": f"/api/{{s{section}[passcode]}}/"
+                                      f"{{s{section}u{student}[student_id]}}/update_schedule",
+                              "json": {"schedule": rng.sample(slots, rng.randint(10, 60))}})
+    for section in range(sections):
+        for student in range(students):
+            prefix = f"/api/{{s{section}[passcode]}}/{{s{section}u{student}[student_id]}}"
+            classmate = rng.randrange(students)
+            trace.append({"phase": 2 + updates, "method": "GET",
+                          "path": f"{prefix}/group_cumulative"})
+            trace.append({"phase": 2 + updates, "method": "GET",
+                          "path": f"{prefix}/schedule_intersect/"
+                                  f"{{s{section}u{classmate}[student_id]}}"})
+    return trace
+
+def route_name(request):
+    """Route of a trace request, with its placeholders named by field."""
+    path = PLACEHOLDER.sub(r"{\1}", request["path"])
+    return f"{request['method']} {path}"
+
+def percentile(values, fraction : float):
+    """Nearest-rank percentile of a sorted list."""
+    return values[max(0, min(len(values) - 1, round(fraction * len(values)) - 1))]
+
+async def replay(client : httpx.AsyncClient, trace, concurrency : int = 64):
+    """Send every request of a trace, phase by phase.
+
+    Returns a dict from route to {"latencies", "errors", "start", "end"},
+    where latencies are in seconds.
+    """
+    saved = {}
+    stats = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(request):
+        route = stats.setdefault(route_name(request), {"latencies": [], "errors": 0,
+                                                       "start": None, "end": None})
+        async with semaphore:
+            try:
+                path = request["path"].format_map(saved)
+            except (KeyError, TypeError):
+                route["errors"] += 1
+                return
+            started = time.perf_counter()
+            response = await client.request(request["method"], path, json=request.get("json"))
+            finished = time.perf_counter()
+        route["latencies"].append(finished - started)
+        route["start"] = started if route["start"] is None else min(route["start"], started)
+        route["end"] = finished if route["end"] is None else max(route["end"], finished)
+        if response.status_code >= 400:
+            route["errors"] += 1
+        elif "save" in request:
+            saved[request["save"]] = response.json()
+
+    for phase, requests in groupby(trace, key=lambda request: request.get("phase", 0)):
+        await asyncio.gather(*[send(request) for request in requests])
+    return stats
+
+def summarize(stats):
+    """Latency percentiles in milliseconds and throughput of every route."""
+    summary = {}
+    for route, routeStats in stats.items():
+        latencies = sorted(routeStats["latencies"])
+        if not latencies:
+            summary[route] = {"count": 0, "errors": routeStats["errors"]}
+            continue
+        elapsed = routeStats["end"] - routeStats["start"]
+        summary[route] = {"count": len(latencies), "errors": routeStats["errors"],
+                          "p50": percentile(latencies, 0.50) * 1000,
+                          "p95": percentile(latencies, 0.95) * 1000,
+                          "p99": percentile(latencies, 0.99) * 1000,
+                          "perSecond": len(latencies) / elapsed if elapsed else 0.0}
+    return summary
+
+async def run(trace, url : str | None = None, concurrency : int = 64):
+    """Replay a trace against a server at url, or in-process against main.app."""
+    if url is None:
+        os.environ.setdefault("GROUPME_STORAGE", "memory")
+        from main import app
+        transport = httpx.ASGITransport(app=app)
+        url = "http://loadtest"
+    else:
+        transport = None
+    async with httpx.AsyncClient(transport=transport, base_url=url, timeout=60) as client:
+        return summarize(await replay(client, trace, concurrency))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trace", help="JSONL trace to replay instead of a synthetic one")
+    parser.add_argument("--write-trace", help="save the synthetic trace to this file and exit")
+    parser.add_argument("--url", help="server to load instead of main.app in-process")
+    parser.add_argument("--sections", type=int, default=5)
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace) as file:
+            trace = [json.loads(line) for line in file if line.strip()]
+    else:
+        trace = synthetic_trace(args.sections, args.students, args.updates)
+    if args.write_trace:
+        with open(args.write_trace, "w") as file:
+            file.writelines(json.dumps(request) + "\n" for request in trace)
+        return
+
+    summary = asyncio.run(run(trace, args.url, args.concurrency))
+    print(f"{'route':66} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'req/s':>9}")
+    for route, item in summary.items():
+        if item["count"]:
+            print(f"{route:66} {item['count']:6} {item['errors']:6} {item['p50']:8.2f} "
+                  f"{item['p95']:8.2f} {item['p99']:8.2f} {item['perSecond']:9.1f}")
+        else:
+            print(f"{route:66} {0:6} {item['errors']:6}")
+
+if __name__ == "__main__":
+    main()
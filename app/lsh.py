@@ -0,0 +1,102 @@
+import heapq
+import sys
+import numpy as np
+from schedules import ALLPOSSIBLETIMES, mask_slots
+
+SLOT_COUNT = len(ALLPOSSIBLETIMES)
+
+class ScheduleIndex:
+    """
+    MinHash LSH index over the schedules of a section
+
+    Each schedule is summarised by bands * rows MinHash values, and every
+    band of rows values is a bucket key. Classmates sharing at least one
+    bucket with a schedule are its candidates, which are then scored
+    exactly, so a top-k query only touches the few classmates whose
+    schedules resemble it instead of the whole section.
+
+    bands: Number of buckets each schedule is filed under
+    rows: MinHash values per bucket key; more rows mean fewer candidates
+    exactFallback: Scan the whole section when there are fewer than k
+                   candidates, so a query never returns short
+    slotCount: Bits of the section's schedule grid, separators included
+    """
+    def __init__(self, masks, bands : int = 20, rows : int = 3, seed : int = 0,
+                 exactFallback : bool = True, slotCount : int = SLOT_COUNT):
+        self.bands = bands
+        self.rows = rows
+        self.exactFallback = exactFallback
+        rng = np.random.default_rng(seed)
+        self.ranks = np.array([rng.permutation(slotCount) for i in range(bands * rows)])
+        self.buckets = [{} for i in range(bands)]
+        self.masks = []
+        self.keys = []
+        for mask in masks:
+            self.add_student(mask)
+
+    def add_student(self, mask : int):
+        """Append a student and file their schedule."""
+        self.masks.append(0)
+        self.keys.append(None)
+        self.update_student(len(self.masks) - 1, mask)
+
+    def update_student(self, student_id : int, mask : int):
+        """Refile a student under the buckets of their new schedule."""
+        oldKeys = self.keys[student_id]
+        if oldKeys is not None:
+            for band, key in enumerate(oldKeys):
+                bucket = self.buckets[band][key]
+                bucket.discard(student_id)
+                if not bucket:
+                    del self.buckets[band][key]
+        keys = self.bucket_keys(mask)
+        if keys is not None:
+            for band, key in enumerate(keys):
+                self.buckets[band].setdefault(key, set()).add(student_id)
+        self.masks[student_id] = mask
+        self.keys[student_id] = keys
+
+    @property
+    def nbytes(self):
+        """Estimate the bytes held by the index."""
+        total = self.ranks.nbytes + sys.getsizeof(self.masks) + sys.getsizeof(self.keys)
+        total += sum(sys.getsizeof(keys) for keys in self.keys if keys is not None)
+        for bucket in self.buckets:
+            total += sys.getsizeof(bucket) + sum(sys.getsizeof(i) for i in bucket.values())
+        return total
+
+    def bucket_keys(self, mask : int):
+        """Bucket key of every band for a schedule, or None if it is empty."""
+        if not mask:
+            return None
+        minHashes = self.ranks[:, mask_slots(mask)].min(axis=1).tolist()
+        return [tuple(minHashes[band * self.rows:(band + 1) * self.rows])
+                for band in range(self.bands)]
+
+    def candidates(self, mask : int):
+        """Students sharing at least one bucket with a schedule."""
+        candidateIds = set()
+        keys = self.bucket_keys(mask)
+        if keys is not None:
+            for band, key in enumerate(keys):
+                candidateIds |= self.buckets[band].get(key, set())
+        return candidateIds
+
+    def top_k(self, mask : int, k : int, metric, exclude : int | None = None,
+              exact : bool = False):
+        """Retrieve the k students whose schedules score highest against a mask.
+
+        Scores are metric(mask & classmateMask), such as count_slots or
+        longest_run. Ties are broken by lowest student id.
+
+        Returns the number of students scored, and a list of
+        (score, student_id) tuples, highest score first.
+        """
+        if exact:
+            candidateIds = range(len(self.masks))
+        else:
+            candidateIds = self.candidates(mask)
+        scored = [(-metric(mask & self.masks[i]), i) for i in candidateIds if i != exclude]
+        if not exact and self.exactFallback and len(scored) < k:
+            return self.top_k(mask, k, metric, exclude, exact=True)
+        return len(scored), [(-score, i) for score, i in heapq.nsmallest(k, scored)]
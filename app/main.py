@@ -1,70 +1,250 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, Query
+from fastapi.responses import (HTMLResponse, RedirectResponse, StreamingResponse, Response,
+                               JSONResponse)
 from fastapi.templating import Jinja2Templates
 from fastapi.exceptions import HTTPException, RequestValidationError
-from passcodes import create_passcode
+from starlette.concurrency import run_in_threadpool
+from passcodes import allocate_passcode
 from models import Student, Section, ScheduleUpdate
-import uvicorn
+from records import StudentRecord, SectionRecord, record_bytes
+from schedules import DEFAULT_REGISTRY, SlotRegistry, count_slots, longest_run
+from similarity import SectionMatrix, row_scores
+from ranking import top_ranked, schedule_intersection, schedule_intersections, parse_classmate_ids
+from lsh import ScheduleIndex
+from storage import open_store
+from partition import METRICS, partition_section_async, shutdown_pool
+from events import EventBroker
+from serialization import slot_mask_type, fast_response, encode_content, accepts_msgpack
+from roster import read_roster, export_ndjson, export_csv, NDJSON_TYPE, CSV_TYPE
+from assets import HashedStaticFiles, CompressionMiddleware
+from metrics import (MetricsMiddleware, SamplingProfiler, CONTENT_TYPE, requestSeconds,
+                     stageSeconds, timed, gauge, section_sizes_exposition)
+from admission import SingleFlight, SectionAdmission, SectionBusy
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import math
+import os
 from pathlib import Path
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app : FastAPI):
+    """Sweep idle sections while serving, and flush pending writes on shutdown."""
+    sweeper = asyncio.create_task(sweep_periodically())
+    yield
+    sweeper.cancel()
+    profiler.stop()
+    rankingExecutor.shutdown()
+    shutdown_pool()
+    db.close()
+
+app = FastAPI(lifespan=lifespan)
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR/"templates"/"logo"
+ASSETS_DIR = BASE_DIR/"static"
+STORAGE = os.environ.get("GROUPME_STORAGE", str(BASE_DIR/"groupme.db"))
+SHARED_STORAGE = os.environ.get("GROUPME_SHARED") == "1"
+SNAPSHOT = os.environ.get("GROUPME_SNAPSHOT")
+ANN_THRESHOLD = int(os.environ.get("GROUPME_ANN_THRESHOLD", 2000))
+SECTION_TTL = os.environ.get("GROUPME_SECTION_TTL_DAYS")
+SECTION_TTL = float(SECTION_TTL) * 86400 if SECTION_TTL else None
+MAX_RESIDENT = int(os.environ.get("GROUPME_MAX_SECTIONS", 1000))
+SWEEP_INTERVAL = 60
+PROFILER_ENABLED = os.environ.get("GROUPME_PROFILER") == "1"
+RANKING_WORKERS = int(os.environ.get("GROUPME_RANKING_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+SECTION_CONCURRENCY = int(os.environ.get("GROUPME_SECTION_CONCURRENCY",
+                                         max(1, RANKING_WORKERS // 4)))
+SECTION_QUEUE = int(os.environ.get("GROUPME_SECTION_QUEUE", 64))
 
-app.mount("/logo-assets", StaticFiles(directory=str(STATIC_DIR)), name="static")
+logos = HashedStaticFiles("/logo-assets", str(STATIC_DIR))
+assets = HashedStaticFiles("/assets", str(ASSETS_DIR))
+app.mount("/logo-assets", logos, name="static")
+app.mount("/assets", assets, name="assets")
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+app.add_middleware(MetricsMiddleware)
 templates = Jinja2Templates(directory=str(BASE_DIR/"templates"))
+templates.env.globals.update(logos=logos, assets=assets)
+templates.TemplateResponse = timed("render_template")(templates.TemplateResponse)
+
+logger = logging.getLogger(__name__)
 
-db = {}
+db = open_store(STORAGE, shared=SHARED_STORAGE, ttl=SECTION_TTL, maxResident=MAX_RESIDENT,
+                snapshot=SNAPSHOT)
+sectionMatrices = {}
+matrixCacheStats = {"hits": 0, "misses": 0, "updates": 0}
+sectionIndexes = {}
+broker = EventBroker()
+profiler = SamplingProfiler()
+rankingExecutor = ThreadPoolExecutor(RANKING_WORKERS, thread_name_prefix="ranking")
+rankingFlights = SingleFlight()
+admission = SectionAdmission(rankingExecutor, SECTION_CONCURRENCY, SECTION_QUEUE)
 
 @app.post("/api/create_section")
 def api_create_section(newSection : Section):
-    """Create a section and match it with a passcode."""
-    passcode = create_passcode()
-    if passcode not in db:
-        db[passcode] = newSection
+    """Create a section and match it with a passcode.
+
+    The section's students, if any, must only have slots of its grid.
+    """
+    try:
+        section = SectionRecord.from_model(newSection)
+    except ValueError:
+        return None
+    passcode = allocate_passcode(lambda passcode: db.add(passcode, section))
+    if passcode is not None:
         return {'passcode':passcode}
 
 @app.post("/api/{passcode}/create_student")
 def api_create_student(passcode : str, newStudent : Student):
-    """Create a student and match it with a student id."""
+    """Create a student and match it with a student id.
+
+    A schedule with slots that are not in the section's grid is rejected.
+    """
+    with db.transaction(passcode) as section:
+        if section is not None:
+            studentList = section.studentList
+            if section.maxSize > len(studentList):
+                student_id = len(studentList)
+                try:
+                    student = StudentRecord.from_model(newStudent, section.registry)
+                except ValueError:
+                    return None
+                studentList.append(student)
+                db.mark_dirty(passcode, student_id)
+                matrix = cached_section_matrix(passcode, section)
+                if matrix is not None:
+                    matrix.add_student(student.scheduleMask)
+                    matrixCacheStats["updates"] += 1
+                index = cached_section_index(passcode, section)
+                if index is not None:
+                    index.add_student(student.scheduleMask)
+                if broker.has_subscribers(passcode):
+                    broker.publish(passcode, "join", {
+                        "student_id":student_id, "displayName":student.displayName,
+                        "contactDetails":student.contactDetails,
+                        **similarity_rows(passcode, section, student_id)})
+                return {'student_id':student_id}
+
+@app.post("/api/{passcode}/import")
+async def api_import_roster(passcode : str, request : Request):
+    """Add every student of a CSV or NDJSON roster to a section at once.
+
+    Rows carry a displayName, contactDetails and optionally a schedule.
+    A body sent as text/csv is read as CSV, any other as NDJSON. Nothing
+    is added unless every row is valid and the section has room for all
+    of them.
+    """
+    csvFormat = "csv" in request.headers.get("content-type", "")
+    text = (await request.body()).decode(errors="replace")
+    return await run_in_threadpool(import_roster, passcode, text, csvFormat)
+
+@app.get("/api/{passcode}/export")
+def api_export_roster(passcode : str, format : str = "ndjson", scores : bool = True):
+    """Stream the roster of a section as NDJSON or CSV.
+
+    Every student's id, display name, contact details and schedule come
+    first, then, unless scores is false, the cumulative and consecutive
+    similar hours of every pair of students. Pairs are scored while the
+    response is sent, so the whole export is never held in memory.
+    """
+    if passcode in db and format in ("ndjson", "csv"):
+        with db.lock(passcode):
+            section = db[passcode]
+            students = [(i.displayName, i.contactDetails, i.scheduleMask)
+                        for i in section.studentList]
+        if format == "csv":
+            return StreamingResponse(export_csv(students, scores, section.registry),
+                                     media_type=CSV_TYPE,
+                                     headers={"Content-Disposition":
+                                              f'attachment; filename="{passcode}.csv"'})
+        return StreamingResponse(export_ndjson(students, scores, section.registry),
+                                 media_type=NDJSON_TYPE)
+
+@app.get("/api/{passcode}/events")
+async def api_section_events(passcode : str, request : Request):
+    """Stream changes to a section as Server-Sent Events.
+
+    'join' and 'schedule' events carry the id, display name and contact
+    details of the student who joined or changed their schedule, and
+    'schedule' events also their schedule version. Both carry the
+    student's 'cumulative' and 'consecutive' similar hours with every
+    student of the section, so clients can update their rankings without
+    refetching. A 'reset' event means events were missed and everything
+    should be refetched.
+    """
     if passcode in db:
-        section = db[passcode]
-        studentList = section.studentList
-        if section.maxSize > len(studentList):
-            student_id = len(studentList)
-            studentList.append(newStudent)
-            return {'student_id':student_id}
+        lastEventId = request.headers.get("last-event-id")
+        lastEventId = int(lastEventId) if lastEventId and lastEventId.isdigit() else None
+        return StreamingResponse(broker.subscribe(passcode, lastEventId),
+                                 media_type="text/event-stream",
+                                 headers={"Cache-Control":"no-cache", "X-Accel-Buffering":"no"})
 
 @app.get("/api/{passcode}/{student_id}/view_schedule")
-def api_view_schedule(passcode : str, student_id : int):
-    """Retrieve the schedule of a student of a section."""
+def api_view_schedule(passcode : str, student_id : int, request : Request, response : Response):
+    """Retrieve the schedule of a student of a section.
+
+    Tagged with the student's scheduleVersion, so an unchanged schedule
+    is answered with 304 Not Modified.
+    """
     if validate_student(passcode, student_id):
         section = db[passcode]
         student = section.studentList[student_id]
-        schedule = student.schedule
-        return {'schedule':schedule}
+        etag = f'"{db.epoch}-{student.scheduleVersion}"'
+        if not_modified(request, response, etag):
+            return Response(status_code=304, headers=dict(response.headers))
+        schedule = slot_mask_type(section.registry)(student.scheduleMask)
+        return fast_response(request, {'schedule':schedule, 'version':student.scheduleVersion},
+                             headers=dict(response.headers))
 
 @app.post("/api/{passcode}/{student_id}/update_schedule")
 def api_update_schedule(passcode : str, student_id : int, update : ScheduleUpdate):
-    """Update the student of a student of a section."""
-    if validate_student(passcode, student_id):
-        section = db[passcode]
-        student = section.studentList[student_id]
-        schedule = update.schedule
-        student.schedule = set(schedule)
-        return {'result':'success'}
+    """Update the schedule of a student of a section.
+
+    If the update carries a version that no longer matches the student's
+    scheduleVersion, nothing is changed and 'conflict' is returned.
+    """
+    with db.transaction(passcode) as section:
+        if section is not None and student_id in range(len(section.studentList)):
+            student = section.studentList[student_id]
+            if update.version is not None and update.version != student.scheduleVersion:
+                return {'result':'conflict', 'version':student.scheduleVersion}
+            newMask = apply_schedule_update(student.scheduleMask, update, section.registry)
+            if newMask is None:
+                return {'result':'error'}
+            if newMask != student.scheduleMask:
+                student.scheduleMask = newMask
+                student.scheduleVersion += 1
+                db.mark_dirty(passcode, student_id)
+                matrix = cached_section_matrix(passcode, section)
+                if matrix is not None:
+                    matrix.update_student(student_id, newMask)
+                    matrixCacheStats["updates"] += 1
+                index = cached_section_index(passcode, section)
+                if index is not None:
+                    index.update_student(student_id, newMask)
+                if broker.has_subscribers(passcode):
+                    broker.publish(passcode, "schedule", {
+                        "student_id":student_id, "version":student.scheduleVersion,
+                        "displayName":student.displayName, "contactDetails":student.contactDetails,
+                        **similarity_rows(passcode, section, student_id)})
+            return {'result':'success', 'version':student.scheduleVersion}
     return {'result':'error'}
 
 @app.get("/api/{passcode}/{student_id}/get_classmate_names")
-def api_get_studentlist(passcode : str, student_id : int):
-    """Retrieve all display names of classmates of the specified student."""
+def api_get_studentlist(passcode : str, student_id : int, request : Request, response : Response):
+    """Retrieve all display names of classmates of the specified student.
+
+    Tagged with the section's version, so an unchanged section is
+    answered with 304 Not Modified.
+    """
     if passcode in db:
         section = db[passcode]
+        if not_modified(request, response, section_etag(passcode)):
+            return Response(status_code=304, headers=dict(response.headers))
         studentList = [i.displayName for stud_id, i in enumerate(section.studentList)
                        if stud_id != student_id]
-        return {'studentList': studentList}
+        return fast_response(request, {'studentList': studentList}, headers=dict(response.headers))
 
 @app.get("/api/{passcode}/verify")
 def api_verify_passcode(passcode : str):
@@ -74,51 +254,241 @@ def api_verify_passcode(passcode : str):
     return {'result':False}
     
 @app.get("/api/{passcode}/{student_id}/group_cumulative")
-def api_group_cumulative(passcode : str, student_id : int):
+async def api_group_cumulative(passcode : str, student_id : int, request : Request,
+                               response : Response, limit : int | None = Query(None, ge=0),
+                               offset : int = Query(0, ge=0), min_score : float = 0,
+                               exact : bool = False):
     """Retrieve a ranked list of classmates of the specified student.
     
     Ranks classmates based on total intersections of schedule with
-    the specified student.
+    the specified student. Only classmates with at least min_score hours
+    are ranked, and only 'limit' of them from 'offset' are returned.
+    Sections of ANN_THRESHOLD students or more are ranked approximately
+    unless 'exact' is set. Rankings are tagged with the section's version.
     """
-    if validate_student(passcode, student_id):
-        section = db[passcode]
-        student = section.studentList[student_id]
-        similarSchedules = similar_hours_cumulative(student, section)
-        sortedSimilarSchedules = merge_sort(similarSchedules)
-        return {"data":sortedSimilarSchedules}
+    return await coalesced_response(request, response, passcode, student_id, ranking_content,
+                                    "cumulative", limit, offset, min_score, exact)
     
 @app.get("/api/{passcode}/{student_id}/group_consecutive")
-def api_group_consecutive(passcode : str, student_id : int):
+async def api_group_consecutive(passcode : str, student_id : int, request : Request,
+                                response : Response, limit : int | None = Query(None, ge=0),
+                                offset : int = Query(0, ge=0), min_score : float = 0,
+                                exact : bool = False):
     """Retrieve a ranked list of classmates of the specified student.
     
     Ranks classmates based on largest chunk of similar schedule with
-    the specified student.
+    the specified student. Only classmates with at least min_score hours
+    are ranked, and only 'limit' of them from 'offset' are returned.
+    Sections of ANN_THRESHOLD students or more are ranked approximately
+    unless 'exact' is set. Rankings are tagged with the section's version.
     """
-    if validate_student(passcode, student_id):
-        section = db[passcode]
-        student = section.studentList[student_id]
-        similarSchedules = similar_hours_consecutive(student, section)
-        sortedSimilarSchedules = merge_sort(similarSchedules)
-        return {"data":sortedSimilarSchedules}
+    return await coalesced_response(request, response, passcode, student_id, ranking_content,
+                                    "consecutive", limit, offset, min_score, exact)
     
+@app.get("/api/{passcode}/{student_id}/group_combined")
+async def api_group_combined(passcode : str, student_id : int, request : Request,
+                             response : Response, cumulative_weight : float = Query(1.0, ge=0),
+                             consecutive_weight : float = Query(1.0, ge=0),
+                             limit : int | None = Query(None, ge=0),
+                             offset : int = Query(0, ge=0), min_score : float = 0):
+    """Retrieve a ranked list of classmates of the specified student.
+
+    Ranks classmates on a weighted sum of their total and largest chunk of
+    similar hours with the specified student. Each tuple is extended with
+    (cumulativeHours, consecutiveHours, perDayHours) for the classmate.
+    """
+    return await coalesced_response(request, response, passcode, student_id, combined_content,
+                                    cumulative_weight, consecutive_weight, limit, offset,
+                                    min_score)
+
+@app.get("/api/cache_stats")
+def api_cache_stats():
+    """Retrieve hit, miss and incremental update counts of the matrix cache."""
+    return {"sections": len(sectionMatrices), **matrixCacheStats}
+
+@app.get("/api/memory_stats")
+def api_memory_stats():
+    """Retrieve the estimated memory held by each section resident in memory.
+
+    Sections are listed largest first, by student count and bytes held
+    by their records, cached similarity matrix and similarity index.
+    Passcodes are left out, so the report does not reveal them.
+    """
+    sections = []
+    for passcode, section in db.resident_sections().items():
+        matrix = cached_section_matrix(passcode, section)
+        index = cached_section_index(passcode, section)
+        sections.append({"students":len(section.studentList),
+                         "recordBytes":record_bytes(section),
+                         "matrixBytes":matrix.nbytes if matrix is not None else 0,
+                         "indexBytes":index.nbytes if index is not None else 0})
+    sections.sort(key=lambda i: i["recordBytes"] + i["matrixBytes"] + i["indexBytes"],
+                  reverse=True)
+    totalBytes = sum(i["recordBytes"] + i["matrixBytes"] + i["indexBytes"] for i in sections)
+    return {"resident":len(sections), "totalBytes":totalBytes, "sections":sections}
+
+@app.get("/metrics")
+def metrics():
+    """Expose request latencies, section sizes and stage timings to Prometheus."""
+    resident = db.resident_sections()
+    body = "\n".join([
+        requestSeconds.exposition(),
+        stageSeconds.exposition(),
+        section_sizes_exposition([len(i.studentList) for i in resident.values()]),
+        gauge("groupme_resident_sections", "Sections resident in memory.", len(resident)),
+        gauge("groupme_cached_matrices", "Sections with a cached similarity matrix.",
+              len(sectionMatrices)),
+        gauge("groupme_cached_indexes", "Sections with a cached similarity index.",
+              len(sectionIndexes)),
+        gauge("groupme_event_channels", "Sections with live event subscribers.",
+              len(broker.channels)),
+        gauge("groupme_coalesced_rankings_total",
+              "Rankings answered by another request's computation.",
+              rankingFlights.shared, "counter"),
+        gauge("groupme_rejected_rankings_total",
+              "Rankings turned away because their section was at capacity.",
+              admission.rejected, "counter"),
+    ])
+    return Response(body + "\n", media_type=CONTENT_TYPE)
+
+@app.post("/api/profiler")
+def api_toggle_profiler(enabled : bool, interval : float = Query(0.005, gt=0)):
+    """Start or stop the sampling profiler.
+
+    Only available when GROUPME_PROFILER=1. Starting discards the stacks
+    of the previous run.
+    """
+    if PROFILER_ENABLED:
+        if enabled:
+            profiler.interval = interval
+            profiler.start()
+        else:
+            profiler.stop()
+        return {'enabled':profiler.running, 'samples':profiler.samples}
+
+@app.get("/api/profiler")
+def api_profiler_stacks():
+    """Retrieve the sampled stacks in the collapsed format of flame graph tools."""
+    if PROFILER_ENABLED:
+        return Response(profiler.collapsed(), media_type="text/plain")
+
+@app.get("/api/{passcode}/similarity_matrix")
+def api_similarity_matrix(passcode : str, request : Request):
+    """Retrieve the full pairwise similarity matrices of a section.
+
+    Row i, column j of each matrix holds the hours shared by student i
+    and student j. The diagonal holds each student's own hours. Sections
+    of ANN_THRESHOLD students or more are refused with 413 Content Too
+    Large, as their matrices grow with the square of their size.
+    """
+    if passcode in db:
+        section = db[passcode]
+        if len(section.studentList) >= ANN_THRESHOLD:
+            return JSONResponse({'result':'error', 'errors':[
+                f"sections of {ANN_THRESHOLD} or more students have no similarity matrix"]},
+                status_code=413)
+        with db.lock(passcode):
+            matrix = get_section_matrix(passcode, section)
+            studentList = [i.displayName for i in section.studentList]
+            return fast_response(request, {"studentList": studentList,
+                                           "cumulative": matrix.cumulative
+                                                         * section.registry.slotHours,
+                                           "consecutive": matrix.consecutive
+                                                          * section.registry.slotHours})
+
+@app.get("/api/{passcode}/partition")
+async def api_partition_section(passcode : str, group_size : int = Query(ge=1),
+                                method : str = "cumulative",
+                                time_budget : float = Query(1.0, gt=0, le=30)):
+    """Split the whole section into groups of group_size.
+
+    Groups are chosen so that the free time common to all members, measured
+    like group_cumulative or group_consecutive, is as large as possible.
+    The search is awaited within the section's admission slots, and shared
+    by identical requests for the same version of the section.
+    """
+    if method not in METRICS:
+        return None
+    students = await run_in_threadpool(section_students, passcode)
+    if students is None:
+        return None
+    etag, studentList, slotHours = students
+    masks = [i.scheduleMask for i in studentList]
+    key = ("partition", passcode, group_size, method, time_budget, etag)
+    try:
+        groups, scores = await rankingFlights.run(key, lambda: admitted_partition(
+            passcode, masks, group_size, method, time_budget))
+    except SectionBusy:
+        return Response(status_code=503, headers={"Retry-After":"1"})
+    partition = []
+    for group, score in zip(groups, scores):
+        members = [(studentList[i].displayName, studentList[i].contactDetails, i)
+                   for i in group]
+        partition.append({"hours":score * slotHours, "members":members})
+    return {"data":partition}
+
+@app.get("/api/{passcode}/common_windows")
+def api_common_windows(passcode : str, students : str):
+    """Retrieve every free window shared by a set of students of a section.
+
+    'students' is a comma-separated list of student ids, or "all". Windows
+    are ranked by length, longest first, then by day and start time. A
+    malformed list is answered 400 Bad Request.
+    """
+    if passcode in db:
+        section = db[passcode]
+        studentList = section.studentList
+        student_ids = parse_classmate_ids(students, len(studentList))
+        if student_ids is None:
+            return malformed_ids()
+        if student_ids:
+            commonMask = section.registry.validMask
+            for student_id in student_ids:
+                commonMask &= studentList[student_id].scheduleMask
+            windows = sorted(section.registry.free_windows(commonMask),
+                             key=lambda window: (-window[3], window[0]))
+            data = [{"day":day, "start":firstSlot[2:6], "end":lastSlot[7:],
+                     "hours":length * section.registry.slotHours}
+                    for day, firstSlot, lastSlot, length in windows]
+            return {"data":data}
+
 @app.get("/api/{passcode}/{student_id}/schedule_intersect/{classmate_id}")
-def api_check_schedule_intersection(passcode : str, student_id : int, classmate_id : int):
+def api_check_schedule_intersection(passcode : str, student_id : int, classmate_id : int,
+                                    request : Request):
     if validate_student(passcode, student_id) and validate_student(passcode, classmate_id):
         section = db[passcode]
         studentA = section.studentList[student_id]
         studentB = section.studentList[classmate_id]
-        studentASched = studentA.schedule
-        studentBSched = studentB.schedule
-        if studentASched and studentBSched:
-            intersections = studentASched.intersection(studentBSched)
-            studentADiff = studentASched.difference(studentBSched)
-            studentBDiff = studentBSched.difference(studentASched)
-            return {"intersections":intersections, 
-                    "studentADiff":studentADiff, 
-                    "studentBDiff":studentBDiff}
+        studentAMask = studentA.scheduleMask
+        studentBMask = studentB.scheduleMask
+        if studentAMask and studentBMask:
+            return fast_response(request, schedule_intersection(
+                studentAMask, studentBMask, slot_mask_type(section.registry)))
+
+@app.get("/api/{passcode}/{student_id}/schedule_intersections")
+def api_check_schedule_intersections(passcode : str, student_id : int, request : Request,
+                                     classmates : str = "all"):
+    """Retrieve schedule intersections between a student and many classmates.
+
+    'classmates' is either "all" or a comma-separated list of classmate ids.
+    Returns a dict from classmate id to the same intersections and diffs as
+    api_check_schedule_intersection, leaving out classmates without a schedule.
+    A malformed list, or one naming a student not in the section, is
+    answered 400 Bad Request.
+    """
+    if validate_student(passcode, student_id):
+        section = db[passcode]
+        studentList = section.studentList
+        classmate_ids = parse_classmate_ids(classmates, len(studentList), student_id)
+        if classmate_ids is None:
+            return malformed_ids()
+        intersections = schedule_intersections(studentList, student_id, classmate_ids,
+                                               slot_mask_type(section.registry))
+        return fast_response(request, {"data":intersections})
 
 # Helper Functions
 
+@timed("validate_student")
 def validate_student(passcode : str, student_id : int):
     """Verify student-section pair."""
     if passcode in db:
@@ -126,85 +496,320 @@ def validate_student(passcode : str, student_id : int):
             return True
     return False
 
-def similar_hours_cumulative(currentStudent: Student, currentSection: Section):
-    """Retrieve total similar schedule between a student and their classmates.
+def import_roster(passcode : str, text : str, csvFormat : bool):
+    """Validate a roster and append its students to a section in one transaction.
+
+    Schedules are interned against the section's grid, which never changes,
+    before the transaction is opened.
+    """
+    if passcode not in db:
+        return {'result':'error', 'errors':["section does not exist"]}
+    students, errors = read_roster(text, csvFormat, db[passcode].registry)
+    if errors:
+        return {'result':'error', 'errors':errors}
+    with db.transaction(passcode) as section:
+        if section is None:
+            return {'result':'error', 'errors':["section does not exist"]}
+        studentList = section.studentList
+        if len(studentList) + len(students) > section.maxSize:
+            return {'result':'error', 'errors':[
+                f"section has room for {section.maxSize - len(studentList)} more students"]}
+        student_ids = list(range(len(studentList), len(studentList) + len(students)))
+        if students:
+            studentList.extend(students)
+            db.mark_dirty_batch(passcode, student_ids)
+            sectionMatrices.pop(passcode, None)
+            sectionIndexes.pop(passcode, None)
+            if broker.has_subscribers(passcode):
+                broker.publish(passcode, "reset", {})
+        return {'result':'success', 'student_ids':student_ids}
+
+def malformed_ids():
+    """Response to a malformed or unknown list of student ids."""
+    return JSONResponse({'result':'error', 'errors':["malformed or unknown student ids"]},
+                        status_code=400)
+
+def section_etag(passcode : str):
+    """Entity tag of a section's current version."""
+    return f'"{db.epoch}-{db.version(passcode)}"'
+
+def not_modified(request : Request, response : Response, etag : str):
+    """Tag a response, and verify if the client already holds that version.
 
-    Returns a list 'similarHours' of tuples containing: 
-    (classmateDisplayName, classmateSimilarHours, classmateContactDetails, student_id)
+    Responses must be revalidated before reuse, so clients always send
+    the tag back in If-None-Match. The body is msgpack or JSON depending
+    on Accept, so caches must key the tag on it too.
     """
-    similarHours = []
-    rankingList = currentSection.studentList
-    studentSched = currentStudent.schedule
-    student_id = 0
-    for student in rankingList:
-        if student != currentStudent:
-            comparedSched = student.schedule
-            similarSched = studentSched.intersection(comparedSched)
-            similarHours.append((student.displayName, len(similarSched) * 0.5,
-                                student.contactDetails, student_id))
-        student_id += 1
-    return similarHours
-
-def similar_hours_consecutive(currentStudent: Student, currentSection: Section):
-    """Retrieve length of longest consecutive similar time between a student and
-    their classmates.
-
-    Returns a list 'similarHours' of tuples containing: 
-    (classmateDisplayName, classmateConsecutiveHours, classmateContactDetails, student_id)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept"
+    ifNoneMatch = request.headers.get("if-none-match")
+    if ifNoneMatch is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in ifNoneMatch.split(",")]
+    return etag in tags or "*" in tags
+
+def apply_schedule_update(mask : int, update : ScheduleUpdate,
+                          registry : SlotRegistry = DEFAULT_REGISTRY):
+    """Apply a full or delta schedule update to a schedule bitmask.
+
+    The slot lists of the update are interned against the section's grid
+    in one pass. Returns None if the update carries a malformed base64
+    mask or any slot that is not in the grid.
     """
-    allStudentsChunks = []
-    rankingList = currentSection.studentList
-    studentSched = currentStudent.schedule
-    student_id = 0
-    for student in rankingList:
-        if student != currentStudent:
-            comparedSched = student.schedule
-            currentLength = 0
-            maxLength = 0
-            for slot in ALLPOSSIBLETIMES:
-                if slot == "":
-                    maxLength = max(maxLength,currentLength)
-                    currentLength =0
-                elif slot in studentSched and slot in comparedSched:
-                    currentLength += 0.5
-                else:
-                    maxLength = max(maxLength,currentLength)
-                    currentLength =0
-                maxLength = max(maxLength,currentLength)
-            allStudentsChunks.append((student.displayName, maxLength,
-                                      student.contactDetails, student_id))
-        student_id += 1
-    return allStudentsChunks
-
-def merge(L1, L2):
-    mergedList = []
-    while len(L1) != 0 and len(L2) != 0:
-        if L1[0][1] > L2[0][1]:
-            mergedList.append(L1[0])
-            L1.pop(0)
-        else:
-            mergedList.append(L2[0])
-            L2.pop(0)
-    while len(L2) != 0:
-        mergedList.append(L2[0])
-        L2.pop(0)
-    while len(L1) != 0:
-        mergedList.append(L1[0])
-        L1.pop(0)
-    return mergedList
-
-def merge_sort(L):
-    """Merge sort implementation."""
-    if len(L) <= 1:
-        return L
+    replaced = update.schedule if update.mask is None else None
+    masks, invalid = registry.intern_many([update.added, update.removed, replaced or []])
+    if any(invalid):
+        return None
+    added, removed, replacedMask = masks
+    if update.mask is not None:
+        try:
+            mask = registry.decode_mask(update.mask)
+        except ValueError:
+            return None
+    elif replaced is not None:
+        mask = replacedMask
+    return (mask | added) & ~removed
+
+def sweep_sections():
+    """Expire and unload idle sections, then drop caches of unloaded sections."""
+    db.sweep()
+    resident = db.resident_sections()
+    for cache in (sectionMatrices, sectionIndexes):
+        for passcode, (section, value) in list(cache.items()):
+            if resident.get(passcode) is not section:
+                cache.pop(passcode, None)
+
+async def sweep_periodically():
+    """Run sweep_sections every SWEEP_INTERVAL seconds, off the event loop.
+
+    A failed sweep is logged and the next one runs as usual.
+    """
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            await asyncio.to_thread(sweep_sections)
+        except Exception:
+            logger.exception("Section sweep failed; retrying in %ss", SWEEP_INTERVAL)
+
+def cached_section_matrix(passcode : str, section : SectionRecord):
+    """Retrieve the cached similarity matrix of a section, if still valid.
+
+    A matrix is only valid for the section object it was built from, so
+    a section reloaded after another worker changed it is rebuilt. Once a
+    section reaches ANN_THRESHOLD students its matrix is dropped instead,
+    as ranking no longer reads it and it would keep growing quadratically.
+    """
+    if len(section.studentList) >= ANN_THRESHOLD:
+        sectionMatrices.pop(passcode, None)
+        return None
+    cached = sectionMatrices.get(passcode)
+    if cached is not None and cached[0] is section:
+        return cached[1]
+    return None
+
+@timed("section_matrix")
+def get_section_matrix(passcode : str, section : SectionRecord):
+    """Retrieve the cached similarity matrix of a section.
+
+    The matrix is built on first access, then kept up to date by
+    api_create_student and api_update_schedule. Callers hold the section's
+    lock, so the matrix always matches the section's student list.
+    """
+    matrix = cached_section_matrix(passcode, section)
+    if matrix is None:
+        matrixCacheStats["misses"] += 1
+        masks = [i.scheduleMask for i in section.studentList]
+        matrix = SectionMatrix(masks, section.registry)
+        sectionMatrices[passcode] = (section, matrix)
     else:
-        middleIndex = len(L) // 2
-        firstHalf = L[:middleIndex]
-        secondHalf = L[middleIndex:]
-        firstHalf = merge_sort(firstHalf)
-        secondHalf = merge_sort(secondHalf)
-        return merge(firstHalf, secondHalf)
-    
+        matrixCacheStats["hits"] += 1
+    return matrix
+
+def cached_section_index(passcode : str, section : SectionRecord):
+    """Retrieve the cached similarity index of a section, if still valid."""
+    cached = sectionIndexes.get(passcode)
+    if cached is not None and cached[0] is section:
+        return cached[1]
+    return None
+
+@timed("section_index")
+def get_section_index(passcode : str, section : SectionRecord):
+    """Retrieve the cached similarity index of a section.
+
+    Like the similarity matrix, the index is built on first access and
+    then kept up to date by api_create_student and api_update_schedule.
+    """
+    index = cached_section_index(passcode, section)
+    if index is None:
+        index = ScheduleIndex([i.scheduleMask for i in section.studentList],
+                              slotCount=len(section.registry.slots))
+        sectionIndexes[passcode] = (section, index)
+    return index
+
+def section_students(passcode : str):
+    """Retrieve (etag, studentList, slotHours) of a section, or None if it does not exist.
+
+    studentList is a copy, so it stays consistent while a search runs on it.
+    """
+    if passcode in db:
+        section = db[passcode]
+        with db.lock(passcode):
+            return section_etag(passcode), list(section.studentList), section.registry.slotHours
+    return None
+
+async def admitted_partition(passcode : str, masks, groupSize : int, method : str,
+                             timeBudget : float):
+    """Partition a section's schedules within the section's admission slots."""
+    async with admission.slot(passcode):
+        return await partition_section_async(masks, groupSize, method, timeBudget,
+                                             executor=rankingExecutor)
+
+def student_etag(passcode : str, student_id : int):
+    """Entity tag of a section's current version, or None if the student does not exist."""
+    if validate_student(passcode, student_id):
+        return section_etag(passcode)
+    return None
+
+async def coalesced_response(request : Request, response : Response, passcode : str,
+                             student_id : int, function, *args):
+    """Answer a ranking request from a shared computation on the ranking executor.
+
+    The ETag is checked first, on the threadpool as the store may read
+    from disk. Identical requests for the same version of a section then
+    share one run of function, which ranks and encodes the response body
+    within the section's admission slots. A section with too many
+    computations queued is answered 503 Service Unavailable.
+    """
+    etag = await run_in_threadpool(student_etag, passcode, student_id)
+    if etag is None:
+        return None
+    if not_modified(request, response, etag):
+        return Response(status_code=304, headers=dict(response.headers))
+    msgpackFormat = accepts_msgpack(request)
+    key = (function.__name__, passcode, student_id, *args, msgpackFormat, etag)
+    try:
+        encoded = await rankingFlights.run(key, lambda: admission.run(
+            passcode, function, passcode, student_id, *args, msgpackFormat))
+    except SectionBusy:
+        return Response(status_code=503, headers={"Retry-After":"1"})
+    if encoded is None:
+        return None
+    body, mediaType = encoded
+    return Response(body, media_type=mediaType, headers=dict(response.headers))
+
+def ranking_content(passcode : str, student_id : int, method : str, limit : int | None,
+                    offset : int, minScore : float, exact : bool, msgpackFormat : bool):
+    """Rank a student's classmates and encode the response body.
+
+    Returns (body, mediaType), or None if the student no longer exists.
+    """
+    with db.lock(passcode):
+        section = db[passcode] if passcode in db else None
+        if section is None or student_id not in range(len(section.studentList)):
+            return None
+        total, rankedSchedules = rank_classmates(passcode, section, student_id, method,
+                                                 limit, offset, minScore, exact)
+    return encode_content({"data":rankedSchedules, "total":total}, msgpackFormat)
+
+def combined_content(passcode : str, student_id : int, cumulativeWeight : float,
+                     consecutiveWeight : float, limit : int | None, offset : int,
+                     minScore : float, msgpackFormat : bool):
+    """Rank a student's classmates on weighted similar hours and encode the response body.
+
+    Returns (body, mediaType), or None if the student no longer exists.
+    """
+    with db.lock(passcode):
+        section = db[passcode] if passcode in db else None
+        if section is None or student_id not in range(len(section.studentList)):
+            return None
+        cumulative, consecutive, perDay = section_rows(passcode, section, student_id)
+        scores = cumulativeWeight * cumulative + consecutiveWeight * consecutive
+        total, rankedSchedules = top_ranked(section, scores, student_id, limit, offset, minScore)
+        slotHours = section.registry.slotHours
+        rankedSchedules = [item + (int(cumulative[item[3]]) * slotHours,
+                                   int(consecutive[item[3]]) * slotHours,
+                                   perDay[:, item[3]] * slotHours)
+                           for item in rankedSchedules]
+    return encode_content({"data":rankedSchedules, "total":total}, msgpackFormat)
+
+@timed("rank_classmates")
+def rank_classmates(passcode : str, section : SectionRecord, student_id : int, method : str,
+                    limit : int | None = None, offset : int = 0, minScore : float = 0,
+                    exact : bool = False):
+    """Rank a student's classmates by cumulative or consecutive similar hours.
+
+    Paged queries with no minScore on sections of ANN_THRESHOLD students
+    or more go through the section's similarity index, which only scores
+    classmates with resembling schedules, and falls back to scoring all
+    of them when too few resemble the student to fill the page. Any other
+    query needs every classmate scored to count those at or above
+    minScore, so it ranks the student's row of section_rows exactly.
+    Either way the total counts every classmate at or above minScore.
+    """
+    studentList = section.studentList
+    slotHours = section.registry.slotHours
+    minSlots = min_slots(minScore, slotHours)
+    if exact or limit is None or minSlots > 0 or len(studentList) < ANN_THRESHOLD:
+        cumulative, consecutive, perDay = section_rows(passcode, section, student_id)
+        scores = cumulative if method == "cumulative" else consecutive
+        return top_ranked(section, scores, student_id, limit, offset, minScore)
+    index = get_section_index(passcode, section)
+    mask = studentList[student_id].scheduleMask
+    total = len(studentList) - 1
+    scored, neighbours = index.top_k(mask, min(offset + limit, total), METRICS[method],
+                                     exclude=student_id)
+    rankedHours = []
+    for score, classmate_id in neighbours[offset:]:
+        student = studentList[classmate_id]
+        rankedHours.append((student.displayName, score * slotHours,
+                            student.contactDetails, classmate_id))
+    return total, rankedHours
+
+def min_slots(minScore : float, slotHours : float):
+    """Fewest slots whose hours are at least minScore."""
+    slots = math.ceil(minScore / slotHours)
+    while slots * slotHours < minScore:
+        slots += 1
+    while (slots - 1) * slotHours >= minScore:
+        slots -= 1
+    return slots
+
+def section_rows(passcode : str, section : SectionRecord, student_id : int):
+    """Retrieve a student's cumulative, consecutive and per-day rows of similar slots.
+
+    Sections below ANN_THRESHOLD students read them from the cached
+    similarity matrix. Larger ones score the student against every
+    bitmask instead, which never builds an n x n matrix.
+    """
+    if len(section.studentList) < ANN_THRESHOLD:
+        matrix = get_section_matrix(passcode, section)
+        return (matrix.cumulative[student_id], matrix.consecutive[student_id],
+                matrix.perDay[:, student_id])
+    return row_scores(section.studentList[student_id].scheduleMask,
+                      [i.scheduleMask for i in section.studentList], section.registry)
+
+@timed("similarity_rows")
+def similarity_rows(passcode : str, section : SectionRecord, student_id : int):
+    """Retrieve a student's similar hours with every student of a section.
+
+    Reads the rows of the cached similarity matrix when there is one,
+    and otherwise compares bitmasks, so publishing an event never builds
+    a matrix. Returns a dict of 'cumulative' and 'consecutive' lists.
+    """
+    matrix = cached_section_matrix(passcode, section)
+    if matrix is not None:
+        cumulative = matrix.cumulative[student_id].tolist()
+        consecutive = matrix.consecutive[student_id].tolist()
+    else:
+        studentMask = section.studentList[student_id].scheduleMask
+        similarMasks = [studentMask & i.scheduleMask for i in section.studentList]
+        cumulative = [count_slots(i) for i in similarMasks]
+        consecutive = [longest_run(i) for i in similarMasks]
+    slotHours = section.registry.slotHours
+    return {"cumulative":[i * slotHours for i in cumulative],
+            "consecutive":[i * slotHours for i in consecutive]}
+
 # ROUTES
 
 @app.get("/", response_class=HTMLResponse)
@@ -238,7 +843,8 @@ def view_section(request : Request, passcode : str, student_id : int):
                                                             "student_id": student_id,
                                                             "displayName": displayName,
                                                             "className":className,
-                                                            "classDescription":classDescription})
+                                                            "classDescription":classDescription,
+                                                            "grid":section.registry})
     return templates.TemplateResponse("error_page.html", {"request":request})
 
 @app.get("/{passcode}/{student_id}/view_group", response_class=HTMLResponse)
@@ -247,12 +853,12 @@ def view_group(request : Request, passcode : str, student_id : int):
     if validate_student(passcode, student_id):
         section = db[passcode]
         student = section.studentList[student_id]
-        schedule = student.schedule
-        if not schedule:
+        if not student.scheduleMask:
             return RedirectResponse(f"/{passcode}/{student_id}")
         return templates.TemplateResponse("view_groupmates.html", {"request": request, 
                                                             "passcode": passcode, 
-                                                            "student_id": student_id})
+                                                            "student_id": student_id,
+                                                            "grid":section.registry})
     return templates.TemplateResponse("error_page.html", {"request":request})
 
 @app.exception_handler(404)
@@ -265,43 +871,6 @@ def catch_errors(request : Request, exc: RequestValidationError):
     """Catch all for unprocessable pages."""
     return RedirectResponse("/")
 
-ALLPOSSIBLETIMES = [
-    "0-0800-0830", "0-0830-0900", "0-0900-0930", "0-0930-1000", "0-1000-1030",
-    "0-1030-1100", "0-1100-1130", "0-1130-1200", "0-1200-1230", 
-    "0-1230-1300", "0-1300-1330", "0-1330-1400", "0-1400-1430", "0-1430-1500",
-    "0-1500-1530", "0-1530-1600", "0-1600-1630", "0-1630-1700", "0-1700-1730",
-    "0-1730-1800", "0-1800-1830", "0-1830-1900", "0-1900-1930", "0-1930-2000", "", 
-    "1-0800-0830", "1-0830-0900", "1-0900-0930", "1-0930-1000", "1-1000-1030",
-    "1-1030-1100", "1-1100-1130", "1-1130-1200", "1-1200-1230", 
-    "1-1230-1300", "1-1300-1330", "1-1330-1400", "1-1400-1430", "1-1430-1500",
-    "1-1500-1530", "1-1530-1600", "1-1600-1630", "1-1630-1700", "1-1700-1730",
-    "1-1730-1800", "1-1800-1830", "1-1830-1900", "1-1900-1930", "1-1930-2000", "", 
-    "2-0800-0830", "2-0830-0900", "2-0900-0930", "2-0930-1000", "2-1000-1030",
-    "2-1030-1100", "2-1100-1130", "2-1130-1200", "2-1200-1230", 
-    "2-1230-1300", "2-1300-1330", "2-1330-1400", "2-1400-1430", "2-1430-1500",
-    "2-1500-1530", "2-1530-1600", "2-1600-1630", "2-1630-1700", "2-1700-1730",
-    "2-1730-1800", "2-1800-1830", "2-1830-1900", "2-1900-1930", "2-1930-2000", "", 
-    "3-0800-0830", "3-0830-0900", "3-0900-0930", "3-0930-1000", "3-1000-1030",
-    "3-1030-1100", "3-1100-1130", "3-1130-1200", "3-1200-1230", 
-    "3-1230-1300", "3-1300-1330", "3-1330-1400", "3-1400-1430", "3-1430-1500",
-    "3-1500-1530", "3-1530-1600", "3-1600-1630", "3-1630-1700", "3-1700-1730",
-    "3-1730-1800", "3-1800-1830", "3-1830-1900", "3-1900-1930", "3-1930-2000", "", 
-    "4-0800-0830", "4-0830-0900", "4-0900-0930", "4-0930-1000", "4-1000-1030",
-    "4-1030-1100", "4-1100-1130", "4-1130-1200", "4-1200-1230", 
-    "4-1230-1300", "4-1300-1330", "4-1330-1400", "4-1400-1430", "4-1430-1500",
-    "4-1500-1530", "4-1530-1600", "4-1600-1630", "4-1630-1700", "4-1700-1730",
-    "4-1730-1800", "4-1800-1830", "4-1830-1900", "4-1900-1930", "4-1930-2000", "", 
-    "5-0800-0830", "5-0830-0900", "5-0900-0930", "5-0930-1000", "5-1000-1030",
-    "5-1030-1100", "5-1100-1130", "5-1130-1200", "5-1200-1230", 
-    "5-1230-1300", "5-1300-1330", "5-1330-1400", "5-1400-1430", "5-1430-1500",
-    "5-1500-1530", "5-1530-1600", "5-1600-1630", "5-1630-1700", "5-1700-1730",
-    "5-1730-1800", "5-1800-1830", "5-1830-1900", "5-1900-1930", "5-1930-2000", "", 
-    "6-0800-0830", "6-0830-0900", "6-0900-0930", "6-0930-1000", "6-1000-1030",
-    "6-1030-1100", "6-1100-1130", "6-1130-1200", "6-1200-1230", 
-    "6-1230-1300", "6-1300-1330", "6-1330-1400", "6-1400-1430", "6-1430-1500",
-    "6-1500-1530", "6-1530-1600", "6-1600-1630", "6-1630-1700", "6-1700-1730",
-    "6-1730-1800", "6-1800-1830", "6-1830-1900", "6-1900-1930", "6-1930-2000", "", 
-]
-
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app)
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""Request latency, section size and algorithm stage metrics.
+
+Metrics are kept in process and exposed in the Prometheus text format.
+Recording a value costs a bisect and a short lock, so instrumentation
+stays cheap enough to leave on in production.
+"""
+import bisect
+import collections
+import sys
+import threading
+import time
+from functools import wraps
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STAGE_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+SIZE_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def label_text(names, values):
+    """Format label pairs as they appear between the braces of a sample."""
+    escaped = [str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in values]
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+class Histogram:
+    """
+    Prometheus histogram with one series per combination of label values
+
+    name: Metric name
+    documentation: HELP text of the metric
+    labelNames: Names of the labels each observation is made with
+    buckets: Upper bounds of the buckets, in increasing order
+    """
+    def __init__(self, name : str, documentation : str, labelNames = (),
+                 buckets = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(labelNames)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value : float, *labels):
+        """Count one value under the given label values."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def exposition(self):
+        """Render every series in the Prometheus text format."""
+        with self.lock:
+            snapshot = [(labels, list(counts), total, count)
+                        for labels, (counts, total, count) in self.series.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total, count in sorted(snapshot):
+            prefix = label_text(self.labelNames, labels)
+            prefix = prefix + "," if prefix else ""
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucketCount
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = "{" + prefix.rstrip(",") + "}" if prefix else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return "\n".join(lines)
+
+def gauge(name : str, documentation : str, value : float, kind : str = "gauge"):
+    """Render a single unlabelled gauge, or counter, in the Prometheus text format."""
+    return f"# HELP {name} {documentation}\n# TYPE {name} {kind}\n{name} {value}"
+
+requestSeconds = Histogram("groupme_request_seconds", "Time to answer a request, by route.",
+                           ("method", "route", "status"))
+stageSeconds = Histogram("groupme_stage_seconds", "Time spent in each algorithm stage.",
+                         ("stage",), STAGE_BUCKETS)
+activeStages = threading.local()
+
+def timed(stage : str):
+    """Decorate a function to record its running time under a stage.
+
+    Only the outermost call of a stage on a thread is recorded, so
+    recursive functions count once per outermost call.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(activeStages, stage, False):
+                return function(*args, **kwargs)
+            setattr(activeStages, stage, True)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stageSeconds.observe(time.perf_counter() - started, stage)
+                setattr(activeStages, stage, False)
+        return wrapper
+    return decorator
+
+def section_sizes_exposition(sizes):
+    """Render the distribution of students per resident section."""
+    histogram = Histogram("groupme_section_students",
+                          "Students per section resident in memory.", buckets=SIZE_BUCKETS)
+    for size in sizes:
+        histogram.observe(size)
+    return histogram.exposition()
+
+class MetricsMiddleware:
+    """
+    Records the latency of every request by method, route and status.
+
+    Routes are labelled by their path template, so passcodes and student
+    ids never become label values. Event streams stay open for as long
+    as a page does and are not recorded.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        response = {"status": 500, "stream": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for key, value in message.get("headers", []):
+                    if key == b"content-type" and value.startswith(b"text/event-stream"):
+                        response["stream"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not response["stream"]:
+                route = getattr(scope.get("route"), "path", None) or scope.get("root_path")
+                requestSeconds.observe(time.perf_counter() - started, scope["method"],
+                                       route or "unmatched", str(response["status"]))
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread at a fixed interval.
+
+    Stacks are aggregated in the collapsed format read by flame graph
+    tools, one 'frame;frame;frame count' line per distinct stack.
+
+    interval: Seconds between samples
+    maxDepth: Innermost frames kept of each stack
+    """
+    def __init__(self, interval : float = 0.005, maxDepth : int = 64):
+        self.interval = interval
+        self.maxDepth = maxDepth
+        self.counts = collections.Counter()
+        self.samples = 0
+        self.thread = None
+        self.stopped = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        """Start sampling, discarding the stacks of any earlier run."""
+        if self.thread is None:
+            self.counts.clear()
+            self.samples = 0
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._sample, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop sampling and keep the stacks collected so far."""
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+    def collapsed(self):
+        """Render the collected stacks, most sampled first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+    def _sample(self):
+        """Record the stack of every other thread until stopped."""
+        ownId = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for threadId, frame in sys._current_frames().items():
+                if threadId == ownId:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.maxDepth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename}:{code.co_name}")
+                    frame = frame.f_back
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
@@ -1,16 +1,31 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
+from schedules import slot_registry
 
 class Student(BaseModel):
     """
     Represents a student joined in a section
-    
+
+    Only the request body of a new student; the stored schedule bitmask
+    and version live on StudentRecord, so clients cannot set them.
+
     displayName: The name of student
     contactDetails: Chosen contact details of student
-    schedule: Set containing string schedules of student
+    scheduleSlots: Slot strings the schedule was sent as, if any, kept
+                   to be interned against the grid of the student's section;
+                   accepted on input as 'schedule'
     """
     displayName : str
     contactDetails : str
-    schedule : set[str] = {}
+    scheduleSlots : list[str] = Field([], exclude=True)
+
+    @model_validator(mode="before")
+    @classmethod
+    def pack_schedule(cls, data):
+        """Keep an incoming string schedule to be interned by StudentRecord.from_model."""
+        if isinstance(data, dict) and "schedule" in data:
+            data = dict(data)
+            data["scheduleSlots"] = data.pop("schedule")
+        return data
 
 class Section(BaseModel):
     """
@@ -20,17 +35,47 @@ class Section(BaseModel):
     sectionDetails: Details for section
     maxSize: Maximum students under section
     studentList: List of Students joined in section
+    slotMinutes: Length of the slots of the schedule grid (15, 30 or 60)
+    firstDay, lastDay: Days of the week in the grid, 0 being Monday
+    startHour, endHour: Hours of the day in the grid
     """
     sectionName : str
     sectionDetails : str = ""
     maxSize : int
     studentList : list[Student] = []
+    slotMinutes : int = 30
+    firstDay : int = 0
+    lastDay : int = 6
+    startHour : int = 8
+    endHour : int = 20
+
+    @model_validator(mode="after")
+    def check_grid(self):
+        """Reject a grid layout that SlotRegistry does not accept."""
+        self.registry
+        return self
+
+    @property
+    def registry(self):
+        return slot_registry(self.slotMinutes, self.firstDay, self.lastDay,
+                             self.startHour, self.endHour)
 
 class ScheduleUpdate(BaseModel):
     """
     Represents a data packet for updating a
     schedule of a student
 
+    Either replaces the whole schedule through 'schedule' or 'mask',
+    or edits the saved schedule through 'added' and 'removed'.
+
     schedule: List containing string schedules of update
+    mask: Base64 schedule bitmask from schedules.encode_mask
+    added: List containing string schedules to add
+    removed: List containing string schedules to remove
+    version: Expected scheduleVersion of the student, if any
     """
-    schedule: list[str]
\ No newline at end of file
+    schedule: list[str] | None = None
+    mask: str | None = None
+    added: list[str] = []
+    removed: list[str] = []
+    version: int | None = None
\ No newline at end of file
@@ -0,0 +1,185 @@
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import reduce
+from schedules import count_slots, longest_run
+
+METRICS = {"cumulative": count_slots, "consecutive": longest_run}
+PARALLEL_THRESHOLD = 100
+POOL_ATTEMPTS = 2
+
+_pool = None
+
+def common_mask(masks, group):
+    """Bitmask of the slots every member of a group has free.
+
+    Starts from every bit set, so it holds for any section's grid.
+    """
+    return reduce(lambda common, student_id: common & masks[student_id], group, ~0)
+
+def greedy_groups(masks, groupSize : int, metric, rng : random.Random):
+    """Seed a partition by growing one group at a time.
+
+    Each group starts from the remaining student with the fewest free
+    slots, since they are the hardest to place, then repeatedly takes
+    whoever keeps the most common free time. The last group holds the
+    leftover students when groupSize does not divide the section.
+    """
+    remaining = list(range(len(masks)))
+    rng.shuffle(remaining)
+    groups = []
+    while remaining:
+        seed = min(remaining, key=lambda student_id: count_slots(masks[student_id]))
+        remaining.remove(seed)
+        group = [seed]
+        common = masks[seed]
+        while len(group) < groupSize and remaining:
+            best = max(remaining, key=lambda student_id: metric(common & masks[student_id]))
+            remaining.remove(best)
+            group.append(best)
+            common &= masks[best]
+        groups.append(group)
+    return groups
+
+def local_search(masks, groups, metric, deadline : float):
+    """Improve a partition by swapping students between groups.
+
+    Sweeps every pair of members of every pair of groups and keeps any
+    swap that raises the two groups' combined score, until a sweep finds
+    nothing or the deadline passes.
+    """
+    scores = [metric(common_mask(masks, group)) for group in groups]
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for first in range(len(groups)):
+            for second in range(first + 1, len(groups)):
+                if time.monotonic() >= deadline:
+                    return scores
+                if swap_best_pair(masks, groups, scores, first, second, metric):
+                    improved = True
+    return scores
+
+def swap_best_pair(masks, groups, scores, first : int, second : int, metric):
+    """Apply the best improving swap between two groups, if any."""
+    groupA, groupB = groups[first], groups[second]
+    bestGain, bestSwap = 0, None
+    for i in range(len(groupA)):
+        restA = common_mask(masks, groupA[:i] + groupA[i + 1:])
+        for j in range(len(groupB)):
+            restB = common_mask(masks, groupB[:j] + groupB[j + 1:])
+            scoreA = metric(restA & masks[groupB[j]])
+            scoreB = metric(restB & masks[groupA[i]])
+            gain = scoreA + scoreB - scores[first] - scores[second]
+            if gain > bestGain:
+                bestGain, bestSwap = gain, (i, j, scoreA, scoreB)
+    if bestSwap is None:
+        return False
+    i, j, scoreA, scoreB = bestSwap
+    groupA[i], groupB[j] = groupB[j], groupA[i]
+    scores[first], scores[second] = scoreA, scoreB
+    return True
+
+def partition_once(masks, groupSize : int, method : str, timeBudget : float, seed : int):
+    """Run one greedy seed and local search, returning (total, groups, scores)."""
+    deadline = time.monotonic() + timeBudget
+    metric = METRICS[method]
+    rng = random.Random(seed)
+    groups = greedy_groups(masks, groupSize, metric, rng)
+    scores = local_search(masks, groups, metric, deadline)
+    return sum(scores), groups, scores
+
+def partition_section(masks, groupSize : int, method : str = "cumulative",
+                      timeBudget : float = 1.0, seed : int = 0, workers : int | None = None):
+    """Split a section into groups of groupSize with the most common free time.
+
+    Sections below PARALLEL_THRESHOLD students run a single search inline.
+    Larger ones run one search per worker process, each from a different
+    random seed, and keep the best partition found within timeBudget.
+    A pool broken by a dead worker is replaced and the searches retried,
+    up to POOL_ATTEMPTS times, before searching inline instead.
+
+    Returns the groups as lists of student ids, and each group's score
+    in slots under the chosen method.
+    """
+    if workers is None:
+        workers = os.cpu_count() if len(masks) >= PARALLEL_THRESHOLD else 0
+    if not workers:
+        total, groups, scores = partition_once(masks, groupSize, method, timeBudget, seed)
+        return groups, scores
+    for attempt in range(POOL_ATTEMPTS):
+        pool = get_pool(workers)
+        try:
+            futures = [pool.submit(partition_once, masks, groupSize, method, timeBudget,
+                                   seed + i) for i in range(workers)]
+            results = [future.result() for future in futures]
+            break
+        except BrokenProcessPool:
+            discard_pool(pool)
+    else:
+        results = [partition_once(masks, groupSize, method, timeBudget, seed)]
+    total, groups, scores = max(results, key=lambda result: result[0])
+    return groups, scores
+
+async def partition_section_async(masks, groupSize : int, method : str = "cumulative",
+                                  timeBudget : float = 1.0, seed : int = 0,
+                                  workers : int | None = None, executor=None):
+    """Like partition_section, awaiting the searches instead of blocking on them.
+
+    Sections below PARALLEL_THRESHOLD students run their search on
+    executor, or the event loop's default executor if None.
+    """
+    loop = asyncio.get_running_loop()
+    if workers is None:
+        workers = os.cpu_count() if len(masks) >= PARALLEL_THRESHOLD else 0
+    if not workers:
+        total, groups, scores = await loop.run_in_executor(
+            executor, partition_once, masks, groupSize, method, timeBudget, seed)
+        return groups, scores
+    for attempt in range(POOL_ATTEMPTS):
+        pool = get_pool(workers)
+        try:
+            results = await asyncio.gather(*[
+                loop.run_in_executor(pool, partition_once, masks, groupSize, method,
+                                     timeBudget, seed + i) for i in range(workers)])
+            break
+        except BrokenProcessPool:
+            discard_pool(pool)
+    else:
+        results = [await loop.run_in_executor(executor, partition_once, masks, groupSize,
+                                              method, timeBudget, seed)]
+    total, groups, scores = max(results, key=lambda result: result[0])
+    return groups, scores
+
+def get_pool(workers : int):
+    """Retrieve the shared process pool, creating it on first use.
+
+    Workers are spawned rather than forked, since the server process
+    runs request threads.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(workers, os.cpu_count() or 1),
+                                    mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool():
+    """Shut down the shared process pool, if it was started."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+def discard_pool(pool : ProcessPoolExecutor):
+    """Shut down a broken pool, so the next get_pool starts a new one.
+
+    Does nothing to the shared pool if another caller already replaced it.
+    """
+    global _pool
+    if _pool is pool:
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
@@ -3,6 +3,7 @@ import string
 
 ALLOWED_TYPES = string.ascii_uppercase + string.digits
 PASSCODE_LENGTH = 6
+MAX_ATTEMPTS = 32
 
 def create_passcode():
     """Creates an ASCII and digit passcode.
@@ -13,4 +14,17 @@ def create_passcode():
     chars = [secrets.choice(ALLOWED_TYPES) 
              for i in range(PASSCODE_LENGTH)]
     passcode = ''.join(chars)
-    return passcode
\ No newline at end of file
+    return passcode
+
+def allocate_passcode(reserve):
+    """Creates a passcode that no other section holds.
+
+    'reserve' is called with each new passcode and returns whether it
+    claimed it, which a section store does atomically. Collisions are
+    retried up to MAX_ATTEMPTS times before giving up with None.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        passcode = create_passcode()
+        if reserve(passcode):
+            return passcode
+    return None
\ No newline at end of file
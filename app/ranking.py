@@ -0,0 +1,77 @@
+"""Ranking and comparison of classmates' schedules, independent of any store."""
+import heapq
+from records import SectionRecord
+from serialization import SlotMask
+from metrics import timed
+
+@timed("top_ranked")
+def top_ranked(section : SectionRecord, scores, student_id : int, limit : int | None = None,
+               offset : int = 0, minScore : float = 0):
+    """Retrieve one page of a student's classmates ranked by their row of scores.
+
+    Classmates are ordered by score, highest first, with ties broken by
+    lowest student id. When a limit is given only the top offset + limit
+    classmates are selected through a heap instead of sorting all of them.
+
+    Returns the number of classmates at or above minScore, and a list of
+    tuples containing: 
+    (classmateDisplayName, classmateHours, classmateContactDetails, student_id)
+    """
+    row = scores.tolist()
+    slotHours = section.registry.slotHours
+    candidates = [(-score, classmate_id) for classmate_id, score in enumerate(row)
+                  if classmate_id != student_id and score * slotHours >= minScore]
+    if limit is None:
+        selected = sorted(candidates)[offset:]
+    else:
+        selected = heapq.nsmallest(offset + limit, candidates)[offset:]
+    studentList = section.studentList
+    rankedHours = []
+    for negativeScore, classmate_id in selected:
+        student = studentList[classmate_id]
+        rankedHours.append((student.displayName, -negativeScore * slotHours,
+                            student.contactDetails, classmate_id))
+    return len(candidates), rankedHours
+
+def schedule_intersection(studentAMask : int, studentBMask : int, maskType : type = SlotMask):
+    """Slots two students share, and the slots only each of them has free.
+
+    maskType is the slot_mask_type of the section's grid.
+    """
+    return {"intersections":maskType(studentAMask & studentBMask),
+            "studentADiff":maskType(studentAMask & ~studentBMask),
+            "studentBDiff":maskType(studentBMask & ~studentAMask)}
+
+def schedule_intersections(studentList, student_id : int, classmate_ids,
+                           maskType : type = SlotMask):
+    """Intersections of a student with each of classmate_ids, by classmate id.
+
+    Classmates without a schedule are left out, as is everyone when the
+    student has none.
+    """
+    studentAMask = studentList[student_id].scheduleMask
+    intersections = {}
+    if studentAMask:
+        for classmate_id in classmate_ids:
+            studentBMask = studentList[classmate_id].scheduleMask
+            if studentBMask:
+                intersections[classmate_id] = schedule_intersection(studentAMask,
+                                                                    studentBMask, maskType)
+    return intersections
+
+def parse_classmate_ids(classmates : str, studentCount : int, student_id : int | None = None):
+    """Parse "all" or comma-separated classmate ids of a section of studentCount students.
+
+    "all" means every student other than student_id. Repeated ids are
+    kept once, in order of first appearance. Returns None if any id is
+    malformed or not in the section.
+    """
+    if classmates == "all":
+        return [i for i in range(studentCount) if i != student_id]
+    try:
+        classmate_ids = list(dict.fromkeys(int(i) for i in classmates.split(",")))
+    except ValueError:
+        return None
+    if not all(0 <= classmate_id < studentCount for classmate_id in classmate_ids):
+        return None
+    return classmate_ids
@@ -0,0 +1,75 @@
+"""Compact in-memory records of stored sections and students.
+
+Stores keep these instead of the pydantic models, which carry a
+per-instance __dict__ and validation state that resident sections do not
+need. The models stay at the API edge; from_model converts a validated
+request body into its record.
+"""
+import sys
+from models import Student, Section
+from schedules import DEFAULT_REGISTRY, SlotRegistry
+
+class StudentRecord:
+    """
+    Stored form of a Student
+
+    displayName: The name of student
+    contactDetails: Chosen contact details of student
+    scheduleMask: Bitmask of the student's schedule slots, in the slots
+                  of the section's SlotRegistry
+    scheduleVersion: Number of saved updates to the schedule
+    """
+    __slots__ = ("displayName", "contactDetails", "scheduleMask", "scheduleVersion")
+
+    def __init__(self, displayName : str, contactDetails : str, scheduleMask : int = 0,
+                 scheduleVersion : int = 0):
+        self.displayName = displayName
+        self.contactDetails = contactDetails
+        self.scheduleMask = scheduleMask
+        self.scheduleVersion = scheduleVersion
+
+    @classmethod
+    def from_model(cls, student : Student, registry : SlotRegistry = DEFAULT_REGISTRY):
+        """Convert a new Student, interning its schedule against a section's grid.
+
+        Raises ValueError if the schedule has slots that are not in the grid.
+        """
+        return cls(student.displayName, student.contactDetails,
+                   registry.intern(student.scheduleSlots))
+
+class SectionRecord:
+    """
+    Stored form of a Section
+
+    sectionName: The name of section
+    sectionDetails: Details for section
+    maxSize: Maximum students under section
+    studentList: List of StudentRecords joined in section
+    registry: SlotRegistry of the section's schedule grid
+    """
+    __slots__ = ("sectionName", "sectionDetails", "maxSize", "studentList", "registry")
+
+    def __init__(self, sectionName : str, sectionDetails : str, maxSize : int,
+                 studentList : list | None = None, registry : SlotRegistry = DEFAULT_REGISTRY):
+        self.sectionName = sectionName
+        self.sectionDetails = sectionDetails
+        self.maxSize = maxSize
+        self.studentList = studentList if studentList is not None else []
+        self.registry = registry
+
+    @classmethod
+    def from_model(cls, section : Section):
+        """Convert a Section. Raises ValueError if a student's schedule is not in its grid."""
+        registry = section.registry
+        return cls(section.sectionName, section.sectionDetails, section.maxSize,
+                   [StudentRecord.from_model(i, registry) for i in section.studentList],
+                   registry)
+
+def record_bytes(section):
+    """Estimate the bytes held by a section and its students."""
+    total = (sys.getsizeof(section) + sys.getsizeof(section.studentList)
+             + sys.getsizeof(section.sectionName) + sys.getsizeof(section.sectionDetails))
+    for student in section.studentList:
+        total += (sys.getsizeof(student) + sys.getsizeof(student.displayName)
+                  + sys.getsizeof(student.contactDetails) + sys.getsizeof(student.scheduleMask))
+    return total
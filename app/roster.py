@@ -0,0 +1,139 @@
+"""Bulk import and streaming export of section rosters.
+
+Rosters are read and written as NDJSON, one JSON object per line, or as
+CSV with a header row. Schedules are lists of slot strings in NDJSON and
+space-separated slot strings in CSV.
+"""
+import csv
+import io
+import json
+from schedules import DEFAULT_REGISTRY, SlotRegistry
+from similarity import masks_to_matrix, fused_scores
+from records import StudentRecord
+
+NDJSON_TYPE = "application/x-ndjson"
+CSV_TYPE = "text/csv"
+CSV_FIELDS = ["kind", "student_id", "classmate_id", "displayName", "contactDetails",
+              "schedule", "cumulative", "consecutive"]
+EXPORT_BLOCK = 64
+
+def parse_rows(text : str, csvFormat : bool):
+    """Parse roster rows into (line, displayName, contactDetails, slots) tuples.
+
+    Pair rows of an export are skipped, so exports can be imported again.
+    Returns (rows, errors), where errors describes every malformed row
+    by its 1-based line in the roster.
+    """
+    rows = []
+    errors = []
+    if csvFormat:
+        reader = csv.DictReader(io.StringIO(text))
+        items = [(reader.line_num, item) for item in reader]
+        items = [(line, dict(item, schedule=(item.get("schedule") or "").split()))
+                 for line, item in items]
+    else:
+        items = []
+        for line, item in enumerate(text.splitlines(), 1):
+            if item.strip():
+                try:
+                    items.append((line, json.loads(item)))
+                except ValueError:
+                    errors.append(f"line {line}: invalid JSON")
+    for line, item in items:
+        if not isinstance(item, dict):
+            errors.append(f"line {line}: expected an object")
+            continue
+        if item.get("kind") == "pair" or item.get("classmate_id") not in (None, ""):
+            continue
+        displayName = item.get("displayName")
+        contactDetails = item.get("contactDetails")
+        slots = item.get("schedule") or []
+        if not isinstance(displayName, str) or not displayName:
+            errors.append(f"line {line}: missing displayName")
+        elif not isinstance(contactDetails, str):
+            errors.append(f"line {line}: missing contactDetails")
+        elif not isinstance(slots, list) or not all(isinstance(i, str) for i in slots):
+            errors.append(f"line {line}: schedule must be a list of slots")
+        else:
+            rows.append((line, displayName, contactDetails, slots))
+    return rows, errors
+
+def read_roster(text : str, csvFormat : bool, registry : SlotRegistry = DEFAULT_REGISTRY):
+    """Read a roster into StudentRecords, validating every row.
+
+    The schedules of every row are interned against the section's grid
+    in one vectorized pass. Returns (students, errors), with no students
+    unless errors is empty.
+    """
+    rows, errors = parse_rows(text, csvFormat)
+    masks, invalid = registry.intern_many([slots for line, name, contact, slots in rows])
+    for (line, name, contact, slots), rowInvalid in zip(rows, invalid):
+        if rowInvalid:
+            errors.append(f"line {line}: unknown slots {', '.join(sorted(set(rowInvalid)))}")
+    if errors:
+        return [], errors
+    return [StudentRecord(name, contact, mask)
+            for (line, name, contact, slots), mask in zip(rows, masks)], []
+
+def pair_scores(masks, registry : SlotRegistry = DEFAULT_REGISTRY):
+    """Yield (student_id, classmate_id, cumulative, consecutive) for every pair.
+
+    Pairs are scored EXPORT_BLOCK students at a time, so only a block of
+    rows of the similarity matrices is ever held in memory.
+    """
+    schedules = masks_to_matrix(masks, registry)
+    for start in range(0, len(masks), EXPORT_BLOCK):
+        block = schedules[start:start + EXPORT_BLOCK]
+        cumulative, consecutive, perDay = fused_scores(block, schedules, registry)
+        for row in range(len(block)):
+            student_id = start + row
+            for classmate_id in range(student_id + 1, len(masks)):
+                yield (student_id, classmate_id,
+                       float(cumulative[row, classmate_id]) * registry.slotHours,
+                       float(consecutive[row, classmate_id]) * registry.slotHours)
+
+def export_ndjson(students, scores : bool = True, registry : SlotRegistry = DEFAULT_REGISTRY):
+    """Yield a roster as NDJSON, one line per student, then one per pair.
+
+    students: List of (displayName, contactDetails, scheduleMask)
+    """
+    for student_id, (displayName, contactDetails, mask) in enumerate(students):
+        yield json.dumps({"student_id":student_id, "displayName":displayName,
+                          "contactDetails":contactDetails,
+                          "schedule":registry.slot_list(mask)}).encode() + b"\n"
+    if scores:
+        lines = []
+        for student_id, classmate_id, cumulative, consecutive in pair_scores(
+                [mask for displayName, contactDetails, mask in students], registry):
+            lines.append(json.dumps({"student_id":student_id, "classmate_id":classmate_id,
+                                     "cumulative":cumulative, "consecutive":consecutive}))
+            if len(lines) >= 1024:
+                yield "\n".join(lines).encode() + b"\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines).encode() + b"\n"
+
+def export_csv(students, scores : bool = True, registry : SlotRegistry = DEFAULT_REGISTRY):
+    """Yield a roster as CSV rows of kind 'student', then rows of kind 'pair'.
+
+    students: List of (displayName, contactDetails, scheduleMask)
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for student_id, (displayName, contactDetails, mask) in enumerate(students):
+        writer.writerow(["student", student_id, "", displayName, contactDetails,
+                         " ".join(registry.slot_list(mask)), "", ""])
+    yield buffer.getvalue().encode()
+    if scores:
+        buffer.seek(0)
+        buffer.truncate()
+        for student_id, classmate_id, cumulative, consecutive in pair_scores(
+                [mask for displayName, contactDetails, mask in students], registry):
+            writer.writerow(["pair", student_id, classmate_id, "", "", "",
+                             cumulative, consecutive])
+            if buffer.tell() >= 65536:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode()
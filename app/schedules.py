@@ -0,0 +1,265 @@
+"""Bitmask representation of the weekly schedule grid.
+
+Every slot in ALLPOSSIBLETIMES owns one bit of an integer, in list order.
+The "" day separators also own a bit which is never set, so runs of set
+bits can never cross from one day into the next.
+
+ALLPOSSIBLETIMES is the default grid. Sections may use another slot
+length or range of days and hours, described by a SlotRegistry; the
+module-level helpers work on the default grid.
+"""
+import base64
+import threading
+from itertools import chain, repeat
+import numpy as np
+
+ALLPOSSIBLETIMES = [
+    "0-0800-0830", "0-0830-0900", "0-0900-0930", "0-0930-1000", "0-1000-1030",
+    "0-1030-1100", "0-1100-1130", "0-1130-1200", "0-1200-1230", 
+    "0-1230-1300", "0-1300-1330", "0-1330-1400", "0-1400-1430", "0-1430-1500",
+    "0-1500-1530", "0-1530-1600", "0-1600-1630", "0-1630-1700", "0-1700-1730",
+    "0-1730-1800", "0-1800-1830", "0-1830-1900", "0-1900-1930", "0-1930-2000", "", 
+    "1-0800-0830", "1-0830-0900", "1-0900-0930", "1-0930-1000", "1-1000-1030",
+    "1-1030-1100", "1-1100-1130", "1-1130-1200", "1-1200-1230", 
+    "1-1230-1300", "1-1300-1330", "1-1330-1400", "1-1400-1430", "1-1430-1500",
+    "1-1500-1530", "1-1530-1600", "1-1600-1630", "1-1630-1700", "1-1700-1730",
+    "1-1730-1800", "1-1800-1830", "1-1830-1900", "1-1900-1930", "1-1930-2000", "", 
+    "2-0800-0830", "2-0830-0900", "2-0900-0930", "2-0930-1000", "2-1000-1030",
+    "2-1030-1100", "2-1100-1130", "2-1130-1200", "2-1200-1230", 
+    "2-1230-1300", "2-1300-1330", "2-1330-1400", "2-1400-1430", "2-1430-1500",
+    "2-1500-1530", "2-1530-1600", "2-1600-1630", "2-1630-1700", "2-1700-1730",
+    "2-1730-1800", "2-1800-1830", "2-1830-1900", "2-1900-1930", "2-1930-2000", "", 
+    "3-0800-0830", "3-0830-0900", "3-0900-0930", "3-0930-1000", "3-1000-1030",
+    "3-1030-1100", "3-1100-1130", "3-1130-1200", "3-1200-1230", 
+    "3-1230-1300", "3-1300-1330", "3-1330-1400", "3-1400-1430", "3-1430-1500",
+    "3-1500-1530", "3-1530-1600", "3-1600-1630", "3-1630-1700", "3-1700-1730",
+    "3-1730-1800", "3-1800-1830", "3-1830-1900", "3-1900-1930", "3-1930-2000", "", 
+    "4-0800-0830", "4-0830-0900", "4-0900-0930", "4-0930-1000", "4-1000-1030",
+    "4-1030-1100", "4-1100-1130", "4-1130-1200", "4-1200-1230", 
+    "4-1230-1300", "4-1300-1330", "4-1330-1400", "4-1400-1430", "4-1430-1500",
+    "4-1500-1530", "4-1530-1600", "4-1600-1630", "4-1630-1700", "4-1700-1730",
+    "4-1730-1800", "4-1800-1830", "4-1830-1900", "4-1900-1930", "4-1930-2000", "", 
+    "5-0800-0830", "5-0830-0900", "5-0900-0930", "5-0930-1000", "5-1000-1030",
+    "5-1030-1100", "5-1100-1130", "5-1130-1200", "5-1200-1230", 
+    "5-1230-1300", "5-1300-1330", "5-1330-1400", "5-1400-1430", "5-1430-1500",
+    "5-1500-1530", "5-1530-1600", "5-1600-1630", "5-1630-1700", "5-1700-1730",
+    "5-1730-1800", "5-1800-1830", "5-1830-1900", "5-1900-1930", "5-1930-2000", "", 
+    "6-0800-0830", "6-0830-0900", "6-0900-0930", "6-0930-1000", "6-1000-1030",
+    "6-1030-1100", "6-1100-1130", "6-1130-1200", "6-1200-1230", 
+    "6-1230-1300", "6-1300-1330", "6-1330-1400", "6-1400-1430", "6-1430-1500",
+    "6-1500-1530", "6-1530-1600", "6-1600-1630", "6-1630-1700", "6-1700-1730",
+    "6-1730-1800", "6-1800-1830", "6-1830-1900", "6-1900-1930", "6-1930-2000", "", 
+]
+
+SLOT_MINUTES = (15, 30, 60)
+DAY_NAMES = ["Mon", "Tues", "Wed", "Thurs", "Fri", "Sat", "Sun"]
+
+def clock_time(minutes : int):
+    """Format minutes since midnight as HHMM."""
+    return f"{minutes // 60:02d}{minutes % 60:02d}"
+
+class SlotRegistry:
+    """
+    Precomputed layout of a section's schedule grid
+
+    Slot strings are "day-HHMM-HHMM", with days counted from Monday. Every
+    slot owns one bit of a schedule bitmask, in week order, and every day
+    ends with a separator bit that is never set.
+
+    minutes: Length of every slot, one of SLOT_MINUTES
+    firstDay: First day of the grid, 0 being Monday
+    lastDay: Last day of the grid, at most 6
+    startHour: Hour the first slot of every day starts
+    endHour: Hour the last slot of every day ends
+    slots: Slot string of every bit, "" for separators
+    days: Day of every bit, counted from firstDay
+    indices: Bit index of every slot string
+    bits: Bit of every slot string
+    validMask: Bitmask with every slot set
+    maskBytes: Bytes of a packed schedule bitmask
+    slotHours: Hours in one slot
+    """
+    def __init__(self, minutes : int = 30, firstDay : int = 0, lastDay : int = 6,
+                 startHour : int = 8, endHour : int = 20):
+        if minutes not in SLOT_MINUTES:
+            raise ValueError(f"slot length must be one of {SLOT_MINUTES} minutes")
+        if not 0 <= firstDay <= lastDay <= 6:
+            raise ValueError("days must satisfy 0 <= firstDay <= lastDay <= 6")
+        if not 0 <= startHour < endHour <= 24:
+            raise ValueError("hours must satisfy 0 <= startHour < endHour <= 24")
+        self.minutes = minutes
+        self.firstDay = firstDay
+        self.lastDay = lastDay
+        self.startHour = startHour
+        self.endHour = endHour
+        self.slots = []
+        self.days = []
+        for day in range(firstDay, lastDay + 1):
+            for start in range(startHour * 60, endHour * 60, minutes):
+                self.slots.append(f"{day}-{clock_time(start)}-{clock_time(start + minutes)}")
+            self.slots.append("")
+            self.days.extend([day - firstDay] * (len(self.slots) - len(self.days)))
+        self.indices = {slot: index for index, slot in enumerate(self.slots) if slot != ""}
+        self.bits = {slot: 1 << index for slot, index in self.indices.items()}
+        self.validMask = sum(self.bits.values())
+        self.maskBytes = (len(self.slots) + 7) // 8
+        self.slotHours = minutes / 60
+
+    @property
+    def dayCount(self):
+        return self.lastDay - self.firstDay + 1
+
+    @property
+    def dayNames(self):
+        return DAY_NAMES[self.firstDay:self.lastDay + 1]
+
+    def to_mask(self, slots):
+        """Pack an iterable of slot strings into a schedule bitmask.
+
+        Strings that are not slots of the grid are ignored.
+        """
+        mask = 0
+        for slot in slots:
+            mask |= self.bits.get(slot, 0)
+        return mask
+
+    def intern_many(self, schedules):
+        """Validate and pack many lists of slot strings in one vectorized pass.
+
+        The slot strings of every schedule are mapped to their bit indices
+        in a single lookup over all of them, -1 marking strings that are
+        not slots of the grid, and the indices are then scattered into a
+        bit matrix and packed into bitmasks with NumPy. Returns (masks,
+        invalid), where invalid lists the unknown strings of each schedule.
+        """
+        lengths = [len(schedule) for schedule in schedules]
+        total = sum(lengths)
+        masks = [0] * len(schedules)
+        invalid = [[] for i in schedules]
+        if not total:
+            return masks, invalid
+        indices = np.fromiter(map(self.indices.get, chain.from_iterable(schedules),
+                                  repeat(-1, total)), dtype=np.int32, count=total)
+        rows = np.repeat(np.arange(len(schedules)), lengths)
+        found = indices >= 0
+        bits = np.zeros((len(schedules), self.maskBytes * 8), dtype=np.uint8)
+        bits[rows[found], indices[found]] = 1
+        packed = np.packbits(bits, axis=1, bitorder="little").tobytes()
+        masks = [int.from_bytes(packed[start:start + self.maskBytes], "little")
+                 for start in range(0, len(packed), self.maskBytes)]
+        if not found.all():
+            offsets = np.cumsum([0] + lengths)
+            for position in np.flatnonzero(~found).tolist():
+                row = int(rows[position])
+                invalid[row].append(schedules[row][position - offsets[row]])
+        return masks, invalid
+
+    def intern(self, slots):
+        """Pack a list of slot strings into a schedule bitmask.
+
+        Raises ValueError naming the strings that are not slots of the grid.
+        """
+        masks, invalid = self.intern_many([list(slots)])
+        if invalid[0]:
+            raise ValueError(f"unknown slots: {', '.join(sorted(set(invalid[0])))}")
+        return masks[0]
+
+    def from_mask(self, mask : int):
+        """Unpack a schedule bitmask into a set of slot strings."""
+        return {self.slots[i] for i in mask_slots(mask)}
+
+    def slot_list(self, mask : int):
+        """List the slot strings of a schedule bitmask, in week order."""
+        return [self.slots[i] for i in mask_slots(mask)]
+
+    def free_windows(self, mask : int):
+        """Split a schedule bitmask into its runs of consecutive slots.
+
+        Returns a list of (day, firstSlot, lastSlot, length) tuples in week
+        order, where day is counted from Monday and the slots are slot
+        strings. Runs never cross a day, since separator bits are never set.
+        """
+        windows = []
+        while mask:
+            start = (mask & -mask).bit_length() - 1
+            shifted = mask >> start
+            length = (~shifted & (shifted + 1)).bit_length() - 1
+            end = start + length - 1
+            windows.append((self.firstDay + self.days[start], self.slots[start],
+                            self.slots[end], length))
+            mask &= ~(((1 << length) - 1) << start)
+        return windows
+
+    def encode_mask(self, mask : int):
+        """Encode a schedule bitmask as little-endian base64 text."""
+        return base64.b64encode(mask.to_bytes(self.maskBytes, "little")).decode("ascii")
+
+    def decode_mask(self, text : str):
+        """Decode base64 text from encode_mask into a schedule bitmask.
+
+        Raises ValueError if the text is not base64 of at most maskBytes bytes,
+        or sets any bit that is not a slot of the grid.
+        """
+        raw = base64.b64decode(text, validate=True)
+        if len(raw) > self.maskBytes:
+            raise ValueError("encoded schedule is too long")
+        mask = int.from_bytes(raw, "little")
+        if mask & ~self.validMask:
+            raise ValueError("encoded schedule has bits outside the grid")
+        return mask
+
+registries = {}
+registriesLock = threading.Lock()
+
+def slot_registry(minutes : int = 30, firstDay : int = 0, lastDay : int = 6,
+                  startHour : int = 8, endHour : int = 20):
+    """Retrieve the shared SlotRegistry of a grid, building it on first use.
+
+    Raises ValueError if the grid is not valid.
+    """
+    key = (minutes, firstDay, lastDay, startHour, endHour)
+    registry = registries.get(key)
+    if registry is None:
+        with registriesLock:
+            registry = registries.get(key)
+            if registry is None:
+                registry = registries[key] = SlotRegistry(*key)
+    return registry
+
+def mask_slots(mask : int):
+    """Bit indices of the set bits of a schedule bitmask."""
+    slots = []
+    while mask:
+        lowestBit = mask & -mask
+        slots.append(lowestBit.bit_length() - 1)
+        mask ^= lowestBit
+    return slots
+
+def count_slots(mask : int):
+    """Number of slots set in a schedule bitmask."""
+    return mask.bit_count()
+
+def longest_run(mask : int):
+    """Length in slots of the longest run of consecutive set bits.
+
+    Each step clears the last bit of every run, so the loop runs once
+    per slot of the longest run instead of once per slot of the week.
+    """
+    length = 0
+    while mask:
+        mask &= mask >> 1
+        length += 1
+    return length
+
+DEFAULT_REGISTRY = slot_registry()
+SLOT_HOURS = DEFAULT_REGISTRY.slotHours
+SLOT_BITS = DEFAULT_REGISTRY.bits
+VALID_MASK = DEFAULT_REGISTRY.validMask
+SLOT_DAYS = DEFAULT_REGISTRY.days
+MASK_BYTES = DEFAULT_REGISTRY.maskBytes
+
+to_mask = DEFAULT_REGISTRY.to_mask
+from_mask = DEFAULT_REGISTRY.from_mask
+free_windows = DEFAULT_REGISTRY.free_windows
+encode_mask = DEFAULT_REGISTRY.encode_mask
+decode_mask = DEFAULT_REGISTRY.decode_mask
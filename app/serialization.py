@@ -0,0 +1,127 @@
+"""Fast encoding of API responses.
+
+Handlers that return a Response skip FastAPI's jsonable_encoder, which
+walks every value of a response in Python before it is serialized. The
+helpers here encode compact JSON with orjson when it is installed, and
+msgpack for clients that send 'Accept: application/msgpack' when msgpack
+is installed. Schedules are encoded from SlotMask bitmasks by joining
+precomputed encodings of their slot strings.
+"""
+import json
+from functools import lru_cache
+from fastapi import Request
+from fastapi.responses import Response
+from schedules import DEFAULT_REGISTRY, SlotRegistry
+from metrics import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+
+class SlotMask(int):
+    """Schedule bitmask to be encoded as a list of slot strings.
+
+    Encodes slots of the default grid; slot_mask_type gives the subclass
+    for any other grid, so building a SlotMask stays a plain int call.
+    """
+    registry = DEFAULT_REGISTRY
+
+@lru_cache(maxsize=None)
+def slot_mask_type(registry : SlotRegistry):
+    """SlotMask subclass for the slot strings of a grid."""
+    if registry is DEFAULT_REGISTRY:
+        return SlotMask
+    return type("SlotMask", (SlotMask,), {"registry": registry})
+
+@lru_cache(maxsize=None)
+def byte_slot_json(registry : SlotRegistry):
+    """Encoded slots of every value of every byte of a grid's bitmasks.
+
+    Built once per grid, as registries are shared by every section with
+    the same layout.
+    """
+    slots = registry.slots
+    slotJson = [json.dumps(slot).encode() for slot in slots]
+    return [[b",".join([slotJson[8 * byte + bit] for bit in range(8)
+                        if value >> bit & 1 and 8 * byte + bit < len(slots)
+                        and slots[8 * byte + bit]])
+             for value in range(256)] for byte in range(registry.maskBytes)]
+
+def to_builtin(value):
+    """Convert a NumPy array or scalar for encoders without NumPy support."""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"cannot encode {type(value).__name__}")
+
+def dumps(content):
+    """Encode content as compact JSON bytes.
+
+    NumPy arrays are encoded directly by orjson, without first building
+    lists of Python numbers.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=to_builtin, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False,
+                      default=to_builtin).encode()
+
+def slots_json(mask : int, registry : SlotRegistry = DEFAULT_REGISTRY):
+    """Encode the slots of a schedule bitmask as a JSON array, in week order.
+
+    byte_slot_json holds the encoded slots of every value of every byte
+    of a mask, so a schedule costs one lookup per byte instead of one
+    encoding per slot.
+    """
+    raw = mask.to_bytes(registry.maskBytes, "little")
+    return b"[" + b",".join([table[value] for table, value
+                             in zip(byte_slot_json(registry), raw) if value]) + b"]"
+
+def encode_json(content):
+    """Encode content as compact JSON bytes, expanding every SlotMask.
+
+    Only dicts are searched for SlotMasks; any other value is encoded
+    whole by dumps.
+    """
+    if isinstance(content, SlotMask):
+        return slots_json(content, content.registry)
+    if isinstance(content, dict):
+        return b"{" + b",".join([dumps(str(key)) + b":" + encode_json(value)
+                                 for key, value in content.items()]) + b"}"
+    return dumps(content)
+
+def expand_masks(content):
+    """Replace every SlotMask in nested dicts with its list of slot strings."""
+    if isinstance(content, SlotMask):
+        return content.registry.slot_list(content)
+    if isinstance(content, dict):
+        return {key: expand_masks(value) for key, value in content.items()}
+    return content
+
+def accepts_msgpack(request : Request):
+    """Verify if a client asked for msgpack and it can be produced."""
+    return msgpack is not None and MSGPACK_TYPE in request.headers.get("accept", "")
+
+@timed("encode_response")
+def encode_content(content, msgpackFormat : bool = False):
+    """Encode content as msgpack or compact JSON.
+
+    Returns (body, mediaType).
+    """
+    if msgpackFormat:
+        return msgpack.packb(expand_masks(content), default=to_builtin), MSGPACK_TYPE
+    return encode_json(content), JSON_TYPE
+
+def fast_response(request : Request, content, headers : dict | None = None):
+    """Encode content as msgpack if the client accepts it, else as compact JSON."""
+    body, mediaType = encode_content(content, accepts_msgpack(request))
+    response = Response(body, media_type=mediaType, headers=headers)
+    response.headers["Vary"] = "Accept"
+    return response
@@ -0,0 +1,140 @@
+import numpy as np
+from schedules import DEFAULT_REGISTRY, SlotRegistry
+
+def masks_to_matrix(masks, registry : SlotRegistry = DEFAULT_REGISTRY):
+    """Unpack schedule bitmasks into an n x slot count uint8 matrix.
+
+    Row i holds the schedule of student i, column j the slot
+    registry.slots[j]. Separator columns are always zero.
+    """
+    packed = b"".join(mask.to_bytes(registry.maskBytes, "little") for mask in masks)
+    rows = np.frombuffer(packed, dtype=np.uint8).reshape(len(masks), registry.maskBytes)
+    bits = np.unpackbits(rows, axis=1, bitorder="little")
+    return bits[:, :len(registry.slots)]
+
+def fused_scores(left, right, registry : SlotRegistry = DEFAULT_REGISTRY):
+    """Score every row of one schedule matrix against every row of another.
+
+    Walks the slots once and computes, for every pair of rows, the shared
+    slots per day, their total, and the longest run of consecutive shared
+    slots. Separator columns reset every run, so runs never cross from
+    one day into the next.
+
+    Returns (cumulative, consecutive, perDay), where cumulative and
+    consecutive are a x b matrices and perDay is registry.dayCount x a x b.
+    """
+    shape = (len(left), len(right))
+    currentRun = np.zeros(shape, dtype=np.int32)
+    longestRun = np.zeros(shape, dtype=np.int32)
+    perDay = np.zeros((registry.dayCount,) + shape, dtype=np.uint8)
+    leftColumns = left.T.astype(bool)
+    rightColumns = right.T.astype(bool)
+    for slot in range(len(registry.slots)):
+        leftColumn = leftColumns[slot]
+        rightColumn = rightColumns[slot]
+        if not leftColumn.any() or not rightColumn.any():
+            currentRun[:] = 0
+            continue
+        shared = np.logical_and.outer(leftColumn, rightColumn)
+        currentRun += 1
+        currentRun *= shared
+        np.maximum(longestRun, currentRun, out=longestRun)
+        perDay[registry.days[slot]] += shared
+    cumulative = perDay.sum(axis=0, dtype=np.int32)
+    return cumulative, longestRun, perDay
+
+def row_scores(mask : int, masks, registry : SlotRegistry = DEFAULT_REGISTRY):
+    """Score one schedule against every schedule of a section.
+
+    Gives the same row as a SectionMatrix of the section would, in memory
+    linear in the section's size instead of quadratic.
+
+    Returns (cumulative, consecutive, perDay), where cumulative and
+    consecutive have one entry per schedule and perDay is
+    registry.dayCount x that.
+    """
+    cumulative, consecutive, perDay = fused_scores(masks_to_matrix([mask], registry),
+                                                   masks_to_matrix(masks, registry), registry)
+    return cumulative[0], consecutive[0], perDay[:, 0]
+
+class SectionMatrix:
+    """
+    Pairwise schedule similarity of every student in a section
+
+    registry: SlotRegistry of the section's schedule grid
+    schedules: n x slot count matrix of the section's schedules
+    cumulative: n x n matrix of shared slot counts
+    consecutive: n x n matrix of longest shared slot runs
+    perDay: day count x n x n matrix of shared slot counts per day
+
+    Arrays are allocated with spare capacity so that a joining student
+    only costs one new row and column instead of a full copy.
+    """
+    def __init__(self, masks, registry : SlotRegistry = DEFAULT_REGISTRY):
+        self.registry = registry
+        schedules = masks_to_matrix(masks, registry)
+        self.size = len(masks)
+        self._allocate(max(self.size, 8))
+        self._schedules[:self.size] = schedules
+        cumulative, consecutive, perDay = fused_scores(schedules, schedules, registry)
+        self._cumulative[:self.size, :self.size] = cumulative
+        self._consecutive[:self.size, :self.size] = consecutive
+        self._perDay[:, :self.size, :self.size] = perDay
+
+    @property
+    def schedules(self):
+        return self._schedules[:self.size]
+
+    @property
+    def cumulative(self):
+        return self._cumulative[:self.size, :self.size]
+
+    @property
+    def consecutive(self):
+        return self._consecutive[:self.size, :self.size]
+
+    @property
+    def perDay(self):
+        return self._perDay[:, :self.size, :self.size]
+
+    @property
+    def nbytes(self):
+        """Bytes allocated for the matrices, spare capacity included."""
+        return (self._schedules.nbytes + self._cumulative.nbytes + self._consecutive.nbytes
+                + self._perDay.nbytes)
+
+    def add_student(self, mask : int):
+        """Append a student and score them against the section."""
+        if self.size == len(self._schedules):
+            self._grow(2 * self.size)
+        self.size += 1
+        self.update_student(self.size - 1, mask)
+
+    def update_student(self, student_id : int, mask : int):
+        """Replace a student's schedule and rescore only their row and column."""
+        schedule = masks_to_matrix([mask], self.registry)
+        self._schedules[student_id] = schedule[0]
+        cumulative, consecutive, perDay = fused_scores(schedule, self.schedules, self.registry)
+        self._cumulative[student_id, :self.size] = cumulative[0]
+        self._cumulative[:self.size, student_id] = cumulative[0]
+        self._consecutive[student_id, :self.size] = consecutive[0]
+        self._consecutive[:self.size, student_id] = consecutive[0]
+        self._perDay[:, student_id, :self.size] = perDay[:, 0]
+        self._perDay[:, :self.size, student_id] = perDay[:, 0]
+
+    def _allocate(self, capacity : int):
+        """Allocate empty arrays with room for capacity students."""
+        self._schedules = np.zeros((capacity, len(self.registry.slots)), dtype=np.uint8)
+        self._cumulative = np.zeros((capacity, capacity), dtype=np.int32)
+        self._consecutive = np.zeros((capacity, capacity), dtype=np.int32)
+        self._perDay = np.zeros((self.registry.dayCount, capacity, capacity), dtype=np.uint8)
+
+    def _grow(self, capacity : int):
+        """Reallocate the arrays with room for capacity students."""
+        schedules, cumulative = self.schedules, self.cumulative
+        consecutive, perDay = self.consecutive, self.perDay
+        self._allocate(capacity)
+        self._schedules[:self.size] = schedules
+        self._cumulative[:self.size, :self.size] = cumulative
+        self._consecutive[:self.size, :self.size] = consecutive
+        self._perDay[:, :self.size, :self.size] = perDay
@@ -0,0 +1,162 @@
+"""Compact binary snapshots of every section of a store.
+
+A snapshot file holds, in order:
+    header    MAGIC, the number of sections and the offset of the index
+    sections  one record per section: its fields and grid, its students'
+              names, contacts and schedule versions, then their schedules
+              as one block of packed little-endian bitmasks
+    index     one fixed-size entry per section, sorted by passcode
+
+Snapshots are memory-mapped when opened and the index is binary searched
+in place, so opening one costs the same whatever its size, and a section
+is only decoded when it is first loaded.
+"""
+import mmap
+import os
+import struct
+from records import StudentRecord, SectionRecord
+from schedules import slot_registry
+
+MAGIC = b"GMSNAP01"
+HEADER = struct.Struct("<8sIQ")
+INDEX_ENTRY = struct.Struct("<16sQId")
+SECTION_HEADER = struct.Struct("<qIBBBBBII")
+STUDENT_HEADER = struct.Struct("<QII")
+KEY_BYTES = 16
+
+def passcode_key(passcode : str):
+    """Fixed-width index key of a passcode."""
+    key = passcode.encode()
+    if len(key) > KEY_BYTES:
+        raise ValueError(f"passcode longer than {KEY_BYTES} bytes")
+    return key.ljust(KEY_BYTES, b"\0")
+
+def encode_section(section):
+    """Encode a section and its students as a snapshot record."""
+    registry = section.registry
+    studentList = section.studentList
+    name = section.sectionName.encode()
+    details = section.sectionDetails.encode()
+    parts = [SECTION_HEADER.pack(section.maxSize, len(studentList), registry.minutes,
+                                 registry.firstDay, registry.lastDay, registry.startHour,
+                                 registry.endHour, len(name), len(details)), name, details]
+    for student in studentList:
+        displayName = student.displayName.encode()
+        contactDetails = student.contactDetails.encode()
+        parts.append(STUDENT_HEADER.pack(student.scheduleVersion, len(displayName),
+                                         len(contactDetails)))
+        parts.append(displayName)
+        parts.append(contactDetails)
+    parts.extend(student.scheduleMask.to_bytes(registry.maskBytes, "little")
+                 for student in studentList)
+    return b"".join(parts)
+
+def decode_section(buffer, offset : int):
+    """Decode the snapshot record at offset of a buffer into a SectionRecord."""
+    (maxSize, count, minutes, firstDay, lastDay, startHour, endHour,
+     nameLength, detailsLength) = SECTION_HEADER.unpack_from(buffer, offset)
+    registry = slot_registry(minutes, firstDay, lastDay, startHour, endHour)
+    position = offset + SECTION_HEADER.size
+    sectionName = buffer[position:position + nameLength].decode()
+    position += nameLength
+    sectionDetails = buffer[position:position + detailsLength].decode()
+    position += detailsLength
+    students = []
+    for i in range(count):
+        scheduleVersion, nameLength, contactLength = STUDENT_HEADER.unpack_from(buffer, position)
+        position += STUDENT_HEADER.size
+        displayName = buffer[position:position + nameLength].decode()
+        position += nameLength
+        contactDetails = buffer[position:position + contactLength].decode()
+        position += contactLength
+        students.append((displayName, contactDetails, scheduleVersion))
+    width = registry.maskBytes
+    masks = buffer[position:position + count * width]
+    studentList = [StudentRecord(displayName, contactDetails,
+                                 int.from_bytes(masks[i * width:(i + 1) * width], "little"),
+                                 scheduleVersion)
+                   for i, (displayName, contactDetails, scheduleVersion) in enumerate(students)]
+    return SectionRecord(sectionName, sectionDetails, maxSize, studentList, registry)
+
+def write_snapshot(path : str, records):
+    """Atomically replace the snapshot at path.
+
+    records: Iterable of (passcode, lastAccess, record), where record is
+             the output of encode_section
+    """
+    records = sorted((passcode_key(passcode), lastAccess, record)
+                     for passcode, lastAccess, record in records)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        offset = HEADER.size
+        index = []
+        for key, lastAccess, record in records:
+            index.append(INDEX_ENTRY.pack(key, offset, len(record), lastAccess))
+            offset += len(record)
+        file.write(HEADER.pack(MAGIC, len(records), offset))
+        file.writelines(record for key, lastAccess, record in records)
+        file.writelines(index)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+class Snapshot:
+    """
+    Read-only, memory-mapped snapshot file
+
+    path: Snapshot file written by write_snapshot
+    count: Number of sections in the snapshot
+    """
+    def __init__(self, path : str):
+        with open(path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.indexOffset = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            self.buffer.close()
+            raise ValueError(f"{path} is not a section snapshot")
+
+    def __contains__(self, passcode : str):
+        return self._find(passcode) is not None
+
+    def load(self, passcode : str):
+        """Decode one section, or return None if it is not in the snapshot."""
+        entry = self._find(passcode)
+        if entry is None:
+            return None
+        return decode_section(self.buffer, entry[1])
+
+    def entries(self):
+        """List (passcode, lastAccess) of every section, in passcode order."""
+        return [(key.rstrip(b"\0").decode(), lastAccess)
+                for key, offset, length, lastAccess in self._entries()]
+
+    def records(self):
+        """Yield (passcode, lastAccess, record) of every section, without decoding them."""
+        for key, offset, length, lastAccess in self._entries():
+            yield key.rstrip(b"\0").decode(), lastAccess, self.buffer[offset:offset + length]
+
+    def close(self):
+        self.buffer.close()
+
+    def _entries(self):
+        return INDEX_ENTRY.iter_unpack(
+            self.buffer[self.indexOffset:self.indexOffset + self.count * INDEX_ENTRY.size])
+
+    def _find(self, passcode : str):
+        """Binary search the index for a passcode's (key, offset, length, lastAccess)."""
+        try:
+            key = passcode_key(passcode)
+        except ValueError:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry = INDEX_ENTRY.unpack_from(self.buffer,
+                                            self.indexOffset + middle * INDEX_ENTRY.size)
+            if entry[0] < key:
+                low = middle + 1
+            elif entry[0] > key:
+                high = middle
+            else:
+                return entry
+        return None
@@ -0,0 +1,65 @@
+// Fetch JSON with the stored ETag -> Reuse the stored copy when the server answers 304.
+function cachedFetch(url) {
+    const cached = JSON.parse(sessionStorage.getItem(url) || "null");
+    const headers = cached ? {"If-None-Match": cached.etag} : {};
+    return fetch(url, {headers: headers, cache: "no-store"})
+    .then(response => {
+        if (response.status === 304 && cached) {
+            return cached.data;
+        }
+        const etag = response.headers.get("ETag");
+        return response.json().then(data => {
+            if (etag) {
+                try {
+                    sessionStorage.setItem(url, JSON.stringify({etag: etag, data: data}));
+                } catch (error) {
+                    sessionStorage.clear();
+                }
+            }
+            return data;
+        });
+    });
+}
+
+// Fill an empty schedule table with day headers and one row per slot of the
+// section's grid, read from the table's data-slot-minutes, data-first-day,
+// data-last-day, data-start-hour and data-end-hour attributes.
+function buildTimeTable(table) {
+    const DAYS = ["Mon", "Tues", "Wed", "Thurs", "Fri", "Sat", "Sun"];
+    const grid = table.dataset;
+    const slotMinutes = parseInt(grid.slotMinutes || "30");
+    const firstDay = parseInt(grid.firstDay || "0");
+    const lastDay = parseInt(grid.lastDay || "6");
+    const startMinutes = parseInt(grid.startHour || "8") * 60;
+    const endMinutes = parseInt(grid.endHour || "20") * 60;
+    const days = DAYS.slice(firstDay, lastDay + 1);
+    const cellClass = grid.cellClass;
+    const headerRow = table.insertRow();
+    headerRow.className = "text-center";
+    ["", ...days].forEach(day => {
+        const header = headerRow.insertCell();
+        header.className = "days-header";
+        header.innerText = day;
+    });
+    for (let minutes = startMinutes; minutes < endMinutes; minutes += slotMinutes) {
+        const row = table.insertRow();
+        const label = row.insertCell();
+        label.className = minutes === startMinutes ? "time-label text-end" : "time-label";
+        if (minutes % 60 === 0) {
+            const hour = minutes / 60;
+            label.innerText = `${(hour + 11) % 12 + 1} ${hour < 12 ? "AM" : "PM"}`;
+        }
+        const time = clockTime(minutes) + "-" + clockTime(minutes + slotMinutes);
+        days.forEach((day, index) => {
+            const cell = row.insertCell();
+            cell.className = cellClass;
+            cell.setAttribute("day", (firstDay + index) + "-");
+            cell.setAttribute("time", time);
+        });
+    }
+}
+
+// Format minutes since midnight as HHMM.
+function clockTime(minutes) {
+    return String(Math.floor(minutes / 60)).padStart(2, "0") + String(minutes % 60).padStart(2, "0");
+}
@@ -0,0 +1,200 @@
+document.addEventListener('DOMContentLoaded', function() {
+    buildTimeTable(document.getElementById("time-table"));
+    const PAGE_SIZE = 20;
+    var groupmatesTable = document.getElementById('groupmate-rank-table');
+    var loadMore = document.getElementById("load-more");
+    var method = "group_cumulative";
+    var rank = 1;
+    var total = 0;
+    var rankedItems = [];
+    var intersectionCache = {};
+    var prefetching = Promise.resolve();
+
+    // Press search -> Fetch first page of cumulative/consecutive ranking.
+    document.getElementById("search-group").onclick = function(event) {
+        var thTime = document.getElementById('th-time');
+        for (let i = groupmatesTable.rows.length - 1; i > 0; i--) {
+            groupmatesTable.deleteRow(i);
+        }
+        if (document.getElementById("method-select").value === "cumulative") {
+            method = "group_cumulative";
+            thTime.innerText = "Total Similar Hours";
+        } else if (document.getElementById("method-select").value === "consecutive") {
+            method = "group_consecutive";
+            thTime.innerText = "Largest Chunk in Hours";
+        } else if (document.getElementById("method-select").value === "combined") {
+            method = "group_combined";
+            thTime.innerText = "Total + Largest Chunk";
+        }
+        rank = 1;
+        rankedItems = [];
+        loadRankingPage();
+    }
+
+    // Press load more -> Fetch the next page of the current ranking.
+    loadMore.onclick = function(event) {
+        loadRankingPage();
+    }
+
+    // Fetch one page of ranked classmates -> Appends them to the table.
+    function loadRankingPage() {
+        const offset = rank - 1;
+        loadMore.hidden = true;
+        cachedFetch(`/api/${PASSCODE}/${STUDENT_ID}/${method}?limit=${PAGE_SIZE}&offset=${offset}`)
+        .then(data => {
+            const loadedIDs = new Set(rankedItems.map(item => item[3]));
+            const rankingList = data["data"].filter(item => !loadedIDs.has(item[3]));
+            rankingList.forEach(item => rankedItems.push(item));
+            rankingList.forEach(addToGroupList);
+            total = data["total"];
+            loadMore.hidden = rank - 1 >= total;
+            prefetchIntersections(rankingList.map(item => item[3]));
+        });
+    }
+
+    // Append one ranked classmate to the table.
+    function addToGroupList(item) {
+        var groupmateTr = document.createElement('tr');
+        var groupmateRank = document.createElement('td');
+        var groupmateName = document.createElement('td');
+        var groupmateHours = document.createElement('td');
+        var groupmateContact = document.createElement('td');
+        var groupmateID = document.createElement('td');
+        groupmateID.hidden = true;
+        groupmateRank.appendChild(document.createTextNode(rank));
+        groupmateName.appendChild(document.createTextNode(item[0]));
+        groupmateHours.appendChild(document.createTextNode(item[1]));
+        groupmateContact.appendChild(document.createTextNode(item[2]));
+        groupmateID.appendChild(document.createTextNode(item[3]))
+        groupmateTr.appendChild(groupmateRank);
+        groupmateTr.appendChild(groupmateName);
+        groupmateTr.appendChild(groupmateHours);
+        groupmateTr.appendChild(groupmateContact);
+        groupmateTr.appendChild(groupmateID);
+        groupmatesTable.appendChild(groupmateTr);
+        rank++;
+
+        groupmateTr.style.cursor = "pointer";
+        groupmateTr.style.backgroundColor = "white";
+        groupmateTr.addEventListener('mouseover', function(){
+            this.style.backgroundColor = "rgb(228,228,228)";
+        });
+        groupmateTr.addEventListener('mouseout', function(){
+            this.style.backgroundColor = "white";
+        });
+        groupmateTr.addEventListener('click', function(){
+
+            let cells = document.querySelectorAll("#time-table .time-cell");
+            var popupBlock = document.getElementById("popup")
+            var nameText = document.getElementById("name-popup");
+            var contactText = document.getElementById("contact-popup");
+            var classmateID = item[3]
+            nameText.innerText = item[0];
+            contactText.innerText = item[2];
+
+            prefetching.then(() => {
+                const data = intersectionCache[classmateID] || {
+                    intersections: [], studentADiff: [], studentBDiff: []
+                };
+                const studentADiff = data["studentADiff"];
+                const studentBDiff = data["studentBDiff"];
+                const intersections = data["intersections"];
+
+                cells.forEach(function(cell) {
+                    cell.classList.remove("overlap", "my_nonoverlap", "groupmate_nonoverlap");
+                    const timeSlot = cell.getAttribute('day') + cell.getAttribute('time')
+                    if (intersections.includes(timeSlot)) {
+                        cell.classList.add("overlap");
+                    } else if (studentADiff.includes(timeSlot)) {
+                        cell.classList.add("my_nonoverlap");
+                    } else if (studentBDiff.includes(timeSlot)) {
+                        cell.classList.add("groupmate_nonoverlap");
+                    }
+                })
+            })
+
+            popupBlock.style.display = 'block';
+
+            var closeButton = document.getElementById("close-popup");
+                if(closeButton) {
+                    closeButton.onclick = function() {
+                        popupBlock.style.display = 'none';
+                    };
+                }
+        })
+    }
+
+    // Redraw the table from the loaded ranking.
+    function renderRanking() {
+        for (let i = groupmatesTable.rows.length - 1; i > 0; i--) {
+            groupmatesTable.deleteRow(i);
+        }
+        rank = 1;
+        rankedItems.forEach(addToGroupList);
+        loadMore.hidden = rank - 1 >= total;
+    }
+
+    // Move a joined or changed classmate to their new place in the ranking.
+    function applySectionEvent(event) {
+        const data = JSON.parse(event.data);
+        const classmateID = data["student_id"];
+        if (rankedItems.length === 0) {
+            return;
+        }
+        if (event.type === "reset" || classmateID === STUDENT_ID) {
+            intersectionCache = {};
+            document.getElementById("search-group").click();
+            return;
+        }
+        delete intersectionCache[classmateID];
+        const cumulative = data["cumulative"][STUDENT_ID];
+        const consecutive = data["consecutive"][STUDENT_ID];
+        var item = rankedItems.find(item => item[3] === classmateID);
+        if (item === undefined) {
+            item = [data["displayName"], 0, data["contactDetails"], classmateID];
+            if (event.type === "join") {
+                total++;
+            }
+        } else {
+            rankedItems.splice(rankedItems.indexOf(item), 1);
+        }
+        if (method === "group_cumulative") {
+            item[1] = cumulative;
+        } else if (method === "group_consecutive") {
+            item[1] = consecutive;
+        } else {
+            item[1] = cumulative + consecutive;
+            item[4] = cumulative;
+            item[5] = consecutive;
+        }
+        const position = rankedItems.findIndex(other =>
+            other[1] < item[1] || (other[1] === item[1] && other[3] > item[3]));
+        if (position !== -1) {
+            rankedItems.splice(position, 0, item);
+        } else if (rankedItems.length >= total) {
+            rankedItems.push(item);
+        }
+        renderRanking();
+        prefetchIntersections([classmateID]);
+    }
+
+    const sectionEvents = new EventSource(`/api/${PASSCODE}/events`);
+    ["join", "schedule", "reset"].forEach(type =>
+        sectionEvents.addEventListener(type, applySectionEvent));
+
+    // Fetch intersections for a page of classmates in one request.
+    function prefetchIntersections(classmateIDs) {
+        const missingIDs = classmateIDs.filter(id => !(id in intersectionCache));
+        if (missingIDs.length === 0) {
+            return;
+        }
+        prefetching = fetch(`/api/${PASSCODE}/${STUDENT_ID}/schedule_intersections?classmates=${missingIDs.join(",")}`)
+        .then(response => response.json())
+        .then(data => {
+            Object.assign(intersectionCache, data["data"]);
+        })
+        .catch(error => {
+            console.error("Error fetching student schedules", error);
+        });
+    }
+});
@@ -0,0 +1,222 @@
+// original code: https://jsfiddle.net/Brv6J/3/
+
+document.addEventListener('DOMContentLoaded', function() {
+    buildTimeTable(document.getElementById("create-schedule-table"));
+    let isHighlighted = false;
+    let cursorClicked = false;
+    let cells = document.querySelectorAll("#create-schedule-table .clickable");
+    let classListDisplay = document.getElementById("class-list-display");
+    let searchInput = document.getElementById("search-name-input");
+    let searchButton = document.getElementById("search-name-button");
+    let currentlyClicked;
+    var existingSchedule = new Array();
+    var savedSchedule = new Set();
+    var scheduleVersion = null;
+    var studentList = new Array();
+    var sortedStudentList = [];
+
+    // Update table containing class list.
+    function updateClassListDisplay(classList) {
+        classListDisplay.innerHTML = "";
+        if (classList.length === 0) {
+            const newRow = classListDisplay.insertRow();
+            const emptyCell = newRow.insertCell();
+            emptyCell.innerHTML = "No people found"
+            return;
+        }
+        classList.forEach(item => {
+            const newRow = classListDisplay.insertRow();
+            const classmateCell = newRow.insertCell();
+            const classmateName = document.createTextNode(item);
+            classmateCell.appendChild(classmateName);
+        })
+    }
+
+    // Client-side binary search.
+    function binarySearch(nameList, name) {
+        let low = 0;
+        let high = nameList.length;
+        while (low<high) {
+            let mid = Math.floor((low+high)/2);
+            if (nameList[mid] < name) {
+                low = mid + 1;
+            }
+            else {
+                high = mid;
+            }
+        }
+        return low;
+    }
+
+    // Call api to get classmate names -> Sort the names to allow for binary search.
+    function loadClassmateNames() {
+        cachedFetch(`/api/${PASSCODE}/${STUDENT_ID}/get_classmate_names`)
+        .then(data => {
+            const studentList = data["studentList"];
+            updateClassListDisplay(studentList);
+            sortedStudentList = studentList.sort();
+        })
+    }
+    loadClassmateNames();
+
+    // Listen for classmates joining -> Insert them into the sorted class list.
+    const sectionEvents = new EventSource(`/api/${PASSCODE}/events`);
+    sectionEvents.addEventListener("join", function(event) {
+        const name = JSON.parse(event.data)["displayName"];
+        sortedStudentList.splice(binarySearch(sortedStudentList, name), 0, name);
+        searchInput.dispatchEvent(new Event('input'));
+    });
+    sectionEvents.addEventListener("reset", loadClassmateNames);
+
+    // Highlight exactly the cells of a schedule.
+    function showSchedule(schedule) {
+        cells.forEach(function(cell) {
+            cell.classList.toggle("highlighted",
+                schedule.has(cell.getAttribute('day') + cell.getAttribute('time')));
+        })
+    }
+
+    // Prepopulate the schedule table if student has saved any.
+    cachedFetch(`/api/${PASSCODE}/${STUDENT_ID}/view_schedule`)
+    .then(data => {
+        existingSchedule = data["schedule"];
+        if (existingSchedule instanceof Array) {
+            savedSchedule = new Set(existingSchedule);
+            scheduleVersion = data["version"];
+            showSchedule(savedSchedule);
+        }
+    })
+    .catch(error => {
+        console.error("Error fetching student schedule:", error);
+    });
+
+    // Behavior for schedule table.
+    cells.forEach(function(cell) {
+        cell.addEventListener('mousedown', function(event) {
+            cursorClicked = true;
+            this.classList.toggle("highlighted");
+            isHighlighted = this.classList.contains("highlighted");
+            event.preventDefault();
+        });
+
+        cell.addEventListener('mouseover', function() {
+            if (cursorClicked) {
+                this.classList.toggle("highlighted", isHighlighted);
+            }
+        });
+
+        document.addEventListener('mouseup', function() {
+            cursorClicked = false;
+        })
+    })
+
+    // FUNCTIONALITY FOR SEARCH BAR
+    if (searchInput) {
+        searchInput.addEventListener('input', function(e) {
+            let searchInputText = searchInput.value.trim();
+            searchQuery = searchInputText.charAt(0).toUpperCase() + searchInputText.slice(1);
+            if (searchQuery==="") {
+                updateClassListDisplay(sortedStudentList);
+                return;
+            }
+            let matches = [];
+            let startIndex = binarySearch(sortedStudentList, searchQuery);
+            for (let i = startIndex; i <sortedStudentList.length; i++){
+                let name = sortedStudentList[i];
+                if (name.startsWith(searchQuery)){
+                    matches.push(name);
+                }
+                else {
+                    break;
+                }
+            }
+            updateClassListDisplay(matches);
+            });
+        }
+
+    // FUNCTIONALITY FOR SUBMITTING
+    const submit = document.querySelector("#save_sched")
+
+    submit.onclick = function(event){
+        const finalSchedule = new Array();
+        const selectedCells = document.querySelectorAll(".highlighted");
+
+        selectedCells.forEach(function(cell){
+            let cellDay = cell.getAttribute("day");
+            let cellTime = cell.getAttribute("time");
+            let timeCombined = cellDay + cellTime;
+            finalSchedule.push(timeCombined); 
+        });
+
+        // Send only the slots changed since the last save.
+        const finalSet = new Set(finalSchedule);
+        const updatedSchedule = {
+            added : finalSchedule.filter(slot => !savedSchedule.has(slot)),
+            removed : [...savedSchedule].filter(slot => !finalSet.has(slot)),
+            version : scheduleVersion
+        }
+        saveSchedule(updatedSchedule, finalSet);
+    }
+
+    // Post a schedule update -> Merge with the saved schedule if another tab saved first.
+    function saveSchedule(updatedSchedule, finalSet) {
+        fetch(`/api/${PASSCODE}/${STUDENT_ID}/update_schedule`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(updatedSchedule)
+        })
+        .then(response => response.json())
+        .then(data => {
+            const result = data["result"]
+            if (result === "success") {
+                savedSchedule = finalSet;
+                scheduleVersion = data["version"];
+                var alertToastElement = document.getElementById('alertToast');
+                var alertMessage = new bootstrap.Toast(alertToastElement);
+                alertMessage.show();
+            } else if (result === "conflict") {
+                mergeSavedSchedule(finalSet);
+            } else if (result === "error") {
+                var errorToastElement = document.getElementById('errorToast');
+                var errorMessage = new bootstrap.Toast(errorToastElement);
+                errorMessage.show();
+            }
+        });
+    }
+
+    // Fetch the schedule another tab saved -> Reapply this tab's unsaved
+    // changes on top of it, and show the result to be reviewed and saved again.
+    function mergeSavedSchedule(finalSet) {
+        cachedFetch(`/api/${PASSCODE}/${STUDENT_ID}/view_schedule`)
+        .then(data => {
+            const otherSchedule = new Set(data["schedule"]);
+            const mergedSchedule = new Set(otherSchedule);
+            finalSet.forEach(slot => {
+                if (!savedSchedule.has(slot)) {
+                    mergedSchedule.add(slot);
+                }
+            });
+            savedSchedule.forEach(slot => {
+                if (!finalSet.has(slot)) {
+                    mergedSchedule.delete(slot);
+                }
+            });
+            savedSchedule = otherSchedule;
+            scheduleVersion = data["version"];
+            showSchedule(mergedSchedule);
+            var conflictToastElement = document.getElementById('conflictToast');
+            var conflictMessage = new bootstrap.Toast(conflictToastElement);
+            conflictMessage.show();
+        })
+        .catch(error => {
+            console.error("Error fetching student schedule:", error);
+        });
+    }
+
+    const groupMe = document.getElementById('group_me');
+    groupMe.onclick = function(event){
+        window.location.href = `/${PASSCODE}/${STUDENT_ID}/view_group`;
+    }
+});
@@ -0,0 +1,647 @@
+import logging
+import os
+import sqlite3
+import zlib
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from records import StudentRecord, SectionRecord
+from schedules import slot_registry
+from snapshot import Snapshot, encode_section, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+LOCK_STRIPES = 64
+GRID_COLUMNS = [("slotMinutes", 30), ("firstDay", 0), ("lastDay", 6),
+                ("startHour", 8), ("endHour", 20)]
+
+class MemoryStore:
+    """
+    Keeps every section in a process-local dict.
+
+    Handlers use a store like the dict it replaces, change sections only
+    inside transaction(), and call mark_dirty after changing a section or
+    one of its students in place.
+
+    epoch: Changes whenever versions restart from zero, so a version is
+           only ever reused for the same section state
+    ttl: Seconds a section may go unaccessed before sweep() deletes it,
+         or None to keep sections forever
+    """
+    def __init__(self, ttl : float | None = None):
+        self.sections = {}
+        self.sectionLocks = [threading.RLock() for i in range(LOCK_STRIPES)]
+        self.sectionVersions = {}
+        self.epoch = uuid.uuid4().hex[:8]
+        self.ttl = ttl
+        self.lastAccess = {}
+
+    def __contains__(self, passcode : str):
+        return passcode in self.sections
+
+    def __getitem__(self, passcode : str):
+        section = self.sections[passcode]
+        self.lastAccess[passcode] = time.time()
+        return section
+
+    def __setitem__(self, passcode : str, section : SectionRecord):
+        self.sections[passcode] = section
+        self.lastAccess[passcode] = time.time()
+
+    def lock(self, passcode : str):
+        """Retrieve the lock that serializes access to one section.
+
+        Sections share a fixed set of striped locks, so looking up unknown
+        passcodes never grows the store.
+        """
+        return self.sectionLocks[zlib.crc32(passcode.encode()) % LOCK_STRIPES]
+
+    def add(self, passcode : str, section : SectionRecord):
+        """Store a new section, unless the passcode is already taken.
+
+        Returns whether the section was stored.
+        """
+        with self.lock(passcode):
+            if passcode in self:
+                return False
+            self[passcode] = section
+            return True
+
+    @contextmanager
+    def transaction(self, passcode : str):
+        """Yield a section to change in place, or None if it does not exist.
+
+        Holds the section's lock, so checks and changes made inside the
+        transaction cannot interleave with another request's.
+        """
+        with self.lock(passcode):
+            yield self[passcode] if passcode in self else None
+
+    def mark_dirty(self, passcode : str, student_id : int | None = None):
+        """Record that a section, or one of its students, was changed."""
+        self.sectionVersions[passcode] = self.sectionVersions.get(passcode, 0) + 1
+
+    def mark_dirty_batch(self, passcode : str, student_ids):
+        """Record that several students of a section were changed together.
+
+        Backends write the whole batch in the same flush.
+        """
+        self.sectionVersions[passcode] = self.sectionVersions.get(passcode, 0) + 1
+
+    def version(self, passcode : str):
+        """Retrieve a counter that grows with every change to a section."""
+        return self.sectionVersions.get(passcode, 0)
+
+    def resident_sections(self):
+        """Snapshot the sections currently held in memory, by passcode."""
+        return dict(self.sections)
+
+    def sweep(self):
+        """Delete every section left unaccessed for longer than ttl.
+
+        Returns the passcodes of the deleted sections.
+        """
+        if self.ttl is None:
+            return []
+        cutoff = time.time() - self.ttl
+        expired = []
+        for passcode in self._expired(cutoff):
+            with self.lock(passcode):
+                if self.lastAccess.get(passcode, 0) < cutoff:
+                    self._delete(passcode)
+                    expired.append(passcode)
+        return expired
+
+    def flush(self):
+        """Write every pending change to the backend."""
+
+    def close(self):
+        """Flush and release the backend."""
+
+    def _expired(self, cutoff : float):
+        """Passcodes of the sections last accessed before cutoff."""
+        return [passcode for passcode, accessed in list(self.lastAccess.items())
+                if accessed < cutoff]
+
+    def _delete(self, passcode : str):
+        """Forget a section. Callers hold the section's lock."""
+        self.sections.pop(passcode, None)
+        self.lastAccess.pop(passcode, None)
+
+class SQLiteStore(MemoryStore):
+    """
+    Keeps accessed sections in memory and persists them to SQLite.
+
+    Sections are loaded lazily the first time their passcode is looked
+    up. Changes are written behind by a background thread, which batches
+    every section and student marked dirty since the last flush into a
+    single transaction, so handlers never wait on the disk. sweep()
+    flushes and unloads the least recently used sections beyond
+    maxResident, which are loaded again on their next access.
+
+    path: SQLite database file, opened in WAL mode
+    flushInterval: Seconds between background flushes, or None to
+                   only flush when asked
+    batchSize: Pending changes that trigger an early flush
+    maxResident: Sections kept in memory after a sweep, or None for no limit
+    """
+    def __init__(self, path : str, flushInterval : float | None = 1.0, batchSize : int = 256,
+                 ttl : float | None = None, maxResident : int | None = None):
+        super().__init__(ttl)
+        self.flushInterval = flushInterval
+        self.batchSize = batchSize
+        self.maxResident = maxResident
+        self.dirty = set()
+        self.storeLock = threading.RLock()
+        self.flushLock = threading.Lock()
+        self.connection = self._connect(path)
+        self.writeConnection = self._connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS sections (
+                passcode TEXT PRIMARY KEY,
+                sectionName TEXT NOT NULL,
+                sectionDetails TEXT NOT NULL,
+                maxSize INTEGER NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                lastAccess REAL NOT NULL DEFAULT 0,
+                slotMinutes INTEGER NOT NULL DEFAULT 30,
+                firstDay INTEGER NOT NULL DEFAULT 0,
+                lastDay INTEGER NOT NULL DEFAULT 6,
+                startHour INTEGER NOT NULL DEFAULT 8,
+                endHour INTEGER NOT NULL DEFAULT 20
+            );
+            CREATE TABLE IF NOT EXISTS students (
+                passcode TEXT NOT NULL,
+                student_id INTEGER NOT NULL,
+                displayName TEXT NOT NULL,
+                contactDetails TEXT NOT NULL,
+                scheduleMask BLOB NOT NULL,
+                scheduleVersion INTEGER NOT NULL,
+                PRIMARY KEY (passcode, student_id)
+            );
+        """)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(sections)")]
+        if "version" not in columns:
+            self.connection.execute(
+                "ALTER TABLE sections ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        if "lastAccess" not in columns:
+            self.connection.execute(
+                "ALTER TABLE sections ADD COLUMN lastAccess REAL NOT NULL DEFAULT 0")
+            self.connection.execute("UPDATE sections SET lastAccess = ?", (time.time(),))
+        for column, default in GRID_COLUMNS:
+            if column not in columns:
+                self.connection.execute(
+                    f"ALTER TABLE sections ADD COLUMN {column} INTEGER NOT NULL DEFAULT {default}")
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.writer = None
+        if flushInterval is not None:
+            self.writer = threading.Thread(target=self._write_behind, daemon=True)
+            self.writer.start()
+
+    def __contains__(self, passcode : str):
+        return self._get(passcode) is not None
+
+    def __getitem__(self, passcode : str):
+        section = self._get(passcode)
+        if section is None:
+            raise KeyError(passcode)
+        return section
+
+    def __setitem__(self, passcode : str, section : SectionRecord):
+        with self.storeLock:
+            self.sections[passcode] = section
+            self.lastAccess[passcode] = time.time()
+            self.dirty.add((passcode, None))
+            for student_id in range(len(section.studentList)):
+                self.dirty.add((passcode, student_id))
+        self.wakeup.set()
+
+    def mark_dirty(self, passcode : str, student_id : int | None = None):
+        with self.storeLock:
+            super().mark_dirty(passcode, student_id)
+            self.dirty.add((passcode, student_id))
+            pendingCount = len(self.dirty)
+        if pendingCount >= self.batchSize:
+            self.wakeup.set()
+
+    def mark_dirty_batch(self, passcode : str, student_ids):
+        with self.storeLock:
+            super().mark_dirty_batch(passcode, student_ids)
+            self.dirty.update((passcode, student_id) for student_id in student_ids)
+        self.wakeup.set()
+
+    def flush(self):
+        """Write every dirty row in one transaction.
+
+        If the write fails, it is rolled back and the rows are marked dirty
+        again, so the next flush retries them.
+        """
+        with self.flushLock:
+            sectionRows, studentRows = self._take_dirty_rows()
+            if not sectionRows and not studentRows:
+                return
+            try:
+                self.writeConnection.execute("BEGIN")
+                self._write_rows(sectionRows, studentRows)
+                self.writeConnection.execute("COMMIT")
+            except BaseException:
+                if self.writeConnection.in_transaction:
+                    self.writeConnection.execute("ROLLBACK")
+                with self.storeLock:
+                    self.dirty.update((row[0], None) for row in sectionRows)
+                    self.dirty.update((row[0], row[1]) for row in studentRows)
+                raise
+
+    def sweep(self):
+        """Delete expired sections, then unload the least recently used.
+
+        Access times of resident sections are saved first, so sections
+        that are unloaded still expire from their last access.
+        """
+        self._save_access_times()
+        expired = super().sweep()
+        if self.maxResident is not None:
+            with self.storeLock:
+                resident = sorted(self.sections,
+                                  key=lambda passcode: self.lastAccess.get(passcode, 0))
+            for passcode in resident[:max(len(resident) - self.maxResident, 0)]:
+                with self.lock(passcode):
+                    self.flush()
+                    self._unload(passcode)
+        return expired
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        if self.writer is not None:
+            self.writer.join()
+        self.flush()
+        self.writeConnection.close()
+        self.connection.close()
+
+    def _connect(self, path : str):
+        """Open a WAL-mode connection that manages its own transactions."""
+        connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _write_rows(self, sectionRows, studentRows):
+        """Upsert section and student rows inside an open transaction."""
+        self.writeConnection.executemany(
+            "INSERT INTO sections (passcode, sectionName, sectionDetails, maxSize, lastAccess, "
+            "slotMinutes, firstDay, lastDay, startHour, endHour) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (passcode) DO UPDATE SET "
+            "sectionName = excluded.sectionName, sectionDetails = excluded.sectionDetails, "
+            "maxSize = excluded.maxSize, "
+            "lastAccess = max(lastAccess, excluded.lastAccess)", sectionRows)
+        self.writeConnection.executemany(
+            "INSERT OR REPLACE INTO students VALUES (?, ?, ?, ?, ?, ?)", studentRows)
+
+    def _take_dirty_rows(self):
+        """Snapshot the rows of every dirty section and student, then clear them.
+
+        Only this snapshot holds the store lock, so handlers never wait
+        on the disk write that follows. Rows of sections no longer in
+        memory are skipped.
+        """
+        with self.storeLock:
+            sectionRows = []
+            studentRows = []
+            for passcode, student_id in self.dirty:
+                section = self.sections.get(passcode)
+                if section is None:
+                    continue
+                if student_id is None:
+                    registry = section.registry
+                    sectionRows.append((passcode, section.sectionName,
+                                        section.sectionDetails, section.maxSize,
+                                        self.lastAccess.get(passcode, 0), registry.minutes,
+                                        registry.firstDay, registry.lastDay,
+                                        registry.startHour, registry.endHour))
+                else:
+                    student = section.studentList[student_id]
+                    studentRows.append((passcode, student_id, student.displayName,
+                                        student.contactDetails,
+                                        student.scheduleMask.to_bytes(
+                                            section.registry.maskBytes, "little"),
+                                        student.scheduleVersion))
+            self.dirty.clear()
+        return sectionRows, studentRows
+
+    def _get(self, passcode : str):
+        """Retrieve a section from memory, loading it from SQLite on a miss."""
+        section = self.sections.get(passcode)
+        if section is None:
+            with self.storeLock:
+                section = self.sections.get(passcode)
+                if section is None:
+                    section = self._load(passcode)
+        if section is not None:
+            self.lastAccess[passcode] = time.time()
+        return section
+
+    def _expired(self, cutoff : float):
+        with self.storeLock:
+            rows = self.connection.execute(
+                "SELECT passcode FROM sections WHERE lastAccess < ?", (cutoff,)).fetchall()
+        return {row[0] for row in rows} | set(super()._expired(cutoff))
+
+    def _delete(self, passcode : str):
+        with self.flushLock:
+            self.writeConnection.execute("BEGIN IMMEDIATE")
+            self.writeConnection.execute("DELETE FROM students WHERE passcode = ?", (passcode,))
+            self.writeConnection.execute("DELETE FROM sections WHERE passcode = ?", (passcode,))
+            self.writeConnection.execute("COMMIT")
+            with self.storeLock:
+                self.dirty = {i for i in self.dirty if i[0] != passcode}
+                self._unload(passcode)
+
+    def _unload(self, passcode : str):
+        """Drop a flushed section from memory, to be loaded again on access."""
+        with self.storeLock:
+            super()._delete(passcode)
+
+    def _save_access_times(self):
+        """Write the last access time of every resident section."""
+        with self.storeLock:
+            rows = [(accessed, passcode, accessed)
+                    for passcode, accessed in self.lastAccess.items()]
+        if rows:
+            with self.flushLock:
+                self.writeConnection.execute("BEGIN IMMEDIATE")
+                self.writeConnection.executemany(
+                    "UPDATE sections SET lastAccess = ? WHERE passcode = ? AND lastAccess < ?",
+                    rows)
+                self.writeConnection.execute("COMMIT")
+
+    def _load(self, passcode : str):
+        """Read one section and its students from SQLite into memory."""
+        row = self.connection.execute(
+            "SELECT sectionName, sectionDetails, maxSize, slotMinutes, firstDay, lastDay, "
+            "startHour, endHour FROM sections WHERE passcode = ?",
+            (passcode,)).fetchone()
+        if row is None:
+            return None
+        studentRows = self.connection.execute(
+            "SELECT displayName, contactDetails, scheduleMask, scheduleVersion "
+            "FROM students WHERE passcode = ? ORDER BY student_id", (passcode,))
+        studentList = [StudentRecord(displayName, contactDetails,
+                                     int.from_bytes(scheduleMask, "little"), scheduleVersion)
+                       for displayName, contactDetails, scheduleMask, scheduleVersion
+                       in studentRows]
+        section = SectionRecord(row[0], row[1], row[2], studentList, slot_registry(*row[3:]))
+        self.sections[passcode] = section
+        return section
+
+    def _write_behind(self):
+        """Flush pending changes every flushInterval seconds until closed.
+
+        A failed flush is logged and retried on the next pass, as its rows
+        stay dirty.
+        """
+        while not self.closed:
+            self.wakeup.wait(self.flushInterval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed; retrying in %ss",
+                                 self.flushInterval)
+
+class SharedSQLiteStore(SQLiteStore):
+    """
+    SQLite store that stays consistent across worker processes.
+
+    Every access compares the cached section against the version column
+    in SQLite and reloads it if another worker changed it. Changes are
+    written through inside transaction(), which holds the database write
+    lock while the section is refreshed, changed and committed, so
+    concurrent workers apply their changes one at a time.
+
+    path: SQLite database file shared by every worker
+    """
+    def __init__(self, path : str, ttl : float | None = None, maxResident : int | None = None):
+        super().__init__(path, flushInterval=None, ttl=ttl, maxResident=maxResident)
+        self.versions = {}
+        self.epoch = "shared"
+
+    def __setitem__(self, passcode : str, section : SectionRecord):
+        with self.transaction(passcode):
+            super().__setitem__(passcode, section)
+
+    def add(self, passcode : str, section : SectionRecord):
+        with self.transaction(passcode) as existing:
+            if existing is not None:
+                return False
+            super().__setitem__(passcode, section)
+            return True
+
+    @contextmanager
+    def transaction(self, passcode : str):
+        with self.lock(passcode), self.flushLock:
+            self.writeConnection.execute("BEGIN IMMEDIATE")
+            try:
+                section = self._get(passcode)
+                yield section
+                sectionRows, studentRows = self._take_dirty_rows()
+                self._write_rows(sectionRows, studentRows)
+                if sectionRows or studentRows:
+                    self.writeConnection.execute(
+                        "UPDATE sections SET version = version + 1 WHERE passcode = ?",
+                        (passcode,))
+                    self.versions[passcode] = self.versions.get(passcode, 0) + 1
+                self.writeConnection.execute("COMMIT")
+            except BaseException:
+                self.writeConnection.execute("ROLLBACK")
+                with self.storeLock:
+                    self.dirty.clear()
+                    self.sections.pop(passcode, None)
+                    self.versions.pop(passcode, None)
+                raise
+
+    def _unload(self, passcode : str):
+        with self.storeLock:
+            super()._unload(passcode)
+            self.versions.pop(passcode, None)
+
+    def version(self, passcode : str):
+        """Retrieve the section's version column, which every worker bumps."""
+        with self.storeLock:
+            self._get(passcode)
+            return self.versions.get(passcode, 0)
+
+    def _get(self, passcode : str):
+        """Retrieve a section, reloading it if another worker changed it.
+
+        A section whose row is gone, such as one another worker expired,
+        is dropped from memory too, so it is not served or written again.
+        """
+        with self.storeLock:
+            row = self.connection.execute(
+                "SELECT version FROM sections WHERE passcode = ?", (passcode,)).fetchone()
+            if row is None:
+                self._unload(passcode)
+                return None
+            if self.versions.get(passcode) != row[0] or passcode not in self.sections:
+                self.sections.pop(passcode, None)
+                self.versions[passcode] = row[0]
+                self._load(passcode)
+            self.lastAccess[passcode] = time.time()
+            return self.sections[passcode]
+
+class SnapshotStore(MemoryStore):
+    """
+    Keeps every section in memory and saves them all to a snapshot file.
+
+    The snapshot left by the last run is memory-mapped on start, and each
+    section is decoded from it the first time it is accessed, so a restart
+    serves requests without first restoring every section. When anything
+    changed, a new snapshot is written every saveInterval seconds; records
+    of sections never decoded are copied from the old snapshot as they are.
+
+    path: Snapshot file
+    saveInterval: Seconds between snapshots, or None to only save on
+                  flush() and close()
+    """
+    def __init__(self, path : str, saveInterval : float | None = 60.0,
+                 ttl : float | None = None):
+        super().__init__(ttl)
+        self.path = path
+        self.saveInterval = saveInterval
+        self.snapshot = Snapshot(path) if os.path.exists(path) else None
+        self.deleted = set()
+        self.changes = 0
+        self.savedChanges = 0
+        self.storeLock = threading.RLock()
+        self.saveLock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.writer = None
+        if saveInterval is not None:
+            self.writer = threading.Thread(target=self._save_periodically, daemon=True)
+            self.writer.start()
+
+    def __contains__(self, passcode : str):
+        return self._get(passcode) is not None
+
+    def __getitem__(self, passcode : str):
+        section = self._get(passcode)
+        if section is None:
+            raise KeyError(passcode)
+        self.lastAccess[passcode] = time.time()
+        return section
+
+    def __setitem__(self, passcode : str, section : SectionRecord):
+        with self.storeLock:
+            super().__setitem__(passcode, section)
+            self.deleted.discard(passcode)
+            self.changes += 1
+
+    def mark_dirty(self, passcode : str, student_id : int | None = None):
+        with self.storeLock:
+            super().mark_dirty(passcode, student_id)
+            self.changes += 1
+
+    def mark_dirty_batch(self, passcode : str, student_ids):
+        with self.storeLock:
+            super().mark_dirty_batch(passcode, student_ids)
+            self.changes += 1
+
+    def flush(self):
+        self.save()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        if self.writer is not None:
+            self.writer.join()
+        self.save()
+        with self.storeLock:
+            if self.snapshot is not None:
+                self.snapshot.close()
+                self.snapshot = None
+
+    def save(self):
+        """Write a new snapshot if anything changed since the last one.
+
+        Each resident section is encoded under its own lock, so a snapshot
+        never holds a section halfway through a transaction.
+        """
+        with self.saveLock:
+            with self.storeLock:
+                changes = self.changes
+                if changes == self.savedChanges:
+                    return
+                previous = self.snapshot
+                resident = dict(self.sections)
+                deleted = set(self.deleted)
+                lastAccess = dict(self.lastAccess)
+            records = []
+            for passcode, section in resident.items():
+                with self.lock(passcode):
+                    records.append((passcode, lastAccess.get(passcode, 0),
+                                    encode_section(section)))
+            if previous is not None:
+                records.extend(record for record in previous.records()
+                               if record[0] not in resident and record[0] not in deleted)
+            write_snapshot(self.path, records)
+            with self.storeLock:
+                self.snapshot = Snapshot(self.path)
+                self.savedChanges = changes
+            if previous is not None:
+                previous.close()
+
+    def _get(self, passcode : str):
+        """Retrieve a section from memory, decoding it from the snapshot on a miss."""
+        section = self.sections.get(passcode)
+        if section is None:
+            with self.storeLock:
+                section = self.sections.get(passcode)
+                if (section is None and self.snapshot is not None
+                        and passcode not in self.deleted):
+                    section = self.snapshot.load(passcode)
+                    if section is not None:
+                        self.sections[passcode] = section
+                        self.lastAccess[passcode] = time.time()
+        return section
+
+    def _expired(self, cutoff : float):
+        with self.storeLock:
+            stored = self.snapshot.entries() if self.snapshot is not None else []
+            undecoded = {passcode for passcode, accessed in stored if accessed < cutoff
+                         and passcode not in self.sections and passcode not in self.deleted}
+        return undecoded | set(super()._expired(cutoff))
+
+    def _delete(self, passcode : str):
+        with self.storeLock:
+            super()._delete(passcode)
+            self.deleted.add(passcode)
+            self.changes += 1
+
+    def _save_periodically(self):
+        """Save a snapshot every saveInterval seconds until closed."""
+        while not self.closed:
+            self.wakeup.wait(self.saveInterval)
+            self.wakeup.clear()
+            if not self.closed:
+                self.save()
+
+def open_store(location : str, shared : bool = False, ttl : float | None = None,
+               maxResident : int | None = None, snapshot : str | None = None):
+    """Open a section store.
+
+    "memory" opens a MemoryStore, or a SnapshotStore saving to snapshot
+    when one is given; neither has anywhere to unload sections to, so
+    maxResident is ignored. Any other location is a SQLite path, opened
+    as a SharedSQLiteStore if several workers will share it.
+    """
+    if location == "memory":
+        if snapshot is not None:
+            return SnapshotStore(snapshot, ttl=ttl)
+        return MemoryStore(ttl)
+    if shared:
+        return SharedSQLiteStore(location, ttl, maxResident)
+    return SQLiteStore(location, ttl=ttl, maxResident=maxResident)
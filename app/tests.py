@@ -1,36 +1,83 @@
 import unittest
 from unittest.mock import patch
 from models import Student, Section, ScheduleUpdate
+from schedules import (to_mask, from_mask, count_slots, longest_run, encode_mask, decode_mask,
+                       free_windows, slot_registry, DEFAULT_REGISTRY)
+from similarity import SectionMatrix, row_scores
+from lsh import ScheduleIndex
+from events import EventBroker, HISTORY_SIZE
+from serialization import SlotMask, slot_mask_type, encode_json
+from assets import HashedStaticFiles, IMMUTABLE, REVALIDATE
+from storage import MemoryStore, SQLiteStore, SharedSQLiteStore, SnapshotStore
+from records import StudentRecord, SectionRecord, record_bytes
+from snapshot import Snapshot
+from roster import read_roster, export_ndjson, export_csv
+from benchmarks import synthetic_section, compare_baseline
+from loadtest import synthetic_trace, route_name, percentile, summarize
+from metrics import Histogram, SamplingProfiler, timed, stageSeconds
+from passcodes import allocate_passcode
+from ranking import top_ranked, schedule_intersections, parse_classmate_ids
+from partition import partition_section, partition_section_async, get_pool, shutdown_pool
+from admission import SingleFlight, SectionAdmission, SectionBusy
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import json
+import time
+import itertools
+import multiprocessing
+import random
+import numpy as np
+import tempfile
+import threading
+import os
+import sqlite3
+from fastapi.testclient import TestClient
+
+os.environ.setdefault("GROUPME_STORAGE", "memory")
+import main
 
 db = {}
 
+def join_shared_section(path, passcode, worker, joins):
+    """Join a section from a separate worker process through a shared store."""
+    store = SharedSQLiteStore(path)
+    for i in range(joins):
+        with store.transaction(passcode) as section:
+            student_id = len(section.studentList)
+            section.studentList.append(StudentRecord(f"Worker {worker}", str(i),
+                                                     to_mask({"0-0800-0830"})))
+            store.mark_dirty(passcode, student_id)
+    store.close()
+
+def create_app_section(client, maxSize, schedules):
+    """Create a section through the API with one student per schedule, returning its passcode."""
+    passcode = client.post("/api/create_section",
+                           json={"sectionName":"Krusty Krabs", "maxSize":maxSize}).json()["passcode"]
+    for i, schedule in enumerate(schedules):
+        client.post(f"/api/{passcode}/create_student",
+                    json={"displayName":str(i), "contactDetails":"", "schedule":schedule})
+    return passcode
+
 class GroupMeUnitTests(unittest.TestCase):
 
     def setUp(self):
         
         self.passcode = "ABC123"
-        self.section = Section(sectionName="Krusty Krabs", maxSize=4)
-
-        self.studentA = Student(displayName="Mr. Krabs",
-                                contactDetails="Meet me at Krusty Krabs.",
-                                schedule={
-                                    "0-0800-0830", "0-0830-0900", "0-0900-0930"
-                                })
-        self.studentB = Student(displayName="Spongebob",
-                                contactDetails="Hello, I am Spongebob.",
-                                schedule={
-                                    "0-0800-0830", "0-0830-0900", "0-0900-0930"
-                                })
-        self.studentC = Student(displayName="Squidward",
-                                contactDetails="Go away.",
-                                schedule={
-                                    "0-0800-0830", "0-0900-0930", "0-1000-1030"
-                                })
-        self.studentD = Student(displayName="Patrick Star",
-                                contactDetails="I'm in my rock.",
-                                schedule={
-                                    "0-0800-0830", "0-0900-0930", "0-1000-1030"
-                                })
+        self.section = SectionRecord.from_model(Section(sectionName="Krusty Krabs", maxSize=4))
+
+        self.studentA = StudentRecord.from_model(Student(
+            displayName="Mr. Krabs", contactDetails="Meet me at Krusty Krabs.",
+            schedule={"0-0800-0830", "0-0830-0900", "0-0900-0930"}))
+        self.studentB = StudentRecord.from_model(Student(
+            displayName="Spongebob", contactDetails="Hello, I am Spongebob.",
+            schedule={"0-0800-0830", "0-0830-0900", "0-0900-0930"}))
+        self.studentC = StudentRecord.from_model(Student(
+            displayName="Squidward", contactDetails="Go away.",
+            schedule={"0-0800-0830", "0-0900-0930", "0-1000-1030"}))
+        self.studentD = StudentRecord.from_model(Student(
+            displayName="Patrick Star", contactDetails="I'm in my rock.",
+            schedule={"0-0800-0830", "0-0900-0930", "0-1000-1030"}))
 
         db[self.passcode] = self.section
         self.section.studentList.append(self.studentA)
@@ -78,9 +125,7 @@ class GroupMeUnitTests(unittest.TestCase):
         self.assertEqual(len(db[self.passcode].studentList), 4) 
     
     def test_api_create_student_fail_max_size(self):
-        new_student = Student(displayName="Sandy Cheeks",
-                            contactDetails="Yeehaw!",
-                            schedule={"0-0800-0830"})
+        new_student = StudentRecord("Sandy Cheeks", "Yeehaw!", to_mask({"0-0800-0830"}))
         response = api_create_student(self.passcode, new_student)
         self.assertIsNone(response)
         self.assertEqual(len(db[self.passcode].studentList), 4)
@@ -98,7 +143,8 @@ class GroupMeUnitTests(unittest.TestCase):
         update_data = ScheduleUpdate(schedule=new_schedule)
         response = api_update_schedule(self.passcode, 1, update_data)
         self.assertEqual(response, {'result': 'success'}) 
-        self.assertEqual(db[self.passcode].studentList[1].schedule, set(new_schedule))
+        self.assertEqual(from_mask(db[self.passcode].studentList[1].scheduleMask),
+                         set(new_schedule))
 
     def test_api_get_studentList_success(self):
         response = api_get_studentlist(self.passcode, 1)
@@ -128,6 +174,704 @@ class GroupMeUnitTests(unittest.TestCase):
         ]
         self.assertEqual(response['data'], expected_result)
 
+    def test_schedule_mask_roundtrip(self):
+        schedule = {"0-0800-0830", "3-1430-1500", "6-1930-2000"}
+        mask = to_mask(schedule)
+        self.assertEqual(from_mask(mask), schedule)
+        self.assertEqual(count_slots(mask), 3)
+        self.assertEqual(from_mask(self.studentA.scheduleMask),
+                         {"0-0800-0830", "0-0830-0900", "0-0900-0930"})
+
+    def test_student_request_cannot_set_stored_fields(self):
+        student = StudentRecord.from_model(Student.model_validate(
+            {"displayName":"Plankton", "contactDetails":"", "schedule":["0-0800-0830"],
+             "scheduleMask":1 << 200, "scheduleVersion":9}))
+        self.assertEqual(student.scheduleMask, to_mask(["0-0800-0830"]))
+        self.assertEqual(student.scheduleVersion, 0)
+
+    def test_schedule_mask_ignores_unknown_slots(self):
+        self.assertEqual(to_mask(["0-0800-0830", "", "9-0000-0030"]), to_mask(["0-0800-0830"]))
+
+    def test_schedule_mask_base64(self):
+        mask = to_mask(["0-0800-0830", "6-1930-2000"])
+        self.assertEqual(decode_mask(encode_mask(mask)), mask)
+        self.assertRaises(ValueError, decode_mask, encode_mask(1 << 24))
+        self.assertRaises(ValueError, decode_mask, "not base64!")
+        self.assertRaises(ValueError, decode_mask, "A" * 40)
+
+    def test_longest_run_stops_at_day_boundary(self):
+        mask = to_mask(["0-1900-1930", "0-1930-2000", "1-0800-0830"])
+        self.assertEqual(longest_run(mask), 2)
+        self.assertEqual(longest_run(0), 0)
+
+    def test_free_windows(self):
+        common = self.studentA.scheduleMask & self.studentC.scheduleMask
+        self.assertEqual(free_windows(common), [(0, "0-0800-0830", "0-0800-0830", 1),
+                                                (0, "0-0900-0930", "0-0900-0930", 1)])
+        mask = to_mask(["1-1900-1930", "1-1930-2000", "2-0800-0830", "6-1930-2000"])
+        self.assertEqual(free_windows(mask), [(1, "1-1900-1930", "1-1930-2000", 2),
+                                              (2, "2-0800-0830", "2-0800-0830", 1),
+                                              (6, "6-1930-2000", "6-1930-2000", 1)])
+        self.assertEqual(free_windows(0), [])
+
+    def test_section_matrix(self):
+        masks = [student.scheduleMask for student in self.section.studentList]
+        matrix = SectionMatrix(masks)
+        self.assertEqual(matrix.cumulative[0].tolist(), [3, 3, 2, 2])
+        self.assertEqual(matrix.consecutive[0].tolist(), [3, 3, 1, 1])
+        self.assertEqual(matrix.consecutive[2].tolist(), [1, 1, 1, 1])
+
+    def test_section_matrix_matches_bitmasks(self):
+        rng = random.Random(7)
+        masks = [rng.getrandbits(168) & to_mask(ALLPOSSIBLETIMES) for i in range(25)]
+        matrix = SectionMatrix(masks)
+        for i, maskA in enumerate(masks):
+            for j, maskB in enumerate(masks):
+                self.assertEqual(matrix.cumulative[i][j], count_slots(maskA & maskB))
+                self.assertEqual(matrix.consecutive[i][j], longest_run(maskA & maskB))
+
+    def test_section_matrix_per_day(self):
+        self.studentD.scheduleMask = to_mask({"0-0800-0830", "3-0900-0930", "3-0930-1000"})
+        self.studentA.scheduleMask = to_mask({"0-0800-0830", "3-0900-0930", "3-0930-1000",
+                                              "5-1200-1230"})
+        masks = [student.scheduleMask for student in self.section.studentList]
+        matrix = SectionMatrix(masks)
+        self.assertEqual(matrix.perDay[:, 0, 3].tolist(), [1, 0, 0, 2, 0, 0, 0])
+        self.assertEqual(matrix.perDay[:, 3, 0].tolist(), [1, 0, 0, 2, 0, 0, 0])
+        self.assertEqual(matrix.perDay.sum(axis=0).tolist(), matrix.cumulative.tolist())
+        self.assertEqual(matrix.consecutive[0][3], 2)
+
+    def test_section_matrix_incremental_updates(self):
+        rng = random.Random(11)
+        validMask = to_mask(ALLPOSSIBLETIMES)
+        masks = [rng.getrandbits(168) & validMask for i in range(5)]
+        matrix = SectionMatrix(masks)
+        for i in range(20):
+            masks.append(rng.getrandbits(168) & validMask)
+            matrix.add_student(masks[-1])
+        masks[3] = rng.getrandbits(168) & validMask
+        matrix.update_student(3, masks[3])
+        rebuilt = SectionMatrix(masks)
+        self.assertEqual(matrix.cumulative.tolist(), rebuilt.cumulative.tolist())
+        self.assertEqual(matrix.consecutive.tolist(), rebuilt.consecutive.tolist())
+        self.assertEqual(matrix.perDay.tolist(), rebuilt.perDay.tolist())
+
+    def test_api_update_schedule_deltas_versions_and_masks(self):
+        client = TestClient(main.app)
+        passcode = create_app_section(client, 4, [["0-0800-0830", "0-0830-0900"]])
+        url = f"/api/{passcode}/0/update_schedule"
+        def saved():
+            data = client.get(f"/api/{passcode}/0/view_schedule").json()
+            return set(data["schedule"]), data["version"]
+
+        response = client.post(url, json={"added":["1-0800-0830"], "removed":["0-0800-0830"],
+                                          "version":0}).json()
+        self.assertEqual(response, {"result":"success", "version":1})
+        self.assertEqual(saved(), ({"0-0830-0900", "1-0800-0830"}, 1))
+
+        # A tab still at version 0 conflicts, then reapplies its delta on the saved schedule.
+        response = client.post(url, json={"added":["2-0800-0830"], "version":0}).json()
+        self.assertEqual(response, {"result":"conflict", "version":1})
+        self.assertEqual(saved(), ({"0-0830-0900", "1-0800-0830"}, 1))
+        response = client.post(url, json={"added":["2-0800-0830"], "version":1}).json()
+        self.assertEqual(response, {"result":"success", "version":2})
+        self.assertEqual(saved(), ({"0-0830-0900", "1-0800-0830", "2-0800-0830"}, 2))
+
+        mask = encode_mask(to_mask(["3-0800-0830"]))
+        self.assertEqual(client.post(url, json={"mask":mask}).json()["result"], "success")
+        self.assertEqual(saved(), ({"3-0800-0830"}, 3))
+        for malformed in ("not base64!", "A" * 40, encode_mask(1 << 24)):
+            self.assertEqual(client.post(url, json={"mask":malformed}).json(),
+                             {"result":"error"})
+        self.assertEqual(client.post(url, json={"added":["9-0800-0830"]}).json(),
+                         {"result":"error"})
+        self.assertEqual(saved(), ({"3-0800-0830"}, 3))
+
+    def test_section_matrix_evicted_at_ann_threshold(self):
+        client = TestClient(main.app)
+        passcode = client.post("/api/create_section",
+                               json={"sectionName":"Lecture Hall", "maxSize":10}).json()["passcode"]
+        with patch.object(main, "ANN_THRESHOLD", 5):
+            for i in range(4):
+                client.post(f"/api/{passcode}/create_student",
+                            json={"displayName":str(i), "contactDetails":"",
+                                  "schedule":["0-0800-0830"]})
+            self.assertEqual(client.get(f"/api/{passcode}/0/group_cumulative").status_code, 200)
+            self.assertIn(passcode, main.sectionMatrices)
+            for i in range(4, 8):
+                client.post(f"/api/{passcode}/create_student",
+                            json={"displayName":str(i), "contactDetails":"",
+                                  "schedule":["0-0800-0830"]})
+            self.assertNotIn(passcode, main.sectionMatrices)
+            client.post(f"/api/{passcode}/1/update_schedule", json={"added":["0-0830-0900"]})
+            data = client.get(f"/api/{passcode}/0/group_cumulative").json()
+            self.assertEqual(data["total"], 7)
+            self.assertNotIn(passcode, main.sectionMatrices)
+
+    def test_row_scores_match_section_matrix(self):
+        rng = random.Random(19)
+        validMask = to_mask(ALLPOSSIBLETIMES)
+        masks = [rng.getrandbits(168) & validMask for i in range(30)]
+        matrix = SectionMatrix(masks)
+        cumulative, consecutive, perDay = row_scores(masks[4], masks)
+        self.assertEqual(cumulative.tolist(), matrix.cumulative[4].tolist())
+        self.assertEqual(consecutive.tolist(), matrix.consecutive[4].tolist())
+        self.assertEqual(perDay.tolist(), matrix.perDay[:, 4].tolist())
+
+    def test_schedule_index_recall(self):
+        rng = random.Random(13)
+        slots = [i for i in ALLPOSSIBLETIMES if i]
+        bases = [rng.sample(slots, 30) for i in range(20)]
+        masks = [to_mask([slot for slot in bases[i % 20] if rng.random() < 0.8]
+                         + rng.sample(slots, 5)) for i in range(2000)]
+        index = ScheduleIndex(masks)
+        found = scored = 0
+        for student_id in range(50):
+            total, neighbours = index.top_k(masks[student_id], 10, count_slots,
+                                            exclude=student_id)
+            exact = sorted(count_slots(masks[student_id] & mask)
+                           for i, mask in enumerate(masks) if i != student_id)
+            found += sum(1 for score, i in neighbours if score >= exact[-10])
+            scored += total
+        self.assertGreaterEqual(found / 500, 0.95)
+        self.assertLess(scored / 50, len(masks) / 4)
+
+    def test_schedule_index_updates_and_fallback(self):
+        rng = random.Random(17)
+        validMask = to_mask(ALLPOSSIBLETIMES)
+        masks = [rng.getrandbits(168) & validMask for i in range(50)]
+        index = ScheduleIndex(masks)
+        index.add_student(0)
+        index.update_student(7, masks[20])
+        total, neighbours = index.top_k(masks[20], 1, count_slots, exclude=20)
+        self.assertEqual(neighbours, [(count_slots(masks[20]), 7)])
+        total, neighbours = index.top_k(masks[20], 51, count_slots, exclude=20)
+        self.assertEqual(total, 50)
+        self.assertEqual(len(neighbours), 50)
+        total, neighbours = ScheduleIndex(masks, exactFallback=False).top_k(0, 5, count_slots)
+        self.assertEqual(neighbours, [])
+
+    def test_event_broker_fan_out(self):
+        async def listen():
+            broker = EventBroker()
+            clients = [broker.subscribe(self.passcode) for i in range(100)]
+            for client in clients:
+                self.assertEqual(await anext(client), b"retry: 3000\n\n")
+            pending = [asyncio.ensure_future(anext(client)) for client in clients]
+            await asyncio.sleep(0)
+            await asyncio.to_thread(broker.publish, self.passcode, "join", {"student_id": 4})
+            await asyncio.to_thread(broker.publish, "CHUM12", "join", {"student_id": 0})
+            frames = await asyncio.gather(*pending)
+            self.assertEqual(set(frames), {b'id: 1\nevent: join\ndata: {"student_id":4}\n\n'})
+            late = broker.subscribe(self.passcode, lastEventId=0)
+            await anext(late)
+            self.assertEqual(await anext(late), frames[0])
+            for i in range(HISTORY_SIZE + 1):
+                broker.publish(self.passcode, "schedule", {"student_id": 1})
+            await asyncio.sleep(0)
+            self.assertIn(b"event: reset", await anext(clients[0]))
+            for client in clients + [late]:
+                await client.aclose()
+            self.assertFalse(broker.has_subscribers(self.passcode))
+        asyncio.run(listen())
+
+    def test_store_versions_grow_with_changes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "groupme.db")
+            stores = [MemoryStore(), SQLiteStore(path, flushInterval=None),
+                      SharedSQLiteStore(os.path.join(directory, "shared.db"))]
+            for store in stores:
+                store.add(self.passcode, SectionRecord("Krusty Krabs", "", 4))
+                before = store.version(self.passcode)
+                with store.transaction(self.passcode) as section:
+                    section.studentList.append(self.studentA)
+                    store.mark_dirty(self.passcode, 0)
+                self.assertGreater(store.version(self.passcode), before)
+                self.assertEqual(store.version("CHUM12"), 0)
+                version = store.version(self.passcode)
+                store.close()
+            self.assertNotEqual(stores[0].epoch, MemoryStore().epoch)
+            reopened = SharedSQLiteStore(os.path.join(directory, "shared.db"))
+            self.assertEqual(reopened.version(self.passcode), version)
+            reopened.close()
+
+    def test_fast_json_encoding(self):
+        rng = random.Random(19)
+        mask = rng.getrandbits(168) & to_mask(ALLPOSSIBLETIMES)
+        content = {"data": {1: {"intersections": SlotMask(mask), "studentADiff": SlotMask(0)}},
+                   "ranking": [("Spongebob", 1.5, "Hello, I am Spongebob.", 1)],
+                   "matrix": SectionMatrix([mask, mask]).cumulative * 0.5}
+        expected = {"data": {"1": {"intersections": [i for i in ALLPOSSIBLETIMES
+                                                     if i in from_mask(mask)],
+                                   "studentADiff": []}},
+                    "ranking": [["Spongebob", 1.5, "Hello, I am Spongebob.", 1]],
+                    "matrix": [[count_slots(mask) * 0.5] * 2] * 2}
+        self.assertEqual(json.loads(encode_json(content)), expected)
+        with patch("serialization.orjson", None):
+            self.assertEqual(json.loads(encode_json(content)), expected)
+
+    def test_hashed_static_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "page.js")
+            with open(path, "w") as file:
+                file.write("let rank = 1;")
+            files = HashedStaticFiles("/assets", directory)
+            url = files.url("page.js")
+            scope = {"type": "http", "method": "GET", "headers": [],
+                     "query_string": url.split("?")[1].encode()}
+            response = asyncio.run(files.get_response("page.js", scope))
+            self.assertEqual(response.headers["cache-control"], IMMUTABLE)
+            with open(path, "w") as file:
+                file.write("let rank = 2;")
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+            self.assertNotEqual(files.url("page.js"), url)
+            response = asyncio.run(files.get_response("page.js", scope))
+            self.assertEqual(response.headers["cache-control"], REVALIDATE)
+
+    def test_sqlite_store_roundtrip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "groupme.db")
+            store = SQLiteStore(path, flushInterval=60)
+            store[self.passcode] = self.section
+            self.studentB.scheduleMask = to_mask({"4-1200-1230"})
+            self.studentB.scheduleVersion = 1
+            store.mark_dirty(self.passcode, 1)
+            store.close()
+
+            reopened = SQLiteStore(path)
+            self.assertNotIn(self.passcode, reopened.sections)
+            self.assertIn(self.passcode, reopened)
+            self.assertNotIn("CHUM12", reopened)
+            section = reopened[self.passcode]
+            self.assertEqual(section.sectionName, "Krusty Krabs")
+            self.assertEqual([i.displayName for i in section.studentList],
+                             ["Mr. Krabs", "Spongebob", "Squidward", "Patrick Star"])
+            self.assertEqual(from_mask(section.studentList[1].scheduleMask), {"4-1200-1230"})
+            self.assertEqual(section.studentList[1].scheduleVersion, 1)
+            self.assertEqual(section.studentList[2].scheduleMask, self.studentC.scheduleMask)
+            reopened.close()
+
+    def test_sqlite_write_behind_survives_failed_flush(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "groupme.db")
+            store = SQLiteStore(path, flushInterval=0.01)
+            writeRows = store._write_rows
+            failures = []
+            def fail_once(sectionRows, studentRows):
+                if not failures:
+                    failures.append(len(studentRows))
+                    raise sqlite3.OperationalError("database is locked")
+                writeRows(sectionRows, studentRows)
+            with patch.object(store, "_write_rows", fail_once), self.assertLogs("storage"):
+                store[self.passcode] = self.section
+                store["BBB222"] = SectionRecord("Chum Bucket", "", 2)
+                store._unload("BBB222")
+                deadline = time.monotonic() + 5
+                while (store.dirty or not failures) and time.monotonic() < deadline:
+                    time.sleep(0.01)
+            self.assertTrue(store.writer.is_alive())
+            self.assertEqual(failures, [4])
+            store.close()
+
+            reopened = SQLiteStore(path, flushInterval=None)
+            self.assertEqual(len(reopened[self.passcode].studentList), 4)
+            reopened.close()
+
+    def test_sqlite_store_unloads_and_expires_sections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "groupme.db")
+            store = SQLiteStore(path, flushInterval=None, ttl=3600, maxResident=1)
+            store["AAA111"] = self.section
+            store["BBB222"] = SectionRecord("Chum Bucket", "", 2)
+            store.lastAccess["AAA111"] -= 60
+            self.assertEqual(store.sweep(), [])
+            self.assertEqual(list(store.resident_sections()), ["BBB222"])
+            section = store["AAA111"]
+            self.assertIsInstance(section.studentList[2], StudentRecord)
+            self.assertEqual(section.studentList[2].scheduleMask, self.studentC.scheduleMask)
+            self.assertGreater(record_bytes(section), 0)
+
+            store.lastAccess["BBB222"] -= 7200
+            self.assertEqual(store.sweep(), ["BBB222"])
+            self.assertNotIn("BBB222", store)
+            self.assertIn("AAA111", store)
+            store.close()
+
+    def test_shared_store_consistent_across_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "groupme.db")
+            store = SharedSQLiteStore(path)
+            store[self.passcode] = SectionRecord("Krusty Krabs", "", 100)
+            self.assertEqual(len(store[self.passcode].studentList), 0)
+
+            workers = [multiprocessing.Process(target=join_shared_section,
+                                               args=(path, self.passcode, worker, 25))
+                       for worker in range(4)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+                self.assertEqual(worker.exitcode, 0)
+
+            studentList = store[self.passcode].studentList
+            self.assertEqual(len(studentList), 100)
+            for worker in range(4):
+                contacts = [i.contactDetails for i in studentList
+                            if i.displayName == f"Worker {worker}"]
+                self.assertEqual(contacts, [str(i) for i in range(25)])
+            store.close()
+
+    def test_shared_store_forgets_sections_expired_by_another_worker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "groupme.db")
+            storeA = SharedSQLiteStore(path, ttl=0.05)
+            storeB = SharedSQLiteStore(path)
+            storeA.add(self.passcode, self.section)
+            self.assertEqual(len(storeB[self.passcode].studentList), 4)
+            time.sleep(0.1)
+            self.assertEqual(storeA.sweep(), [self.passcode])
+            self.assertNotIn(self.passcode, storeB)
+            self.assertEqual(storeB.resident_sections(), {})
+            with storeB.transaction(self.passcode) as section:
+                self.assertIsNone(section)
+            rows = storeB.connection.execute("SELECT COUNT(*) FROM students").fetchone()
+            self.assertEqual(rows[0], 0)
+            storeA.close()
+            storeB.close()
+
+    def test_sweeper_survives_failed_sweep(self):
+        calls = []
+        def sweep():
+            calls.append(1)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+        async def run():
+            sweeper = asyncio.ensure_future(main.sweep_periodically())
+            while len(calls) < 3:
+                await asyncio.sleep(0.01)
+            sweeper.cancel()
+        with patch.object(main, "SWEEP_INTERVAL", 0), patch.object(main, "sweep_sections", sweep), \
+             self.assertLogs("main"):
+            asyncio.run(asyncio.wait_for(run(), 5))
+        self.assertGreaterEqual(len(calls), 3)
+
+    def test_negotiated_responses_vary_on_accept(self):
+        client = TestClient(main.app)
+        passcode = create_app_section(client, 4, [["0-0800-0830"], ["0-0800-0830"]])
+        for url in (f"/api/{passcode}/0/view_schedule", f"/api/{passcode}/0/get_classmate_names",
+                    f"/api/{passcode}/0/group_cumulative", f"/api/{passcode}/similarity_matrix"):
+            response = client.get(url)
+            self.assertEqual(response.headers["vary"], "Accept")
+            etag = response.headers.get("etag")
+            if etag is not None:
+                response = client.get(url, headers={"If-None-Match":etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.headers["vary"], "Accept")
+
+    def test_concurrent_joins_respect_max_size(self):
+        self.assertIsInstance(main.db, MemoryStore)
+        client = TestClient(main.app)
+        passcode = create_app_section(client, 150, [])
+        def join(i):
+            return client.post(f"/api/{passcode}/create_student",
+                               json={"displayName":str(i), "contactDetails":""}).json()
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(join, range(300)))
+        student_ids = [result["student_id"] for result in results if result is not None]
+        self.assertEqual(sorted(student_ids), list(range(150)))
+        studentList = main.db[passcode].studentList
+        self.assertEqual(len(studentList), 150)
+        for result, name in zip(results, range(300)):
+            if result is not None:
+                self.assertEqual(studentList[result["student_id"]].displayName, str(name))
+
+    def test_concurrent_passcode_allocation_is_unique(self):
+        store = MemoryStore()
+        counter = itertools.count()
+        with patch("passcodes.create_passcode", lambda: "AAAAA" + str(next(counter) % 10)):
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                passcodes = list(pool.map(
+                    lambda i: allocate_passcode(lambda passcode: store.add(
+                        passcode, SectionRecord(str(i), "", 1))), range(12)))
+        allocated = [i for i in passcodes if i is not None]
+        self.assertEqual(len(allocated), 10)
+        self.assertEqual(len(set(allocated)), 10)
+        self.assertEqual(passcodes.count(None), 2)
+
+    def test_roster_import_and_export(self):
+        students, errors = read_roster(
+            '{"displayName":"Sandy Cheeks","contactDetails":"Yeehaw!",'
+            '"schedule":["0-0800-0830","0-0830-0900"]}\n'
+            '{"displayName":"Gary","contactDetails":"Meow","schedule":["0-0800-0830"]}\n', False)
+        self.assertEqual(errors, [])
+        self.assertEqual(from_mask(students[0].scheduleMask), {"0-0800-0830", "0-0830-0900"})
+        students, errors = read_roster("displayName,contactDetails,schedule\n"
+                                       "Plankton,,0-0800-0830 7-0800-0830\n"
+                                       ",Karen,\n", True)
+        self.assertEqual(students, [])
+        self.assertEqual(sorted(errors), ["line 2: unknown slots 7-0800-0830",
+                                          "line 3: missing displayName"])
+
+        rows = [(i.displayName, i.contactDetails, i.scheduleMask)
+                for i in self.section.studentList]
+        lines = [json.loads(line) for chunk in export_ndjson(rows) for line in chunk.splitlines()]
+        self.assertEqual([i["displayName"] for i in lines[:4]],
+                         ["Mr. Krabs", "Spongebob", "Squidward", "Patrick Star"])
+        pairs = {(i["student_id"], i["classmate_id"]): i["cumulative"] for i in lines[4:]}
+        self.assertEqual(len(pairs), 6)
+        self.assertEqual(pairs[(0, 1)], 1.5)
+        self.assertEqual(pairs[(0, 2)], 1.0)
+        exported = b"".join(export_csv(rows)).decode()
+        students, errors = read_roster(exported, True)
+        self.assertEqual([i.scheduleMask for i in students],
+                         [i.scheduleMask for i in self.section.studentList])
+
+    def test_synthetic_section_and_baseline(self):
+        section = synthetic_section(200, density=0.25, clusters=2, spread=0.1)
+        self.assertEqual(len(section.studentList), 200)
+        masks = {i.scheduleMask for i in section.studentList}
+        self.assertGreater(len(masks), 2)
+        self.assertTrue(all(0 < count_slots(mask) <= 42 for mask in masks))
+        independent = synthetic_section(50, clusters=0)
+        self.assertEqual(len({i.scheduleMask for i in independent.studentList}), 50)
+
+        baseline = {"a@10": {"opsPerSecond": 100.0}, "b@10": {"opsPerSecond": 100.0}}
+        results = {"a@10": {"opsPerSecond": 60.0}, "b@10": {"opsPerSecond": 40.0},
+                   "c@10": {"opsPerSecond": 1.0}}
+        self.assertEqual(compare_baseline(results, baseline, tolerance=0.5), ["b@10"])
+
+    def test_load_trace_routes_and_percentiles(self):
+        trace = synthetic_trace(sections=2, students=5, updates=1)
+        self.assertEqual(len(trace), 2 + 10 + 10 + 20)
+        self.assertEqual([i["phase"] for i in trace], sorted(i["phase"] for i in trace))
+        self.assertEqual(route_name(trace[2]), "POST /api/{passcode}/create_student")
+        self.assertEqual(trace[2]["path"].format_map({"s0": {"passcode": "ABC123"}}),
+                         "/api/ABC123/create_student")
+        latencies = [i / 1000 for i in range(1, 101)]
+        self.assertEqual(percentile(latencies, 0.5), 0.05)
+        self.assertEqual(percentile(latencies, 0.99), 0.099)
+        summary = summarize({"GET /": {"latencies": latencies, "errors": 1,
+                                       "start": 0.0, "end": 2.0}})
+        self.assertEqual(summary["GET /"]["count"], 100)
+        self.assertAlmostEqual(summary["GET /"]["p95"], 95.0)
+        self.assertEqual(summary["GET /"]["perSecond"], 50.0)
+
+    def test_metrics_histogram_and_timed_stages(self):
+        histogram = Histogram("latency", "Latency.", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, '/a "b"')
+        lines = histogram.exposition().splitlines()
+        self.assertIn('latency_bucket{route="/a \\"b\\"",le="0.1"} 2', lines)
+        self.assertIn('latency_bucket{route="/a \\"b\\"",le="+Inf"} 4', lines)
+        self.assertIn('latency_count{route="/a \\"b\\""} 4', lines)
+
+        @timed("test_recursion")
+        def countdown(n):
+            return n if n == 0 else countdown(n - 1)
+        countdown(5)
+        self.assertEqual(stageSeconds.series[("test_recursion",)][2], 1)
+
+        def idle_worker():
+            time.sleep(0.05)
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        worker = threading.Thread(target=idle_worker)
+        worker.start()
+        worker.join()
+        profiler.stop()
+        self.assertGreater(profiler.samples, 0)
+        self.assertIn("idle_worker", profiler.collapsed())
+
+    def test_slot_registry_interns_section_grids(self):
+        self.assertEqual(DEFAULT_REGISTRY.slots, ALLPOSSIBLETIMES)
+        self.assertIs(slot_registry(15, 1, 2, 9, 11), slot_registry(15, 1, 2, 9, 11))
+        registry = slot_registry(15, 1, 2, 9, 11)
+        self.assertEqual(registry.slots[:2], ["1-0900-0915", "1-0915-0930"])
+        self.assertEqual(len(registry.slots), 2 * 9)
+        masks, invalid = registry.intern_many([["1-0900-0915", "0-0800-0830"], [],
+                                               ["2-1045-1100", "1-0915-0930"]])
+        self.assertEqual(invalid, [["0-0800-0830"], [], []])
+        self.assertEqual(registry.slot_list(masks[2]), ["1-0915-0930", "2-1045-1100"])
+        self.assertRaises(ValueError, registry.intern, ["1-0900-0930"])
+        self.assertEqual(registry.free_windows(masks[2])[1], (2, "2-1045-1100", "2-1045-1100", 1))
+        self.assertRaises(ValueError, Section, sectionName="Chum Bucket", maxSize=4,
+                          slotMinutes=20)
+
+        section = SectionRecord.from_model(Section(
+            sectionName="Chum Bucket", maxSize=4, slotMinutes=15, firstDay=1, lastDay=2,
+            startHour=9, endHour=11, studentList=[
+                Student(displayName="Plankton", contactDetails="", schedule=["1-0900-0915"])]))
+        self.assertIs(section.registry, registry)
+        self.assertRaises(ValueError, StudentRecord.from_model,
+                          Student(displayName="Karen", contactDetails="",
+                                  schedule=["0-0800-0830"]), registry)
+        self.assertEqual(encode_json({"schedule":slot_mask_type(registry)(masks[2])}),
+                         b'{"schedule":["1-0915-0930","2-1045-1100"]}')
+        matrix = SectionMatrix(masks, registry)
+        self.assertEqual(matrix.perDay.shape, (2, 3, 3))
+        self.assertEqual(matrix.consecutive[2, 2], 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "groupme.db")
+            store = SQLiteStore(path, flushInterval=None)
+            store.add(self.passcode, section)
+            store.close()
+            store = SQLiteStore(path, flushInterval=None)
+            self.assertIs(store[self.passcode].registry, registry)
+            self.assertEqual(store[self.passcode].studentList[0].scheduleMask, 1)
+            store.close()
+
+    def test_snapshot_store_restores_sections_lazily(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "groupme.snapshot")
+            store = SnapshotStore(path, saveInterval=None)
+            store.add(self.passcode, self.section)
+            registry = slot_registry(60, 4, 4, 0, 24)
+            store.add("AAA111", SectionRecord("Chum Bucket", "", 2, [
+                StudentRecord("Plankton", "Karen", registry.intern(["4-2300-2400"]), 3)], registry))
+            store.close()
+            snapshot = Snapshot(path)
+            self.assertEqual(snapshot.count, 2)
+            snapshot.close()
+
+            store = SnapshotStore(path, saveInterval=None)
+            self.assertEqual(store.resident_sections(), {})
+            self.assertNotIn("ZZZ999", store)
+            section = store[self.passcode]
+            self.assertEqual(list(store.resident_sections()), [self.passcode])
+            self.assertEqual([(i.displayName, i.scheduleMask) for i in section.studentList],
+                             [(i.displayName, i.scheduleMask) for i in self.section.studentList])
+            with store.transaction(self.passcode) as section:
+                section.studentList[0].scheduleVersion += 1
+                store.mark_dirty(self.passcode, 0)
+            store.close()
+
+            store = SnapshotStore(path, saveInterval=None)
+            self.assertEqual(store[self.passcode].studentList[0].scheduleVersion, 1)
+            section = store["AAA111"]
+            self.assertIs(section.registry, registry)
+            self.assertEqual(registry.slot_list(section.studentList[0].scheduleMask),
+                             ["4-2300-2400"])
+            store.ttl = 60
+            self.assertEqual(store.sweep(), [])
+            store.lastAccess["AAA111"] = 0
+            self.assertEqual(store.sweep(), ["AAA111"])
+            store.close()
+            store = SnapshotStore(path, saveInterval=None)
+            self.assertNotIn("AAA111", store)
+            self.assertIn(self.passcode, store)
+            store.close()
+
+    def test_top_ranked_pages_match_full_sort(self):
+        rng = random.Random(23)
+        section = SectionRecord("Lecture Hall", "", 60, [StudentRecord(str(i), "")
+                                                         for i in range(60)])
+        scores = np.array([rng.randrange(6) for i in range(60)])
+        for minScore in (0, 1.5):
+            expected = sorted(((-score, i) for i, score in enumerate(scores.tolist())
+                               if i != 7 and score * 0.5 >= minScore))
+            expected = [(str(i), -score * 0.5, "", i) for score, i in expected]
+            total, ranked = top_ranked(section, scores, 7, minScore=minScore)
+            self.assertEqual((total, ranked), (len(expected), expected))
+            pages = [top_ranked(section, scores, 7, 10, offset, minScore)
+                     for offset in range(0, 70, 10)]
+            self.assertTrue(all(total == len(expected) for total, page in pages))
+            self.assertEqual(sum((page for total, page in pages), []), expected)
+        ties = [i for name, hours, contact, i in ranked if hours == ranked[0][1]]
+        self.assertEqual(ties, sorted(ties))
+        self.assertEqual(top_ranked(section, scores, 7, 5, 100), (59, []))
+
+    def test_schedule_intersections_across_classmates(self):
+        self.section.studentList.append(StudentRecord("Gary", "Meow"))
+        intersections = schedule_intersections(self.section.studentList, 0,
+                                               parse_classmate_ids("all", 5, 0))
+        self.assertEqual(list(intersections), [1, 2, 3])
+        self.assertEqual(from_mask(intersections[2]["intersections"]),
+                         {"0-0800-0830", "0-0900-0930"})
+        self.assertEqual(from_mask(intersections[2]["studentADiff"]), {"0-0830-0900"})
+        self.assertEqual(from_mask(intersections[2]["studentBDiff"]), {"0-1000-1030"})
+        self.assertEqual(intersections[1]["studentBDiff"], 0)
+        self.assertEqual(schedule_intersections(self.section.studentList, 4, [0, 1]), {})
+
+    def test_parse_classmate_ids(self):
+        self.assertEqual(parse_classmate_ids("all", 4, 1), [0, 2, 3])
+        self.assertEqual(parse_classmate_ids("all", 4), [0, 1, 2, 3])
+        self.assertEqual(parse_classmate_ids("3,0,3,2,0", 4, 1), [3, 0, 2])
+        for malformed in ("4", "-1", "1,,2", "1;2", "", "one", "1.5"):
+            self.assertIsNone(parse_classmate_ids(malformed, 4, 1))
+
+    def test_single_flight_coalesces_and_survives_cancelled_callers(self):
+        async def run():
+            flights = SingleFlight()
+            started = []
+            release = asyncio.Event()
+            async def compute():
+                started.append(1)
+                await release.wait()
+                return "ranking"
+            callers = [asyncio.ensure_future(flights.run("key", compute)) for i in range(5)]
+            await asyncio.sleep(0)
+            callers[0].cancel()
+            await asyncio.sleep(0)
+            release.set()
+            results = await asyncio.gather(*callers[1:])
+            self.assertTrue(callers[0].cancelled())
+            self.assertEqual(results, ["ranking"] * 4)
+            self.assertEqual(started, [1])
+            self.assertEqual(flights.shared, 4)
+            self.assertEqual(flights.calls, {})
+            self.assertEqual(await flights.run("key", compute), "ranking")
+            self.assertEqual(started, [1, 1])
+        asyncio.run(run())
+
+    def test_section_admission_rejects_beyond_queue(self):
+        async def run():
+            release = threading.Event()
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                admission = SectionAdmission(executor, 1, 2)
+                admitted = [asyncio.ensure_future(admission.run(self.passcode, release.wait, 5))
+                            for i in range(3)]
+                await asyncio.sleep(0)
+                with self.assertRaises(SectionBusy):
+                    await admission.run(self.passcode, release.wait, 5)
+                self.assertEqual(await admission.run("CHUM12", len, "other"), 5)
+                release.set()
+                self.assertEqual(await asyncio.gather(*admitted), [True] * 3)
+                self.assertEqual(admission.rejected, 1)
+                self.assertEqual(admission.sections, {})
+        asyncio.run(run())
+
+    def test_partition_section_recovers_clusters(self):
+        days = [["0-0800-0830", "0-0830-0900"], ["2-1000-1030", "2-1030-1100"],
+                ["4-1300-1330", "4-1330-1400"]]
+        rng = random.Random(3)
+        masks = [to_mask(days[i % 3] + rng.sample(ALLPOSSIBLETIMES[100:120], 2))
+                 for i in range(9)]
+        for method in ("cumulative", "consecutive"):
+            groups, scores = partition_section(masks, 3, method, timeBudget=5)
+            self.assertEqual(sorted(sorted(group) for group in groups),
+                             [[0, 3, 6], [1, 4, 7], [2, 5, 8]])
+            self.assertTrue(all(score >= 2 for score in scores))
+
+    def test_partition_section_process_pool(self):
+        rng = random.Random(5)
+        masks = [rng.getrandbits(168) & to_mask(ALLPOSSIBLETIMES) for i in range(10)]
+        groups, scores = partition_section(masks, 4, timeBudget=1, workers=2)
+        self.assertEqual([len(group) for group in groups], [4, 4, 2])
+        self.assertEqual(sorted(sum(groups, [])), list(range(10)))
+        for workers in (0, 2):
+            groups, scores = asyncio.run(partition_section_async(masks, 4, timeBudget=1,
+                                                                 workers=workers))
+            self.assertEqual(sorted(sum(groups, [])), list(range(10)))
+        for partition in (partition_section, lambda *args, **options: asyncio.run(
+                partition_section_async(*args, **options))):
+            broken = get_pool(2)
+            self.assertRaises(BrokenProcessPool, broken.submit(os._exit, 1).result)
+            groups, scores = partition(masks, 4, timeBudget=1, workers=2)
+            self.assertEqual(sorted(sum(groups, [])), list(range(10)))
+            self.assertIsNot(get_pool(2), broken)
+        shutdown_pool()
+
 #Copy-pasted relevant functions to test, which use global variable db.
 
 ALLPOSSIBLETIMES = [
@@ -179,7 +923,7 @@ def validate_student(passcode : str, student_id : int):
 def similar_hours_cumultative(currentStudent: Student, currentSection: Section):
     similarHours = []
     rankingList = currentSection.studentList
-    studentSched = currentStudent.schedule
+    studentSched = from_mask(currentStudent.scheduleMask)
     try:
         current_student_id = rankingList.index(currentStudent)
     except ValueError:
@@ -187,7 +931,7 @@ def similar_hours_cumultative(currentStudent: Student, currentSection: Section):
 
     for student_id, student in enumerate(rankingList):
         if student_id != current_student_id:
-            comparedSched = student.schedule
+            comparedSched = from_mask(student.scheduleMask)
             similarSched = studentSched.intersection(comparedSched)
             similarHours.append((student.displayName, len(similarSched) * 0.5,
                                  student.contactDetails, student_id))
@@ -196,7 +940,7 @@ def similar_hours_cumultative(currentStudent: Student, currentSection: Section):
 def similar_hours_consecutive(currentStudent: Student, currentSection: Section):
     allStudentsChunks = []
     rankingList = currentSection.studentList
-    studentSched = currentStudent.schedule
+    studentSched = from_mask(currentStudent.scheduleMask)
     try:
         current_student_id = rankingList.index(currentStudent)
     except ValueError:
@@ -204,7 +948,7 @@ def similar_hours_consecutive(currentStudent: Student, currentSection: Section):
 
     for student_id, student in enumerate(rankingList):
         if student_id != current_student_id:
-            comparedSched = student.schedule
+            comparedSched = from_mask(student.scheduleMask)
             currentLength = 0
             maxLength = 0
             for slot in ALLPOSSIBLETIMES:
@@ -262,7 +1006,7 @@ def api_view_schedule(passcode : str, student_id : int):
     if validate_student(passcode, student_id):
         section = db[passcode]
         student = section.studentList[student_id]
-        schedule = student.schedule
+        schedule = from_mask(student.scheduleMask)
         return {'schedule':schedule}
 
 def api_update_schedule(passcode : str, student_id : int, update : ScheduleUpdate):
@@ -270,7 +1014,7 @@ def api_update_schedule(passcode : str, student_id : int, update : ScheduleUpdat
         section = db[passcode]
         student = section.studentList[student_id]
         schedule = update.schedule
-        student.schedule = set(schedule)
+        student.scheduleMask = to_mask(schedule)
         return {'result':'success'}
     return {'result':'error'}
 